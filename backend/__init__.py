@@ -25,6 +25,10 @@ AUTH_TEST_CREDS = AUTH_TEST_CREDS.split(',') if AUTH_TEST_CREDS else []
 POOL_NODES = os.environ.get('POOL_NODES', None)
 POOL_NODES = POOL_NODES.split(',') if POOL_NODES else []
 
+ENVOY_ADMIN_URL = os.environ.get(
+    'ENVOY_ADMIN_URL',
+    'http://titan-emulator-envoy:19000')
+
 USER_GROUP_NAME = os.environ.get('USER_GROUP_NAME', None)
 USER_GROUP_NAME = set(
     map(str.strip,
@@ -5,12 +5,14 @@ import requests
 import yaml
 import logging
 from itertools import groupby
+from concurrent.futures import Future
 from flask import Flask, request, jsonify, render_template
 from flask_login import login_required, current_user
-from flask_socketio import SocketIO
+from flask_socketio import SocketIO, join_room
 from werkzeug.utils import redirect
 
 import emulator
+from emulator import metrics
 from backend.utility import utility
 
 from emulator import HOSTNAME, MAX_INSTANCES_PER_USER
@@ -27,12 +29,21 @@ from backend.errors import MAX_INSTANCES_PER_USER_ERROR
 from backend.errors import UPLOAD_CONNECTION_ERROR
 from backend.errors import MAX_INSTANCES_REACHED_ERROR
 from backend.errors import DELETE_IMAGE_ERROR
+from backend.errors import LAUNCH_FAILED_ERROR
 
 from backend.scheduler import Scheduler
 from backend.envoy_config import add_envoy_route
 from backend.envoy_config import remove_envoy_route
+from backend.envoy_stats import cluster_stats
 
 from node.master import PoolMananger
+from node.jobs import JobQueue
+from node.fairshare import FairShareQueue
+from node.fairshare import resolve
+from node.leases import LeaseKeeper
+from node.idle import IdleDetector
+from node import LEASE_WARNING
+from node import IDLE_POLICY
 
 logger = logging.getLogger(__name__)
 
@@ -45,6 +56,96 @@ app = Flask(__name__)
 socketio = SocketIO(app)
 
 
+def launch_job_event(job):
+    ''' Sends launch job progress to the room of the user launched it '''
+    socketio.emit('stage', with_error(job), namespace='/launch',
+                  room=job['owner'])
+
+
+def with_error(job):
+    ''' Sets the result of failed job to the error shown in UI '''
+    if job['state'] == 'failed':
+        job['result'] = {'error': LAUNCH_FAILED_ERROR}
+    return job
+
+
+launch_jobs = JobQueue(on_event=launch_job_event)
+# launches waiting in the launch queue are run by the launch workers
+# once dispatched
+launch_queue = FairShareQueue(run=launch_jobs.execute)
+emulator.on_change(launch_queue.freed)
+
+
+def instance_ready_event(info, boot_time):
+    ''' Sends the instance booted on any node of the pool to the room of
+        its owner, the owner is the prefix the instance was launched with '''
+    socketio.emit('ready', {'id': info['ident'], 'boot_time': boot_time},
+                  namespace='/launch', room=owner_name(info['owner']))
+
+
+emulator_iface.on_ready(instance_ready_event)
+
+
+def owner_name(owner):
+    ''' Returns the user name of the instance owner, the owner is the
+        prefix the instance containers were launched with '''
+    owner = owner or ''
+    for suffix in ('_cockpit_', '_'):
+        if owner.endswith(suffix):
+            return owner[:-len(suffix)]
+    return owner
+
+
+def stop_instance(ident, inst):
+    ''' Stops the instance and removes its envoy route '''
+    logger.info('stopping instance {} {}'.format(
+        inst['id'], inst['image_name']))
+    emulator_iface.stop_container(int(inst['id']))
+    launch_queue.freed()
+    hostname = inst['hostname'] + '.' + DOMAINNAME
+    remove_envoy_route(ident, hostname, int(inst['port']))
+
+
+def lease_warning_event(ident, inst, lease):
+    ''' Warns the owner the lease of the instance is about to expire '''
+    socketio.emit('lease', {'id': ident, 'shown_id': int(ident) + 1,
+                            'expires_at': lease['expires_at']},
+                  namespace='/launch', room=owner_name(inst.get('owner')))
+
+
+leases = LeaseKeeper(emulator_iface.list_containers, stop_instance,
+                     on_warning=lease_warning_event,
+                     reported=emulator_iface.reported)
+leases.start()
+
+
+def instance_idle_event(ident, inst):
+    ''' Applies the idle policy to the instance nobody uses: pauses it
+        or cuts its lease, so it is stopped unless the owner extends it '''
+    if IDLE_POLICY == 'pause':
+        emulator_iface.pause_container(ident)
+    elif IDLE_POLICY == 'stop':
+        leases.shorten(ident, LEASE_WARNING)
+
+
+def instance_active_event(ident, inst):
+    ''' Unpauses the idle instance used again '''
+    if IDLE_POLICY == 'pause':
+        emulator_iface.pause_container(ident, paused=False)
+
+
+idle_instances = IdleDetector(emulator_iface.list_containers, cluster_stats,
+                              instance_idle_event, instance_active_event,
+                              reported=emulator_iface.reported)
+idle_instances.start()
+
+
+def owned_by(inst, username):
+    ''' Checks if the instance is launched by the user, the owner
+        is the prefix the instance containers were launched with '''
+    return inst.get('owner') in (username + '_', username + '_cockpit_')
+
+
 @app.route('/')
 @login_required
 def index():
@@ -89,7 +190,7 @@ def index():
 
     instances = [inst for ident, inst in instances.items()]
     if not is_admin:
-        instances = [inst for inst in instances if username in inst['childs']]
+        instances = [inst for inst in instances if owned_by(inst, username)]
     for inst in instances:
         inst['shown_id'] = int(inst['id']) + 1
         inst['image_name'] = inst.get('image_name').upper()
@@ -102,19 +203,18 @@ def index():
     devices = emulator.lsusb(remote_addr)
     ivi_instances = [
         i for i in instances
-        if "_emulator_titan_"
-        in i['childs'] and "cockpit" not in i['childs']]
+        if i['role'] == 'titan' and not i['pair']]
     cluster_instances = [
         i for i in instances
-        if "_emulator_cluster_"
-        in i['childs'] and "cockpit" not in i['childs']]
-    cockpit_instances = [i for i in instances
-                         if "cockpit" in i['childs']]
+        if i['role'] == 'cluster' and not i['pair']]
+    cockpit_instances = [i for i in instances if i['pair']]
     if cockpit_instances:
-        cockpit_instances_network_sorted = sorted(
-            cockpit_instances, key=lambda x: x['net_name'])
+        cockpit_instances_pair_sorted = sorted(
+            cockpit_instances,
+            key=lambda x: (x['hostname'], x['pair'], x['role'] != 'titan'))
         for key, value in groupby(
-                cockpit_instances_network_sorted, key=lambda x: x['net_name']):
+                cockpit_instances_pair_sorted,
+                key=lambda x: (x['hostname'], x['pair'])):
             running_cockpit_instance_pair.append(list(value))
     cluster_remote_images = [
         i for i in remote_images
@@ -154,6 +254,7 @@ def launch(image_name):
     devices = []
     requested_devices = request.args.get('devs')
     cluster_name = request.args.get('cluster')
+    priority = request.args.get('priority', 'interactive')
     username = str(current_user).split('@')[0]
 
     logger.info('request to launch image {} with devs {} from user {}'.format(
@@ -178,24 +279,87 @@ def launch(image_name):
 
     instances = emulator_iface.list_containers()
     owned_instances = len([v for k, v in instances.items()
-                           if username in v.get('childs')])
+                           if owned_by(v, username)])
+    owned_instances += launch_jobs.pending(username)
     if owned_instances >= int(MAX_INSTANCES_PER_USER):
         logger.error('max number of launched images is reached: {}'
                      .format(owned_instances))
         return jsonify({'error': MAX_INSTANCES_PER_USER_ERROR})
 
+    job_id = launch_jobs.submit(
+        launch_instance, image_name, devices, username, cluster_name,
+        priority, owner=username)
+    return jsonify({'job': job_id})
+
+
+@app.route('/metrics')
+@login_required
+def pool_metrics():
+    return jsonify({**metrics.snapshot(),
+                    'inventory_cache': emulator_iface.cache.stats(),
+                    'launch_queue': len(launch_queue.waiting()),
+                    'idle_instances': idle_instances.idle(),
+                    'nodes': [{**node, 'state': str(node['state'])}
+                              for node in emulator_iface.__nodes_info__()]})
+
+
+@app.route('/launch/job/<job_id>')
+@login_required
+def launch_job(job_id):
+    username = str(current_user).split('@')[0]
+    job = launch_jobs.get(job_id)
+    if job is None or job['owner'] != username:
+        return jsonify({})
+    return jsonify(with_error(job))
+
+
+@socketio.on('connect', namespace='/launch')
+def launch_connect():
+    if not current_user.is_authenticated:
+        return False
+    join_room(str(current_user).split('@')[0])
+
+
+def launch_instance(progress, image_name, devices, username, cluster_name,
+                    priority):
+    ''' Launch job: starts the instance, or cockpit pair if cluster_name
+        is given, and adds envoy routes to it. The instance waits in the
+        launch queue in its turn if the pool is full, no worker is held
+        meanwhile. Returns the instance as shown in UI or error, Future of
+        it for the instance launched through the queue '''
     if cluster_name is not None:
+        progress('placed', node=0)
         ident = emulator.start_image(
-            image_name, devices, username + '_cockpit_', cluster_name)
-    else:
+            image_name, devices, username + '_cockpit_', cluster_name,
+            progress=progress)
+        emulator_iface.invalidate()  # launched bypassing the pool
+        if ident is None:
+            return {'error': MAX_INSTANCES_REACHED_ERROR}
+        return launched(ident, username, cockpit=True)
+
+    def attempt():
         ident = emulator_iface.start_image(
-            image_name, devices, username + '_')
+            image_name, devices, username + '_', progress=progress)
+        return None if ident is None else launched(ident, username)
 
-    if ident is None:
-        return jsonify({'error': MAX_INSTANCES_REACHED_ERROR})
+    def queued(done):
+        if done.exception() is None and done.result() is None:
+            result.set_result({'error': MAX_INSTANCES_REACHED_ERROR})
+        else:
+            resolve(result, done)
+
+    # the job is finished once the launch is served by the queue
+    result = Future()
+    launch_queue.submit(
+        username, priority, attempt, progress).add_done_callback(queued)
+    return result
 
+
+def launched(ident, username, cockpit=False):
+    ''' Adds envoy routes to the instance launched and leases it. Returns
+        the instance as shown in UI '''
     instances = emulator_iface.list_containers()
-    if cluster_name is not None:
+    if cockpit:
         ivi_inst = instances[ident[0]]
         cluster_inst = instances[ident[1]]
         ivi_inst['image_name'] = ivi_inst.get('image_name').upper()
@@ -208,7 +372,9 @@ def launch(image_name):
         hostname = ivi_inst['hostname'] + '.' + DOMAINNAME
         add_envoy_route(ident[0], hostname, int(ivi_inst['port']))
         add_envoy_route(ident[1], hostname, int(cluster_inst['port']))
-        return jsonify(inst)
+        inst['lease'] = leases.grant(ident[0], username)
+        leases.grant(ident[1], username)
+        return inst
     else:
         inst = instances[ident]
         inst['shown_id'] = int(inst['id']) + 1
@@ -217,7 +383,8 @@ def launch(image_name):
 
         hostname = inst['hostname'] + '.' + DOMAINNAME
         add_envoy_route(ident, hostname, int(inst['port']))
-        return jsonify(inst)
+        inst['lease'] = leases.grant(ident, username)
+        return inst
 
 
 @app.route('/stop/<ident>')
@@ -232,17 +399,29 @@ def stop(ident):
 
     for inst in instances:
         if int(inst['id']) == int(ident):
-            logger.info('stopping instance {} {}'.format(
-                inst['id'], inst['image_name']))
-            emulator_iface.stop_container(int(inst['id']))
+            stop_instance(ident, inst)
             break
 
-    hostname = inst['hostname'] + '.' + DOMAINNAME
-    remove_envoy_route(ident, hostname, int(inst['port']))
-
     return '{}'
 
 
+@app.route('/lease/<int:ident>/extend')
+@login_required
+def extend_lease(ident):
+    username = str(current_user).split('@')[0]
+    seconds = request.args.get('seconds', type=float)
+    logger.info('request to extend lease of instance {} from user {}'.format(
+        ident, username))
+
+    inst = emulator_iface.list_containers().get(ident)
+    if inst is None or not owned_by(inst, username):
+        return jsonify({'error': 'instance not found'}), 404
+    lease = leases.extend(ident, seconds)
+    if lease is None:
+        return jsonify({'error': 'instance not leased'}), 404
+    return jsonify(lease)
+
+
 @app.route('/attach/<addr>/<bus_id>')
 @login_required
 def attach(addr, bus_id):
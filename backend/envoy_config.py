@@ -73,8 +73,8 @@ def remove_cds_resource(resources, ident, hostname, port):
 
 
 def add_lds_route(routes, ident):
-    if [r for r in routes if r['match'].get('prefix') and
-            f'instance/{ident}' in r['match']['prefix']]:
+    prefix = format_route(ident)[0]['match']['prefix']
+    if [r for r in routes if r['match'].get('prefix') == prefix]:
         logger.info('routes for instance {} '
                     'is already in config'.format(ident))
         return routes
@@ -87,8 +87,8 @@ def add_lds_route(routes, ident):
 
 
 def remove_lds_route(routes, ident):
-    if not [r for r in routes if r['match'].get('prefix') and
-            f'instance/{ident}' in r['match']['prefix']]:
+    prefix = format_route(ident)[0]['match']['prefix']
+    if not [r for r in routes if r['match'].get('prefix') == prefix]:
         logger.info('no routes for instance {} '.format(ident))
         return routes
 
@@ -0,0 +1,32 @@
+import re
+import logging
+import requests
+
+from backend import ENVOY_ADMIN_URL
+
+logger = logging.getLogger(__name__)
+
+'''Counters of the instance clusters showing traffic to the instance'''
+TRAFFIC_COUNTERS = ['upstream_cx_active', 'upstream_cx_total',
+                    'upstream_cx_rx_bytes_total', 'upstream_cx_tx_bytes_total',
+                    'upstream_rq_total']
+
+STAT_PATTERN = re.compile(r'^cluster\.isntance(\d+)\.(\w+): (\d+)$')
+
+
+def cluster_stats(admin_url=ENVOY_ADMIN_URL, timeout=5):
+    ''' Scrapes the admin interface of envoy for the traffic counters of
+        the clusters routed to instances by add_envoy_route.
+        Returns dict of instance ident: dict of counter: value '''
+    req = requests.get(admin_url + '/stats', params={
+        'filter': r'^cluster\.isntance\d+\.({})$'.format(
+            '|'.join(TRAFFIC_COUNTERS))}, timeout=timeout)
+    req.raise_for_status()
+
+    stats = {}
+    for line in req.text.splitlines():
+        match = STAT_PATTERN.match(line.strip())
+        if match:
+            ident, counter, value = match.groups()
+            stats.setdefault(int(ident), {})[counter] = int(value)
+    return stats
@@ -25,3 +25,9 @@ UPLOAD_CONNECTION_ERROR = dict(
     reason='Connection upload server error!',
     description='Uploading is not possible, '
                 'please check network connection ')
+
+'''Launch job failed'''
+LAUNCH_FAILED_ERROR = dict(
+    reason='Launch failed!',
+    description='The instance could not be started, '
+                'please try again later')
@@ -6,8 +6,12 @@ list_images = emulator.list_images
 list_containers = emulator.list_containers
 start_image = emulator.start_image
 stop_container = emulator.stop_container
+pause_container = emulator.pause_container
 pull = emulator.pull
 delete_image = emulator.delete_image
 lsusb = emulator.lsusb
 attach = emulator.attach
 detach = emulator.detach
+probe_readiness = emulator.probe_readiness
+on_ready = emulator.on_ready
+on_change = emulator.on_change
@@ -0,0 +1,191 @@
+import logging
+import threading
+from collections import deque
+
+from emulator import INSTANCE_ID_LIMIT
+from emulator import GRPC_PORT_RANGE
+from emulator import SHELL_PORT_RANGE
+from emulator import TELNET_PORT_RANGE
+from emulator import HOST_PROC_PATH
+from emulator.reservations import ReservationStore
+
+logger = logging.getLogger(__name__)
+
+
+class IdAllocator:
+    ''' Allocates instance ids on the node. Ids released by stopped
+        instances go to the tail of a free list and are reused in
+        the order they were freed, which gives docker time to remove
+        the auto-removed containers of the previous owner of the id.
+        An acquired id is reserved in the store shared with the other
+        processes of the node, so the launch has time to create its
+        containers before the id shows up in the containers inventory.
+        The ids reserved by the other processes are skipped. '''
+    def __init__(self, limit=INSTANCE_ID_LIMIT, store=None):
+        self.limit = limit
+        self.store = store or ReservationStore()
+        self.__lock = threading.Lock()
+        self.__next = 0           # lowest id never handed out
+        self.__free = deque()     # released ids below __next
+        self.__in_use = set()
+
+    def acquire(self):
+        ''' Returns the next free id or None if all ids are in use '''
+        with self.__lock:
+            ident = self.store.reserve('id', self.__pick)
+            if ident is None:
+                logger.warning('no free instance ids left')
+                return None
+            self.__take(ident)
+            return ident
+
+    def release(self, ident):
+        ''' Returns the id to the free list '''
+        with self.__lock:
+            self.store.release('id', ident)
+            if ident not in self.__in_use:
+                return
+            self.__in_use.discard(ident)
+            self.__free.append(ident)
+
+    def sync(self, idents):
+        ''' Rebuilds the allocator from the ids found running, ids
+            reserved by recent launches are kept '''
+        with self.__lock:
+            in_use = set(idents) | self.store.reserved('id')
+            self.__next = max(in_use) + 1 if in_use else 0
+            free = [ident for ident in self.__free
+                    if ident not in in_use and ident < self.__next]
+            known = set(free)
+            free += [ident for ident in range(self.__next)
+                     if ident not in in_use and ident not in known]
+            self.__free = deque(free)
+            self.__in_use = in_use
+
+    def __pick(self, reserved):
+        ''' Returns the next id not reserved by anyone, the reserved ones
+            are in use by launches of the other processes. Called in the
+            store transaction, so the allocator is not changed here '''
+        for ident in self.__free:
+            if ident not in reserved:
+                return ident
+        for ident in range(self.__next, self.limit):
+            if ident not in reserved:
+                return ident
+        return None
+
+    def __take(self, ident):
+        ''' Marks the id reserved in the store as used, the ids reserved
+            by the others skipped on the way to it are known again after
+            the next sync '''
+        if ident < self.__next:
+            self.__free.remove(ident)
+        else:
+            self.__next = ident + 1
+        self.__in_use.add(ident)
+
+
+class PortAllocator:
+    ''' Allocates host port triples (grpc, shell, telnet) for instances.
+        Slot N of the allocator stands for the Nth port of each of the
+        three port ranges, busy slots are kept as bits of an integer, so
+        looking up the lowest free slot takes a couple of operations on
+        the bitmap. Slots whose ports are bound on the host by someone
+        else are kept in a separate bitmap refreshed by sync().
+        An acquired slot is reserved in the store shared with the other
+        processes of the node, same as instance ids. '''
+    def __init__(self, grpc_ports=GRPC_PORT_RANGE,
+                 shell_ports=SHELL_PORT_RANGE,
+                 telnet_ports=TELNET_PORT_RANGE,
+                 store=None):
+        self.ranges = [parse_port_range(r) for r in
+                       (grpc_ports, shell_ports, telnet_ports)]
+        self.size = min([len(r) for r in self.ranges])
+        self.store = store or ReservationStore()
+        self.__lock = threading.Lock()
+        self.__used = 0           # bitmap of slots allocated by us
+        self.__foreign = 0        # bitmap of slots bound by others
+
+    def acquire(self):
+        ''' Returns a free (grpc, shell, telnet) port triple or None
+            if all ports of the ranges are busy '''
+        with self.__lock:
+            slot = self.store.reserve('port', self.__pick)
+            if slot is None:
+                logger.warning('no free host ports left')
+                return None
+            self.__used |= 1 << slot
+            return self.__ports(slot)
+
+    def release(self, ports):
+        ''' Returns the slot of the ports dict given as
+            {'grpc': port, 'shell': port, 'telnet': port} '''
+        slot = self.__slot(ports)
+        if slot is None:
+            return
+        with self.__lock:
+            self.store.release('port', slot)
+            self.__used &= ~(1 << slot)
+
+    def sync(self, ports_in_use, bound_ports=None):
+        ''' Rebuilds the bitmaps from the ports of running instances
+            and from the ports bound on the host, slots reserved by recent
+            launches are kept '''
+        slots = [self.__slot(ports) for ports in ports_in_use]
+        bound_ports = bound_ports if bound_ports is not None \
+            else host_bound_ports()
+        with self.__lock:
+            used = 0
+            for slot in slots + list(self.store.reserved('port')):
+                if slot is not None:
+                    used |= 1 << slot
+            foreign = 0
+            for port_range in self.ranges:
+                for port in bound_ports:
+                    if port in port_range:
+                        foreign |= 1 << port_range.index(port)
+            self.__used = used
+            self.__foreign = foreign & ~used
+
+    def __pick(self, reserved):
+        ''' Returns the lowest slot neither busy nor reserved by anyone.
+            Called in the store transaction, so the bitmaps are not
+            changed here '''
+        busy = self.__used | self.__foreign
+        for slot in reserved:
+            busy |= 1 << slot
+        slot = (~busy & (busy + 1)).bit_length() - 1
+        return slot if slot < self.size else None
+
+    def __ports(self, slot):
+        return tuple(port_range[slot] for port_range in self.ranges)
+
+    def __slot(self, ports):
+        port_range = self.ranges[0]
+        if ports.get('grpc') not in port_range:
+            return None
+        slot = port_range.index(ports['grpc'])
+        return slot if slot < self.size else None
+
+
+def parse_port_range(port_range):
+    ''' Turns the range given as 'first-last' into range object '''
+    first, last = port_range.split('-')
+    return range(int(first), int(last) + 1)
+
+
+def host_bound_ports(proc_path=HOST_PROC_PATH):
+    ''' Returns the set of tcp ports listened on the host. The host's
+        /proc should be mounted into the container at proc_path, else
+        only the ports of the container network namespace are seen '''
+    ports = set()
+    for name in ['tcp', 'tcp6']:
+        try:
+            with open('{}/1/net/{}'.format(proc_path, name)) as f:
+                for line in f.readlines()[1:]:
+                    fields = line.split()
+                    if fields[3] == '0A':  # TCP_LISTEN
+                        ports.add(int(fields[1].split(':')[-1], 16))
+        except Exception as e:
+            logger.info('failed to read bound ports: {}'.format(e))
+    return ports
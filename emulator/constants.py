@@ -1,5 +1,6 @@
 import os
 import socket
+import tempfile
 
 ''' If running within docker, the host name must be pass as env var'''
 HOSTNAME = os.environ.get('HOSTNAME', socket.gethostname())
@@ -48,10 +49,52 @@ SCHEDULER_JOB_MINUTE = os.environ.get('SCHEDULER_JOB_MINUTE', 30)
 NUM_OF_REMOTE_IMAGES_PER_CAT = os.environ.get(
     'NUM_OF_REMOTE_IMAGES_PER_CAT', 5)
 
-'''Baseline for port ranging'''
-GRPC_PORT_BASE = 8443
-SHELL_PORT_BASE = 9555
-TELNET_PORT_BASE = 10555
+'''Labels stamped on emulator containers, the inventory relies on them
+   to recognize emulator containers and to learn instance metadata'''
+LABEL_PREFIX = 'com.harman.titan-emulator.'
+LABEL_INSTANCE = LABEL_PREFIX + 'instance'
+LABEL_ROLE = LABEL_PREFIX + 'role'
+LABEL_OWNER = LABEL_PREFIX + 'owner'
+LABEL_PAIR = LABEL_PREFIX + 'pair'
+LABEL_PORTS = LABEL_PREFIX + 'ports'
+LABEL_DEVICES = LABEL_PREFIX + 'devices'
+LABEL_NETWORK_POOL = LABEL_PREFIX + 'network-pool'
+
+'''Host port ranges given as first-last, the ports of an instance are
+   allocated from them. The Nth ports of the three ranges go together,
+   so the number of instances is limited by the shortest range'''
+GRPC_PORT_RANGE = os.environ.get('GRPC_PORT_RANGE', '8443-9442')
+SHELL_PORT_RANGE = os.environ.get('SHELL_PORT_RANGE', '9555-10554')
+TELNET_PORT_RANGE = os.environ.get('TELNET_PORT_RANGE', '10555-11554')
+
+'''Mount point of host's /proc, used to skip host ports already bound'''
+HOST_PROC_PATH = os.environ.get('HOST_PROC_PATH', '/proc')
+
+'''Instance ids on a node are below this limit. The pool encodes
+   the node into instance id by multiplying node index by the limit'''
+INSTANCE_ID_LIMIT = 1000
+
+'''Sqlite database of the id and ports reservations, shared by all
+   processes launching instances on the node. Reservations are tied
+   to process ids, so the processes sharing it must run in the same
+   pid namespace (container)'''
+RESERVATION_DB = os.environ.get(
+    'RESERVATION_DB',
+    os.path.join(tempfile.gettempdir(), 'titan-emulator-reservations.db'))
+
+'''Number of spare per-instance networks kept created in advance,
+   launches lease them and get them back once the instance is gone'''
+NETWORK_POOL_SIZE = int(os.environ.get('NETWORK_POOL_SIZE', 4))
+NETWORK_POOL_PREFIX = 'emulator_envoymesh_pool_'
+
+'''Networking of instances: isolated gives every instance a network of
+   its own, shared puts all single instances into one network. Cockpit
+   pairs get a network of their own in both modes'''
+NETWORK_MODE = os.environ.get('NETWORK_MODE', 'isolated')
+SHARED_NETWORK_NAME = 'emulator_envoymesh_shared'
+
+'''Seconds a stopped container is given to exit before it is killed'''
+STOP_GRACE_TIMEOUT = int(os.environ.get('STOP_GRACE_TIMEOUT', 5))
 
 ''' TURN configuration. Note that cloud setup requires TURN server to
     make it possible to establish WebRTC connections towards emulator.'''
@@ -72,4 +115,31 @@ TURN_EMU_CFG = 'printf {\"iceServers\":[{' + \
 
 USBIP_RPC_URL = os.environ.get('USBIP_RPC_URL')
 
+'''Period in seconds of the full resync of the containers inventory,
+   in between the inventory is kept current by docker events'''
+INVENTORY_RESYNC_INTERVAL = int(os.environ.get(
+    'INVENTORY_RESYNC_INTERVAL', 60))
+
+'''Seconds an id or ports acquired by a launch are held until
+   the launched containers appear in the containers inventory'''
+# other processes see the launched containers after a resync only
+RESERVATION_HOLD_TIME = max(int(os.environ.get('RESERVATION_HOLD_TIME', 60)),
+                            INVENTORY_RESYNC_INTERVAL)
+
 BASE_URL = 'unix://var/run/docker.sock'
+
+'''Docker client shared by the process: size of its connection pool,
+   default timeout of a call in seconds and period in seconds of its
+   health check, the client is rebuilt if docker is not reachable'''
+DOCKER_POOL_SIZE = int(os.environ.get('DOCKER_POOL_SIZE', 32))
+DOCKER_TIMEOUT = int(os.environ.get('DOCKER_TIMEOUT', 60))
+DOCKER_HEALTH_INTERVAL = int(os.environ.get('DOCKER_HEALTH_INTERVAL', 30))
+
+'''Boot readiness of instances: host their ports are probed at and
+   their console is reached at on stop, the published ports are reached
+   by host name, so they are reached from inside containers not using
+   the host network, time in seconds an instance is given to boot and
+   the longest pause in seconds between probes of a booting instance'''
+READINESS_HOST = os.environ.get('READINESS_HOST', HOSTNAME)
+READINESS_TIMEOUT = int(os.environ.get('READINESS_TIMEOUT', 600))
+READINESS_MAX_BACKOFF = int(os.environ.get('READINESS_MAX_BACKOFF', 30))
@@ -0,0 +1,63 @@
+import time
+import logging
+import threading
+import docker
+
+from emulator import BASE_URL
+from emulator import DOCKER_POOL_SIZE
+from emulator import DOCKER_TIMEOUT
+from emulator import DOCKER_HEALTH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+docker_client_lock = threading.Lock()
+docker_client = None
+docker_client_checked_at = 0
+
+
+def get_client():
+    ''' Returns the docker client shared by all threads of the process.
+        The connections to docker socket are kept in the pool of the
+        client and reused. The client is pinged once per health interval
+        and rebuilt if docker does not respond '''
+    global docker_client, docker_client_checked_at
+    with docker_client_lock:
+        now = time.monotonic()
+        if docker_client is not None and \
+                now - docker_client_checked_at > DOCKER_HEALTH_INTERVAL:
+            docker_client_checked_at = now
+            try:
+                docker_client.ping()
+            except Exception as e:
+                logger.error('docker client is unhealthy: {}'.format(e))
+                close(docker_client)
+                docker_client = None
+        if docker_client is None:
+            docker_client = docker.DockerClient(
+                BASE_URL,
+                timeout=DOCKER_TIMEOUT,
+                max_pool_size=DOCKER_POOL_SIZE)
+            docker_client_checked_at = now
+            logger.info('docker client created')
+        return docker_client
+
+
+def get_api():
+    ''' Returns the low level api of the shared client '''
+    return get_client().api
+
+
+def reset():
+    ''' Drops the shared client, the next call creates a new one '''
+    global docker_client
+    with docker_client_lock:
+        if docker_client is not None:
+            close(docker_client)
+        docker_client = None
+
+
+def close(client):
+    try:
+        client.close()
+    except Exception:
+        pass
@@ -1,4 +1,6 @@
 import re
+import json
+import socket
 
 import requests
 import logging
@@ -10,9 +12,6 @@ from emulator import TITAN_IMAGE_NAME_PATTERN
 from emulator import CLUSTER_IMAGE_NAME_PATTERN
 from emulator import CATALOG_URL_TEMPLATE
 from emulator import IMAGE_URL_TEMPLATE
-from emulator import GRPC_PORT_BASE
-from emulator import SHELL_PORT_BASE
-from emulator import TELNET_PORT_BASE
 from emulator import TURN_ON
 from emulator import TURN_SERVER_CDM
 from emulator import TURN_EMU_CFG
@@ -20,10 +19,35 @@ from emulator import USBIP_RPC_URL
 from emulator import REGISTRY_USER
 from emulator import REGISTRY_PASS
 from emulator import ARTIFACTORY_PATH
-from emulator import BASE_URL
+from emulator import LABEL_INSTANCE
+from emulator import LABEL_ROLE
+from emulator import LABEL_OWNER
+from emulator import LABEL_PAIR
+from emulator import LABEL_PORTS
+from emulator import LABEL_DEVICES
+from emulator import STOP_GRACE_TIMEOUT
+from emulator import NETWORK_MODE
+from emulator import SHARED_NETWORK_NAME
+from emulator import LABEL_NETWORK_POOL
+from emulator import READINESS_HOST
+from emulator.docker_client import get_client
+from emulator.docker_client import get_api
+from emulator.allocator import IdAllocator
+from emulator.allocator import PortAllocator
+from emulator.reservations import ReservationStore
+from emulator.inventory import ContainerInventory
+from emulator.images import ImageIndex
+from emulator.netpool import NetworkPool
+from emulator.metrics import Stopwatch
+from emulator.readiness import ReadinessMonitor
+from emulator.readiness import adb_shell
+from emulator.readiness import answers
+from emulator.readiness import H2_PREFACE
+from emulator.readiness import HTTP_HEAD
 from usbip_client import usbip_client
 from decimal import Decimal
 from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
 
 
 logger = logging.getLogger(__name__)
@@ -31,9 +55,24 @@ usbip_client_proxy = usbip_client if USBIP_RPC_URL is None \
     else xmlrpc.client.ServerProxy(USBIP_RPC_URL, allow_none=True)
 
 emulator_global_lock = Lock()
+emulator_coturn_lock = Lock()
+emulator_inventory_lock = Lock()
+emulator_network_lock = Lock()
+emulator_reaper = ThreadPoolExecutor(max_workers=4,
+                                     thread_name_prefix='reaper')
 
 
 class emulator:
+    __inventory = None
+    __ids = None
+    __ports = None
+    __netpool = None
+    __images = ImageIndex()
+    __coturn = None
+    __readiness = None
+    __ready_listeners = []
+    __change_listeners = []
+
     @staticmethod
     def describe_image(image_name, sha):
         api = '<unknown>'
@@ -66,15 +105,14 @@ class emulator:
             If the local image name coincides with the remote one
             this image will be placed only once in the result dict
             only as a local instance'''
-        client = docker.DockerClient(BASE_URL)
-        lokal_images = client.images.list()
         result_images = dict()
-        lokal_images = [i for i in lokal_images if
-                        name_pattern in ''.join(i.tags)]
-        for local in lokal_images:
-            for name_local in local.tags:
+        lokal_images = [(tags, short_id) for tags, short_id
+                        in __class__.__images.images()
+                        if name_pattern in ''.join(tags)]
+        for tags, short_id in lokal_images:
+            for name_local in tags:
                 name_local = __class__.__to_short_image_name(name_local)
-                result_images[name_local] = local.short_id
+                result_images[name_local] = short_id
                 logger.info('LOCAL: {}'.format(name_local))
         for path in emulator.__remote_images_paths_list(
                 registry, name_pattern):
@@ -86,95 +124,259 @@ class emulator:
     @staticmethod
     def list_containers():
         '''lists running instances'''
+        return __class__.__get_inventory().instances()
+
+    @staticmethod
+    def __get_inventory():
+        '''returns the inventory of running containers, the inventory
+           is created on first use'''
+        if __class__.__inventory is None:
+            with emulator_inventory_lock:
+                if __class__.__inventory is None:
+                    store = ReservationStore()
+                    __class__.__ids = IdAllocator(store=store)
+                    __class__.__ports = PortAllocator(store=store)
+                    __class__.__inventory = ContainerInventory(
+                        __class__.__parse_container,
+                        __class__.__render_instances,
+                        LABEL_ROLE,
+                        on_release=__class__.__on_release,
+                        on_resync=__class__.__on_resync,
+                        on_image=__class__.__on_image,
+                        on_change=__class__.__on_change)
+                    __class__.__netpool = NetworkPool(
+                        __class__.__inventory, store)
+                    __class__.__readiness = ReadinessMonitor(
+                        __class__.__probe_instance,
+                        on_ready=__class__.__on_ready,
+                        on_change=__class__.__inventory.invalidate)
+        return __class__.__inventory
+
+    @staticmethod
+    def reset():
+        '''drops the inventory, the allocators and the network pool, the
+           next call creates them again from the current reservations'''
+        with emulator_inventory_lock:
+            __class__.__inventory = None
+            __class__.__ids = None
+            __class__.__ports = None
+            __class__.__netpool = None
+            __class__.__readiness = None
+            __class__.__images.invalidate()
+
+    @staticmethod
+    def __on_release(record):
+        '''returns id and ports of the gone instance to allocators'''
+        __class__.__ids.release(record['ident'])
+        __class__.__ports.release(record['ports'])
+        __class__.__readiness.untrack(record['ident'])
 
-        client = docker.DockerClient(BASE_URL)
-        containers = client.containers.list()
-        cont_names = [c.name for c in containers
-                      if 'emulator_titan' in c.name]
-        clust_cont_names = [c.name for c in containers
-                            if 'emulator_cluster' in c.name]
-        cont_names.extend(clust_cont_names)
+    @staticmethod
+    def __on_resync(records):
+        '''rebuilds allocators from the instances found running'''
+        __class__.__ids.sync([r['ident'] for r in records])
+        __class__.__ports.sync([r['ports'] for r in records])
+        if TURN_ON:
+            with emulator_coturn_lock:
+                __class__.__coturn = __class__.__find_coturn(
+                    get_api())
+
+    @staticmethod
+    def probe_readiness(timeout=5):
+        '''probes every running instance at least once, so readiness
+           reported by list_containers is known. Returns False if some
+           instances are not probed in timeout seconds'''
+        __class__.__get_inventory().instances()
+        return __class__.__readiness.settle(timeout)
 
-        ids = sorted(set([cont[-1] for cont in cont_names]))
+    @staticmethod
+    def on_ready(callback):
+        '''registers callback called with the instance info and its boot
+           time in seconds once the instance is booted. Boot time is None
+           for the instances found running, not seen starting'''
+        __class__.__ready_listeners.append(callback)
+
+    @staticmethod
+    def on_change(callback):
+        '''registers callback called without arguments after running
+           instances or local images may have changed, the callback is
+           called under the inventory lock and must not block'''
+        __class__.__change_listeners.append(callback)
+
+    @staticmethod
+    def __on_change():
+        for callback in __class__.__change_listeners:
+            try:
+                callback()
+            except Exception as e:
+                logger.error('change callback failed: {}'.format(e))
+
+    @staticmethod
+    def __on_image(event):
+        __class__.__images.on_event(event)
+        __class__.__on_change()
+
+    @staticmethod
+    def __on_ready(info, boot_time):
+        for callback in __class__.__ready_listeners:
+            try:
+                callback(info, boot_time)
+            except Exception as e:
+                logger.error('ready callback failed: {}'.format(e))
+
+    @staticmethod
+    def __probe_instance(info):
+        '''checks if the instance is booted: titan one is booted once
+           sys.boot_completed is set, if adb requires authentication
+           its grpc port must answer. Cluster one must answer on its
+           web port'''
+        ports = info['ports']
+        if info['role'] == 'titan':
+            booted = adb_shell(READINESS_HOST, ports['shell'],
+                               'getprop sys.boot_completed')
+            if booted is not None:
+                return booted == '1'
+            return answers(READINESS_HOST, ports['grpc'], H2_PREFACE)
+        return answers(READINESS_HOST, ports['grpc'], HTTP_HEAD)
+
+    @staticmethod
+    def __instance_info(record):
+        '''returns the info readiness monitor probes the instance by'''
+        return {
+            'ident': record['ident'],
+            'role': record['role'],
+            'image_name': record['image_name'],
+            'owner': record['owner'],
+            'pair': record['pair'],
+            'ports': record['ports']}
+
+    @staticmethod
+    def __parse_container(container):
+        '''returns the inventory record for emulator container or None
+           if the container is not an emulator one. Both inspected and
+           sparse (as listed) containers are accepted'''
+        attrs = container.attrs
+        config = attrs.get('Config', attrs)
+        labels = config.get('Labels') or {}
+        if LABEL_ROLE not in labels:
+            return None
+
+        name = attrs['Name'] if 'Config' in attrs else attrs['Names'][0]
+        image_name = config['Image']
+        networks = attrs['NetworkSettings']['Networks']
+        devices = json.loads(labels.get(LABEL_DEVICES, '[]'))
+        if devices:
+            devpaths = [device['path'] for device in devices]
+            attached_devices = __class__.lsusb()
+            devices = [dev for dev in attached_devices
+                       if dev['dev_path'] in devpaths]
+            devices = ['{}@{}/{}'.format(
+                dev['vid_pid'],
+                dev['remote_address'],
+                dev['bus_id']) for dev in devices]
+        return {
+            'name': name.lstrip('/'),
+            'role': labels[LABEL_ROLE],
+            'ident': int(labels[LABEL_INSTANCE]),
+            'owner': labels.get(LABEL_OWNER, ''),
+            'pair': labels.get(LABEL_PAIR, ''),
+            'ports': json.loads(labels[LABEL_PORTS]),
+            'image_name': __class__.__to_short_image_name(image_name),
+            'net_name': list(networks.keys())[0],
+            'devices': devices}
+
+    @staticmethod
+    def __render_instances(records):
+        '''groups inventory records into instances, titan container
+           is the leading one if an instance has several of them'''
+        records = sorted(records, key=lambda r: r['role'] != 'titan')
+        ids = sorted(set([r['ident'] for r in records]))
 
         instances = {}
         for ident in ids:
-            childs = [cont for cont in cont_names if cont[-1] == ident]
-
-            healthy = False
-            devices = []
-
-            if 'titan' in ''.join(childs):
-                healthy = True
-                titan = [cont for cont in containers if
-                         'titan' in cont.name and cont.name in childs][0]
-                image_name = titan.attrs['Config']['Image']
-                short_name = __class__.__to_short_image_name(image_name)
-                networks = titan.attrs['NetworkSettings']['Networks']
-                net_name = list(networks.keys())[0]
-                devices = titan.attrs['HostConfig']['Devices'][1:]
-                devices = [dev['PathOnHost'] for dev in devices]
-                attached_devices = __class__.lsusb()
-                devices = [dev for dev in attached_devices
-                           if dev['dev_path'] in devices]
-                devices = ['{}@{}/{}'.format(
-                    dev['vid_pid'],
-                    dev['remote_address'],
-                    dev['bus_id']) for dev in devices]
+            childs = [r for r in records if r['ident'] == ident]
+            lead = childs[0]
+            ports = lead['ports']
+            __class__.__readiness.track(
+                ident, __class__.__instance_info(lead), starting=False)
+
+            if lead['role'] == 'titan':
                 shell_cmd = 'adb connect {}:{}'.format(HOSTNAME,
-                                                       SHELL_PORT_BASE +
-                                                       int(ident))
+                                                       ports['shell'])
                 telnet_cmd = 'telnet {} {}'.format(HOSTNAME,
-                                                   TELNET_PORT_BASE +
-                                                   int(ident))
+                                                   ports['telnet'])
                 link = 'http://{}/instance/{}'.format(HOSTNAME.lower(), ident)
-
-            elif 'cluster' in ''.join(childs):
-                healthy = True
-                cluster = [cont for cont in containers if
-                           'cluster' in cont.name and cont.name in childs][0]
-                image_name = cluster.attrs['Config']['Image']
-                short_name = __class__.__to_short_image_name(image_name)
-                networks = cluster.attrs['NetworkSettings']['Networks']
-                net_name = list(networks.keys())[0]
+            else:
                 shell_cmd = 'ssh  root@{} -p {}'.format(HOSTNAME,
-                                                        SHELL_PORT_BASE +
-                                                        int(ident))
+                                                        ports['shell'])
                 telnet_cmd = ''
                 link = 'http://{}:{}'.format(HOSTNAME.lower(),
-                                             GRPC_PORT_BASE + int(ident))
-            else:
-                short_name = '<unknown>'
+                                             ports['grpc'])
 
-            instances[int(ident)] = {
-                'id': ident,
-                'image_name': short_name,
-                'healthy': healthy,
+            instances[ident] = {
+                'id': str(ident),
+                'image_name': lead['image_name'],
+                'healthy': __class__.__readiness.is_ready(ident),
                 'link': link,
                 'adb': shell_cmd,
-                'net_name': net_name,
+                'net_name': lead['net_name'],
                 'telnet': telnet_cmd,
                 'hostname': HOSTNAME.lower(),
-                'port': GRPC_PORT_BASE + int(ident),
-                'devices': ' '.join(devices),
-                'childs': ' '.join(childs)}
+                'port': ports['grpc'],
+                'role': lead['role'],
+                'owner': lead['owner'],
+                'pair': lead['pair'],
+                'devices': ' '.join(lead['devices']),
+                'childs': ' '.join([r['name'] for r in childs])}
         return instances
 
+    @staticmethod
+    def __labels(ident, role, prefix, pair, ports, devices):
+        '''returns the labels to stamp on the container of an instance
+           input: ident - instance id
+                  role - titan or cluster
+                  prefix - prefix of container names, identifies the owner
+                  pair - id of the titan instance of cockpit pair if any
+                  ports - tuple of grpc, shell and telnet host ports
+                  devices - list of usb devices passed to the container'''
+        grpc_port, shell_port, telnet_port = ports
+        return {
+            LABEL_INSTANCE: str(ident),
+            LABEL_ROLE: role,
+            LABEL_OWNER: prefix,
+            LABEL_PAIR: str(pair) if pair is not None else '',
+            LABEL_PORTS: json.dumps({
+                'grpc': grpc_port,
+                'shell': shell_port,
+                'telnet': telnet_port}),
+            LABEL_DEVICES: json.dumps(devices)}
+
     @staticmethod
     def __get_next_instance_config():
-        '''looks for already running instances and
-            returns an id for the next instance'''
+        '''acquires an id and host ports for the next instance,
+            None is returned if no ids or ports are left on the node.
+            Allocation is done in memory, docker is not involved'''
+        __class__.__get_inventory().start()
+        ix = __class__.__ids.acquire()
+        if ix is None:
+            return None
+        ports = __class__.__ports.acquire()
+        if ports is None:
+            __class__.__ids.release(ix)
+            return None
+        return (ix,) + ports
 
-        containers = __class__.list_containers()
-        keys = list(containers.keys())
-        for ix in range(max([0] + keys) + 2):  # +2 to have latest always free
-            if ix not in keys:
-                break
-        return (ix, GRPC_PORT_BASE + ix,
-                SHELL_PORT_BASE + ix, TELNET_PORT_BASE + ix)
+    @staticmethod
+    def __release_instance_config(instance_config):
+        '''returns id and ports of the instance which is not launched'''
+        ix, grpc_port, shell_port, telnet_port = instance_config
+        __class__.__ids.release(ix)
+        __class__.__ports.release(
+            {'grpc': grpc_port, 'shell': shell_port, 'telnet': telnet_port})
 
     @staticmethod
-    def start_image(image_name, devices=[], prefix='', cluster_name=''):
+    def start_image(image_name, devices=[], prefix='', cluster_name='',
+                    progress=None):
         '''launches an instance
            input: image_name - name of docker image
                   devices - list of dicts of format
@@ -182,15 +384,21 @@ class emulator:
                        'vid_pid': <vid:pid>}
                   prefix - prefix used in container names to be launched
                   cluster_name = name of cluster docker image
+                  progress - called with the name of launch stage passed
+                      and keyword info: network (the instance network is
+                      ready), started (a container is started)
         '''
+        progress = progress or (lambda stage, **info: None)
         if not image_name:
             logger.warning('no image_name provided')
             return
 
+        stopwatch = Stopwatch('launch')
         image_name = __class__.__to_full_image_name(image_name)
         logger.info('image full name {}'.format(image_name))
 
-        client = docker.APIClient(BASE_URL)
+        client = get_api()
+        inventory = __class__.__get_inventory()
 
         images = [image_name]
 
@@ -203,38 +411,47 @@ class emulator:
             images += [cluster_name]
 
         for image in images:
-            if not client.images(image):
+            if not image or not __class__.__images.has(image):
                 logger.error('image {} not found'.format(image))
                 return
+        stopwatch.lap('resolve')
 
         with emulator_global_lock:
             instance_config = __class__.__get_next_instance_config()
+            if instance_config is None:
+                return None
             instance_id, instance_port, shell_port, \
                 telnet_port = instance_config
 
-            logger.info('starting instance #{} on port {}, prefix {}'.format(
-                instance_id, instance_port, prefix))
+            cl_instance_config = instance_config
+            if CLUSTER_IMAGE_NAME_PATTERN in cluster_name:
+                cl_instance_config = __class__.__get_next_instance_config()
+                if cl_instance_config is None:
+                    __class__.__release_instance_config(instance_config)
+                    return None
+        stopwatch.lap('allocate')
 
-            net_name = '{}emulator_envoymesh_{}'.format(prefix, instance_id)
-            if not [net for net in client.networks(net_name)
-                    if net['Name'] == net_name]:
-                client.create_network(net_name)
-                logger.info('created network {}'.format(net_name))
+        logger.info('starting instance #{} on port {}, prefix {}'.format(
+            instance_id, instance_port, prefix))
 
-            if TURN_ON and 'coturn' not in ' '.join(
-                    [cont['Image'] for cont in client.containers()]):
-                logger.info('TURN_SERVER_CDM {}'.format(TURN_SERVER_CDM))
-                coturn = client.create_container(
-                    name='coturn',
-                    image='instrumentisto/coturn:latest',
-                    detach=True,
-                    command=TURN_SERVER_CDM,
-                    host_config=client.create_host_config(
-                        auto_remove=True,
-                        network_mode='host'))
+        net_name = __class__.__get_network(client, cluster_name != '')
+        if net_name is None:
+            __class__.__release_instance_config(instance_config)
+            if cl_instance_config is not instance_config:
+                __class__.__release_instance_config(cl_instance_config)
+            return None
+        logger.info('joining network {}'.format(net_name))
+        stopwatch.lap('network')
+        progress('network', network=net_name)
 
-                logger.info('created coturn {}'.format(coturn))
-                client.start(container=coturn.get('Id'))
+        configs = [instance_config]
+        if cl_instance_config is not instance_config:
+            configs.append(cl_instance_config)
+        created = []
+        try:
+            if TURN_ON:
+                __class__.__start_coturn(client)
+                stopwatch.lap('coturn')
 
             environment = {}
             if TURN_ON:
@@ -262,6 +479,11 @@ class emulator:
                             net_name: client.create_endpoint_config(
                                 aliases=['emulator'])}),
                     environment=environment,
+                    labels=__class__.__labels(
+                        instance_id, 'titan', prefix,
+                        instance_id if cluster_name != '' else None,
+                        (instance_port, shell_port, telnet_port),
+                        devices),
                     ports=[8554, 5555, 5554],
                     host_config=client.create_host_config(
                         cap_add=["NET_ADMIN"],
@@ -271,31 +493,38 @@ class emulator:
                         port_bindings={5555: shell_port,
                                        5554: telnet_port,
                                        8554: instance_port},
+                        # telnet session requires auth via token kept inside
+                        # the container, to not complicate the things for now
+                        # with token exposing in the UI, the token is empty
+                        # and non-auth access is allowed
+                        binds=['/dev/null:/root/.emulator_console_auth_token'],
                         auto_remove=True))
+                created.append(emulator.get('Id'))
                 logger.info('created emulator {}'.format(emulator))
+                stopwatch.lap('create')
                 client.start(container=emulator.get('Id'))
-
-                # telnet session requires auth via token kept inside
-                # the container, to not complicate the things for now
-                # with token exposing in the UI, just remove the tocken
-                # and allowing non-auth access
-                client.exec_start(
-                    client.exec_create(
-                        emulator.get('Id'),
-                        'cp /dev/null /root/.emulator_console_auth_token'))
+                __class__.__readiness.track(instance_id, {
+                    'ident': instance_id,
+                    'role': 'titan',
+                    'image_name': __class__.__to_short_image_name(image_name),
+                    'owner': prefix,
+                    'pair': str(instance_id) if cluster_name != '' else '',
+                    'ports': {'grpc': instance_port,
+                              'shell': shell_port,
+                              'telnet': telnet_port}})
+                inventory.refresh(emulator.get('Id'))
+                stopwatch.lap('start')
+                progress('started', ident=instance_id, role='titan')
 
             cl_inst_id = 0
 
             if (CLUSTER_IMAGE_NAME_PATTERN in image_name) or \
                     (CLUSTER_IMAGE_NAME_PATTERN in cluster_name):
+                cl_inst_id, cl_instance_port, cl_shell_port, \
+                    cl_telnet_port = cl_instance_config
                 if cluster_name != '':
-                    cl_instance_config = __class__.__get_next_instance_config()
-                    cl_inst_id, cl_instance_port, cl_shell_port, \
-                        cl_telnet_port = cl_instance_config
                     cl_image_name = cluster_name
                 else:
-                    cl_inst_id, cl_instance_port, cl_shell_port, \
-                        cl_telnet_port = instance_config
                     cl_image_name = image_name
 
                 logger.info(
@@ -308,6 +537,11 @@ class emulator:
                     image=cl_image_name,
                     detach=True,
                     stdin_open=True, tty=True,
+                    labels=__class__.__labels(
+                        cl_inst_id, 'cluster', prefix,
+                        instance_id if cluster_name != '' else None,
+                        (cl_instance_port, cl_shell_port, cl_telnet_port),
+                        devices),
                     networking_config=client.create_networking_config(
                         endpoints_config={
                             net_name: client.create_endpoint_config(
@@ -321,51 +555,255 @@ class emulator:
                         port_bindings={
                             8022: cl_shell_port, 8080: cl_instance_port},
                         auto_remove=True))
+                created.append(cluster.get('Id'))
                 logger.info('created emulator {}'.format(cluster))
+                stopwatch.lap('create')
                 client.start(container=cluster.get('Id'))
+                __class__.__readiness.track(cl_inst_id, {
+                    'ident': cl_inst_id,
+                    'role': 'cluster',
+                    'image_name':
+                        __class__.__to_short_image_name(cl_image_name),
+                    'owner': prefix,
+                    'pair': str(instance_id) if cluster_name != '' else '',
+                    'ports': {'grpc': cl_instance_port,
+                              'shell': cl_shell_port,
+                              'telnet': cl_telnet_port}})
+                inventory.refresh(cluster.get('Id'))
+                stopwatch.lap('start')
+                progress('started', ident=cl_inst_id, role='cluster')
+        except Exception as e:
+            logger.error('failed to launch #{}: {}'.format(instance_id, e))
+            __class__.__abort_launch(client, created, configs, net_name)
+            raise
 
         logger.info('running instance_id = {}, cluster_id = {}'.format(
             instance_id, cl_inst_id))
+        logger.info('launched #{} in {:.3f}s: {}'.format(
+            instance_id, stopwatch.total(), stopwatch))
         if cluster_name != '':
             return instance_id, cl_inst_id
         return instance_id
 
     @staticmethod
-    def stop_container(inst_id):
-        '''stops running instance'''
+    def __abort_launch(client, containers, configs, net_name):
+        '''undoes the launch failed half way: removes the containers it
+           created, returns its ids and ports, drops the network lease
+           and stops coturn if no instances are left'''
+        inventory = __class__.__get_inventory()
+        # no launch allocates in between, so the ids and ports released
+        # by the inventory already are not released twice
+        with emulator_global_lock:
+            for container_id in containers:
+                try:
+                    client.remove_container(container_id, force=True)
+                except docker.errors.APIError as e:
+                    logger.info('failed to remove {}: {}'.format(
+                        container_id, e))
+                inventory.discard(container_id)
+            for instance_config in configs:
+                __class__.__readiness.untrack(instance_config[0])
+                __class__.__release_instance_config(instance_config)
+        __class__.__netpool.release(net_name)
+        __class__.__netpool.wakeup()
+        __class__.__stop_unused_coturn()
+
+    @staticmethod
+    def __stop_unused_coturn():
+        '''stops coturn if no instances are left'''
+        if TURN_ON and len(__class__.__get_inventory().instances()) == 0:
+            with emulator_coturn_lock:
+                __class__.__coturn = None
+                try:
+                    get_client().containers.get('coturn').stop(
+                        timeout=STOP_GRACE_TIMEOUT)
+                    logger.info('stopped coturn')
+                except Exception:
+                    pass
 
-        containers = __class__.list_containers()
+    @staticmethod
+    def __get_network(client, pair):
+        '''returns the network for the instance to join: a spare one of
+           the pool or the shared one if networks are shared. Cockpit
+           pair always gets a network of its own, the containers of the
+           pair find each other by aliases'''
+        if pair or NETWORK_MODE != 'shared':
+            return __class__.__netpool.lease()
+
+        inventory = __class__.__get_inventory()
+        with emulator_network_lock:
+            if not inventory.has_network(SHARED_NETWORK_NAME):
+                try:
+                    net = client.create_network(
+                        SHARED_NETWORK_NAME, check_duplicate=True,
+                        labels={LABEL_NETWORK_POOL: 'shared'})
+                    inventory.add_network(SHARED_NETWORK_NAME, net.get('Id'))
+                    logger.info('created network {}'.format(
+                        SHARED_NETWORK_NAME))
+                except docker.errors.APIError as e:
+                    # another worker process may have created it meanwhile
+                    if e.status_code != 409:
+                        raise
+        return SHARED_NETWORK_NAME
+
+    @staticmethod
+    def __find_coturn(client):
+        '''returns the id of running coturn container or None'''
+        running = client.containers(filters={'name': '^/coturn$'})
+        return running[0]['Id'] if running else None
+
+    @staticmethod
+    def __start_coturn(client):
+        '''starts coturn shared by all instances, docker is not asked
+           while the cached handle of running coturn is there'''
+        with emulator_coturn_lock:
+            if __class__.__coturn is None:
+                __class__.__coturn = __class__.__find_coturn(client)
+            if __class__.__coturn is not None:
+                return
+            logger.info('TURN_SERVER_CDM {}'.format(TURN_SERVER_CDM))
+            try:
+                coturn = client.create_container(
+                    name='coturn',
+                    image='instrumentisto/coturn:latest',
+                    detach=True,
+                    command=TURN_SERVER_CDM,
+                    host_config=client.create_host_config(
+                        auto_remove=True,
+                        network_mode='host'))
+
+                logger.info('created coturn {}'.format(coturn))
+                client.start(container=coturn.get('Id'))
+                __class__.__coturn = coturn.get('Id')
+            except docker.errors.APIError as e:
+                # another worker process may have created it meanwhile
+                if e.status_code != 409:
+                    raise
+                logger.info('coturn already created')
+                __class__.__coturn = __class__.__find_coturn(client)
+
+    @staticmethod
+    def stop_container(inst_id):
+        '''stops running instance. The instance is gone from the list
+           of instances at once, its containers are stopped and networks
+           are cleaned up by the reaper in background'''
 
         if inst_id is None:
             logger.warning('no id in provided')
             return
 
-        inst = containers.get(inst_id)
+        inventory = __class__.__get_inventory()
+        inst = inventory.instances().get(inst_id)
         if not inst:
             logger.info('no suitable instance found for id {}'.format(inst_id))
             return
 
         logger.info('found instance {}'.format(inst))
-        client = docker.DockerClient(BASE_URL)
+        inventory.hide(inst_id)
+        emulator_reaper.submit(__class__.__teardown, inst_id, inst)
 
+    @staticmethod
+    def pause_container(inst_id, paused=True):
+        '''pauses containers of the running instance, so they do not use
+           cpu, or unpauses them. Returns True if the instance is found'''
+        inst = __class__.__get_inventory().instances().get(inst_id)
+        if not inst:
+            logger.info('no suitable instance found for id {}'.format(inst_id))
+            return False
+
+        client = get_client()
         for child in inst['childs'].split():
-            cont = client.containers.get(child)
-            networks = cont.attrs['NetworkSettings']['Networks']
+            try:
+                cont = client.containers.get(child)
+                if paused and cont.status == 'running':
+                    cont.pause()
+                elif not paused and cont.status == 'paused':
+                    cont.unpause()
+            except docker.errors.APIError as e:
+                logger.error('failed to {} {}: {}'.format(
+                    'pause' if paused else 'unpause', child, e))
+        logger.info('{} #{}'.format(
+            'paused' if paused else 'unpaused', inst_id))
+        return True
 
-            cont.stop()
-            logger.info('stopped {} '.format(child))
+    @staticmethod
+    def __teardown(inst_id, inst):
+        '''stops containers of the instance concurrently, then removes
+           its networks which are not pool or shared ones and coturn
+           if no instances are left'''
+        stopwatch = Stopwatch('stop')
+        client = get_client()
+        inventory = __class__.__get_inventory()
+        childs = inst['childs'].split()
+        __class__.__netpool.release(inst['net_name'])
+        try:
+            with ThreadPoolExecutor(max_workers=len(childs)) as executor:
+                networks = {}
+                for nets in executor.map(
+                        lambda child: __class__.__stop_child(client, child),
+                        childs):
+                    networks.update(nets)
+        except Exception as e:
+            logger.error('failed to stop instance {}: {}'.format(inst_id, e))
+            inventory.show(inst_id)
+            return
+        stopwatch.lap('containers')
 
-            for net_name, net in networks.items():
-                client.networks.get(net['NetworkID']).remove()
+        for net_name, net_id in networks.items():
+            if __class__.__netpool.is_pooled(net_name) or \
+                    net_name == SHARED_NETWORK_NAME:
+                continue
+            try:
+                client.networks.get(net_id).remove()
                 logger.info(f'removed net {net_name}')
+            except Exception as e:
+                logger.error(f'failed to remove net {net_name}: {e}')
+            inventory.remove_network(net_name)
+        __class__.__netpool.wakeup()
+        stopwatch.lap('networks')
 
-        containers = __class__.list_containers()
-        if TURN_ON and len(containers) == 0:
-            try:
-                client.containers.get('coturn').stop()
-                logger.info('stopped coturn')
-            except Exception:
-                pass
+        __class__.__stop_unused_coturn()
+        logger.info('stopped #{} in {:.3f}s: {}'.format(
+            inst_id, stopwatch.total(), stopwatch))
+
+    @staticmethod
+    def __stop_child(client, child):
+        '''stops a container of the instance, the emulator is asked to
+           exit via console first. Returns networks the container was
+           connected to as dict of name: id'''
+        try:
+            cont = client.containers.get(child)
+        except docker.errors.NotFound:
+            logger.info('{} is already gone'.format(child))
+            return {}
+        networks = cont.attrs['NetworkSettings']['Networks']
+        labels = cont.attrs['Config']['Labels'] or {}
+
+        if cont.status == 'paused':
+            cont.unpause()
+        if labels.get(LABEL_ROLE) == 'titan':
+            ports = json.loads(labels[LABEL_PORTS])
+            __class__.__console_kill(ports['telnet'])
+
+        cont.stop(timeout=STOP_GRACE_TIMEOUT)
+        __class__.__get_inventory().discard(cont.id)
+        logger.info('stopped {} '.format(child))
+        return {net_name: net['NetworkID']
+                for net_name, net in networks.items()}
+
+    @staticmethod
+    def __console_kill(telnet_port):
+        '''asks the emulator to exit via its console, so it does not
+           wait for the grace timeout of docker stop'''
+        try:
+            with socket.create_connection((READINESS_HOST, telnet_port),
+                                          timeout=1) as console:
+                console.sendall(b'kill\n')
+            logger.info('sent kill to console on port {}'.format(
+                telnet_port))
+        except OSError as e:
+            logger.info('console on port {} is not reachable: {}'.format(
+                telnet_port, e))
 
     @staticmethod
     def lsusb(remote_address=None):
@@ -416,7 +854,7 @@ class emulator:
         '''
 
         # Start to login as an internal user
-        client = docker.APIClient(base_url=BASE_URL)
+        client = get_api()
         authorized = ""
         attempt = 5
         while authorized != 'Login Succeeded' and attempt >= 0:
@@ -503,6 +941,8 @@ class emulator:
                                 extract_percent = int(current / total * 100)
                                 extracting_progress[state] = extract_percent
                                 yield extracting_progress
+        __class__.__images.invalidate()
+        __class__.__on_change()
         if 'Downloaded' in state or 'Image is up to date' in state:
             logger.info('the final state of downloading is: {}'.format(state))
             complete_progress['Complete'] = 100
@@ -542,12 +982,7 @@ class emulator:
     @staticmethod
     def __to_full_image_name(image_name):
         ''' obtains full image name by its short name '''
-        client = docker.DockerClient(BASE_URL)
-        images = client.images.list()
-        for image in images:
-            if image.tags and image_name.lower() in image.tags[0]:
-                return image.tags[0]
-        return None
+        return __class__.__images.resolve(image_name)
 
     @staticmethod
     def __remote_images_paths_list(registry,
@@ -597,9 +1032,11 @@ class emulator:
             return True
         else:
             logger.info('image full name {}'.format(image_name))
-            client = docker.APIClient(BASE_URL)
+            client = get_api()
             try:
                 client.remove_image(image_name)
+                __class__.__images.invalidate()
+                __class__.__on_change()
                 if not client.images(image_name):
                     logger.info('image {} is successfully deleted'.
                                 format(image_name))
@@ -0,0 +1,69 @@
+import logging
+import threading
+
+from emulator.docker_client import get_client
+
+logger = logging.getLogger(__name__)
+
+'''Docker events which change the set of local image tags'''
+IMAGE_EVENTS = ['pull', 'tag', 'untag', 'delete', 'import', 'load']
+
+
+class ImageIndex:
+    ''' Cached tags of the local images, so resolving an image name
+        does not list all images on every launch. The index is built on
+        first use and invalidated by image events, pull and delete.
+        A name missing from the index is looked up once more in a
+        rebuilt index, images tagged a moment ago are not missed '''
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__images = None  # list of (tags, short id)
+
+    def invalidate(self):
+        with self.__lock:
+            self.__images = None
+
+    def on_event(self, event):
+        ''' Invalidates the index on image events from docker '''
+        if event.get('Action') in IMAGE_EVENTS:
+            self.invalidate()
+
+    def resolve(self, image_name):
+        ''' Returns the full name (first tag) of the image which
+            name contains image_name, or None if there is no such image '''
+        for rebuild in (False, True):
+            for tags, _ in self.__get(rebuild):
+                if image_name.lower() in tags[0]:
+                    return tags[0]
+        return None
+
+    def has(self, image_name):
+        ''' Checks if the image is present locally, image_name is either
+            a tag or a repository name '''
+        for rebuild in (False, True):
+            for tags, _ in self.__get(rebuild):
+                if any([image_name in (tag, repository(tag))
+                        for tag in tags]):
+                    return True
+        return False
+
+    def images(self):
+        ''' Returns list of (tags, short id) of the local images '''
+        return list(self.__get())
+
+    def __get(self, rebuild=False):
+        with self.__lock:
+            if self.__images is None or rebuild:
+                client = get_client()
+                self.__images = [(image.tags, image.short_id)
+                                 for image in client.images.list()
+                                 if image.tags]
+                logger.info('image index built, {} images'
+                            .format(len(self.__images)))
+            return self.__images
+
+
+def repository(tag):
+    ''' Strips the tag from the image name '''
+    name, _, version = tag.rpartition(':')
+    return name if name and '/' not in version else tag
@@ -0,0 +1,263 @@
+import time
+import logging
+import threading
+import docker
+from collections import Counter
+
+from emulator import INVENTORY_RESYNC_INTERVAL
+from emulator.docker_client import get_client
+
+logger = logging.getLogger(__name__)
+
+'''Docker events the inventory is interested in'''
+CONTAINER_EVENTS = ['start', 'die', 'destroy']
+NETWORK_EVENTS = ['create', 'destroy']
+
+
+class ContainerInventory:
+    ''' In-process view of the emulator containers running on the node.
+        The view is built by a full scan on first use, then kept current
+        by the docker events stream and resynced periodically to fix any
+        drift. Callers who change containers themselves (launch, stop)
+        should write the change through with refresh()/discard(), so the
+        view is correct without waiting for the event to arrive.
+        input: parse - callable turning docker Container into a record
+                       dict, returns None for non-emulator containers
+               render - callable turning the list of records into
+                        the instances dict returned by list_containers
+               label - label carried by all containers of interest, the
+                       docker daemon filters out the rest
+               on_release - called with the record of the last container
+                            of an instance once it is gone
+               on_resync - called with the list of records found
+                           by full resync
+               on_image - called with docker image events, image
+                          events are not followed if not given
+               on_change - called after the instances may have changed,
+                           it is called under the inventory lock and
+                           must not block
+        Records returned by parse must carry instance id as 'ident' '''
+    def __init__(self, parse, render, label,
+                 on_release=None, on_resync=None, on_image=None,
+                 on_change=None, resync_interval=INVENTORY_RESYNC_INTERVAL):
+        self.parse = parse
+        self.render = render
+        self.label = label
+        self.on_release = on_release
+        self.on_resync = on_resync
+        self.on_image = on_image
+        self.on_change = on_change
+        self.resync_interval = resync_interval
+        self.__lock = threading.RLock()
+        self.__records = None      # container id -> parsed record
+        self.__idents = Counter()  # instance id -> number of containers
+        self.__networks = {}       # network name -> network id
+        self.__instances = None    # rendered instances, None if outdated
+        self.__hidden = set()      # instance ids being stopped
+        self.__seq = 0             # incremented on every change
+        self.__changes = {}        # container id -> seq of latest change
+        self.__synced_at = 0
+        self.__watcher = None
+
+    def start(self):
+        ''' Builds the inventory and starts following docker events,
+            does nothing if already started '''
+        with self.__lock:
+            if self.__records is None:
+                self.resync()
+                self.__start_watcher()
+
+    def instances(self):
+        ''' Returns a copy of the instances dict, docker is not
+            touched unless the inventory is not built yet '''
+        with self.__lock:
+            self.start()
+            if self.__instances is None:
+                self.__instances = self.render(
+                    [r for r in self.__records.values()
+                     if r['ident'] not in self.__hidden])
+            return {k: dict(v) for k, v in self.__instances.items()}
+
+    def invalidate(self):
+        ''' Lets the instances be rendered again, for the case something
+            render depends on is changed outside of the inventory '''
+        with self.__lock:
+            self.__changed()
+
+    def hide(self, ident):
+        ''' Hides the instance being stopped from instances(), it is
+            forgotten once all of its containers are gone '''
+        with self.__lock:
+            self.__hidden.add(ident)
+            self.__changed()
+
+    def show(self, ident):
+        ''' Shows the instance hidden by hide() again '''
+        with self.__lock:
+            self.__hidden.discard(ident)
+            self.__changed()
+
+    def has_network(self, net_name):
+        with self.__lock:
+            self.start()
+            return net_name in self.__networks
+
+    def networks(self):
+        ''' Returns the dict of network name: id '''
+        with self.__lock:
+            self.start()
+            return dict(self.__networks)
+
+    def networks_in_use(self):
+        ''' Returns the set of names of networks containers are in '''
+        with self.__lock:
+            self.start()
+            return set([r['net_name'] for r in self.__records.values()])
+
+    def add_network(self, net_name, net_id):
+        with self.__lock:
+            self.__networks[net_name] = net_id
+
+    def remove_network(self, net_name):
+        with self.__lock:
+            self.__networks.pop(net_name, None)
+
+    def refresh(self, container_id, client=None):
+        ''' Re-reads a single container and updates the view '''
+        client = client or get_client()
+        try:
+            record = self.parse(client.containers.get(container_id))
+        except docker.errors.NotFound:
+            record = None
+        with self.__lock:
+            if record is None:
+                self.__drop(container_id)
+            else:
+                self.__put(container_id, record)
+
+    def discard(self, container_id):
+        ''' Removes a container from the view '''
+        with self.__lock:
+            self.__drop(container_id)
+
+    def resync(self, client=None):
+        ''' Rebuilds the view by full scan. Changes written through
+            while the scan is running take precedence over the scan '''
+        client = client or get_client()
+        with self.__lock:
+            start_seq = self.__seq
+        synced_at = int(time.time())
+        containers = client.containers.list(
+            sparse=True, filters={'label': self.label})
+        networks = client.networks.list()
+        records = {}
+        for container in containers:
+            record = self.parse(container)
+            if record is not None:
+                records[container.id] = record
+        with self.__lock:
+            for container_id, seq in self.__changes.items():
+                if seq <= start_seq:
+                    continue
+                record = (self.__records or {}).get(container_id)
+                if record is None:
+                    records.pop(container_id, None)
+                else:
+                    records[container_id] = record
+            self.__changes = {k: v for k, v in self.__changes.items()
+                              if v > start_seq}
+            self.__records = records
+            self.__idents = Counter(r['ident'] for r in records.values())
+            self.__hidden &= set(self.__idents)
+            self.__networks = {net.name: net.id for net in networks
+                               if 'emulator_envoymesh' in net.name}
+            self.__changed()
+            self.__synced_at = synced_at
+            logger.info('inventory resynced, {} containers, {} networks'
+                        .format(len(records), len(self.__networks)))
+        if self.on_resync:
+            self.on_resync(list(records.values()))
+        return synced_at
+
+    def __put(self, container_id, record):
+        self.__seq += 1
+        self.__changes[container_id] = self.__seq
+        if self.__records is not None:
+            previous = self.__records.get(container_id)
+            if previous is None:
+                self.__idents[record['ident']] += 1
+            self.__records[container_id] = record
+        self.__changed()
+
+    def __drop(self, container_id):
+        self.__seq += 1
+        self.__changes[container_id] = self.__seq
+        if self.__records is not None:
+            record = self.__records.pop(container_id, None)
+            if record is not None:
+                self.__idents[record['ident']] -= 1
+                if self.__idents[record['ident']] <= 0:
+                    del self.__idents[record['ident']]
+                    self.__hidden.discard(record['ident'])
+                    if self.on_release:
+                        self.on_release(record)
+        self.__changed()
+
+    def __changed(self):
+        self.__instances = None
+        if self.on_change:
+            self.on_change()
+
+    def __start_watcher(self):
+        if self.__watcher is None:
+            self.__watcher = threading.Thread(
+                target=self.__watch, name='inventory-watcher', daemon=True)
+            self.__watcher.start()
+
+    def __watch(self):
+        ''' Follows docker events in windows of resync_interval seconds,
+            a full resync is done in between of the windows '''
+        since = self.__synced_at
+        types = ['container', 'network'] + (['image'] if self.on_image
+                                            else [])
+        while True:
+            try:
+                client = get_client()
+                if since is None:
+                    since = self.resync(client)
+                for event in client.api.events(
+                        since=since,
+                        until=since + self.resync_interval,
+                        filters={'type': types},
+                        decode=True):
+                    self.__on_event(client, event)
+                since = self.resync(client)
+            except Exception as e:
+                logger.error('inventory watcher failed: {}'.format(e))
+                since = None
+                time.sleep(self.resync_interval)
+
+    def __on_event(self, client, event):
+        action = event.get('Action', '')
+        actor = event.get('Actor', {})
+        if event.get('Type') == 'container' and action in CONTAINER_EVENTS:
+            attributes = actor.get('Attributes', {})
+            if self.label not in attributes:
+                return
+            logger.info('container {} {}'.format(
+                attributes.get('name'), action))
+            if action == 'start':
+                self.refresh(actor.get('ID'), client)
+            else:
+                self.discard(actor.get('ID'))
+        elif event.get('Type') == 'network' and action in NETWORK_EVENTS:
+            net_name = actor.get('Attributes', {}).get('name', '')
+            if 'emulator_envoymesh' not in net_name:
+                return
+            logger.info('network {} {}'.format(net_name, action))
+            if action == 'create':
+                self.add_network(net_name, actor.get('ID'))
+            else:
+                self.remove_network(net_name)
+        elif event.get('Type') == 'image' and self.on_image:
+            self.on_image(event)
@@ -0,0 +1,89 @@
+import time
+import bisect
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+'''Upper bounds of histogram buckets in seconds'''
+DEFAULT_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30, 60, 120, 300]
+
+histograms = {}
+histograms_lock = threading.Lock()
+
+
+class Histogram:
+    ''' Distribution of observed values over fixed buckets, the same
+        way prometheus histograms count them '''
+    def __init__(self, name, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.buckets = sorted(buckets)
+        self.__lock = threading.Lock()
+        self.__counts = [0] * (len(self.buckets) + 1)
+        self.__sum = 0
+        self.__count = 0
+
+    def observe(self, value):
+        with self.__lock:
+            self.__counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.__sum += value
+            self.__count += 1
+
+    def snapshot(self):
+        ''' Returns count, sum and cumulative bucket counts '''
+        with self.__lock:
+            cumulative = 0
+            buckets = {}
+            for bound, count in zip(self.buckets + ['+Inf'], self.__counts):
+                cumulative += count
+                buckets[str(bound)] = cumulative
+            return {
+                'count': self.__count,
+                'sum': round(self.__sum, 6),
+                'buckets': buckets}
+
+
+class Stopwatch:
+    ''' Times consecutive stages of an operation, each stage goes to
+        the histogram named <operation>_<stage>_seconds '''
+    def __init__(self, operation):
+        self.operation = operation
+        self.laps = {}
+        self.__started = time.monotonic()
+        self.__last = self.__started
+
+    def lap(self, stage):
+        ''' Closes the stage started by the previous lap '''
+        now = time.monotonic()
+        elapsed = now - self.__last
+        self.__last = now
+        self.laps[stage] = self.laps.get(stage, 0) + elapsed
+        histogram('{}_{}_seconds'.format(self.operation, stage)) \
+            .observe(elapsed)
+
+    def total(self):
+        ''' Records and returns the time since the stopwatch start '''
+        elapsed = time.monotonic() - self.__started
+        histogram('{}_seconds'.format(self.operation)).observe(elapsed)
+        return elapsed
+
+    def __str__(self):
+        return ', '.join(['{} {:.3f}s'.format(stage, elapsed)
+                          for stage, elapsed in self.laps.items()])
+
+
+def histogram(name, buckets=DEFAULT_BUCKETS):
+    ''' Returns the histogram registered under name, it is created
+        on first use '''
+    with histograms_lock:
+        if name not in histograms:
+            histograms[name] = Histogram(name, buckets)
+        return histograms[name]
+
+
+def snapshot():
+    ''' Returns the snapshots of all registered histograms '''
+    with histograms_lock:
+        registered = list(histograms.values())
+    return {h.name: h.snapshot() for h in registered}
@@ -0,0 +1,176 @@
+import logging
+import threading
+import docker
+
+from emulator import INSTANCE_ID_LIMIT
+from emulator import INVENTORY_RESYNC_INTERVAL
+from emulator import LABEL_NETWORK_POOL
+from emulator import NETWORK_POOL_PREFIX
+from emulator import NETWORK_POOL_SIZE
+from emulator.docker_client import get_client
+from emulator.docker_client import get_api
+
+logger = logging.getLogger(__name__)
+
+
+class NetworkPool:
+    ''' Pool of per-instance networks created in advance. A launch leases
+        a spare network of the pool, the network is spare again once the
+        containers of the instance are gone, there is nothing to remove.
+        The replenisher keeps size spare networks in background, it
+        creates missing ones and removes the excess ones.
+        Pool networks are numbered slots reserved in the store shared
+        with the other processes while leased, created or removed, so
+        a network is never given to two launches.
+        input: inventory - containers inventory, tells which networks
+                           exist and which are in use
+               store - reservation store shared by the processes
+               size - number of spare networks to keep '''
+    def __init__(self, inventory, store, size=NETWORK_POOL_SIZE,
+                 limit=INSTANCE_ID_LIMIT):
+        self.inventory = inventory
+        self.store = store
+        self.size = size
+        self.limit = limit
+        self.__wakeup = threading.Event()
+        self.__replenisher = None
+        self.__lock = threading.Lock()
+
+    def lease(self):
+        ''' Returns the name of a spare network, the network is created
+            on the spot if the pool has no spare ones '''
+        self.__start_replenisher()
+        networks, in_use = self.__snapshot()
+
+        def pick(reserved):
+            spare = self.__spare(networks, in_use, reserved)
+            if spare:
+                return spare[0]
+            return self.__missing(networks, in_use, reserved)
+
+        slot = self.store.reserve('network', pick)
+        if slot is None:
+            return None
+        net_name = network_name(slot)
+        if net_name not in networks:
+            logger.info('no spare networks in the pool')
+            self.__create(net_name)
+        self.__wakeup.set()
+        return net_name
+
+    def release(self, net_name):
+        ''' Drops the lease of the network, it must be done while the
+            containers are still in the network, so nobody else leases
+            it in between. The network is spare once they are gone '''
+        slot = network_slot(net_name)
+        if slot is not None:
+            self.store.release('network', slot)
+
+    def wakeup(self):
+        ''' Lets the replenisher know networks may be spare again '''
+        self.__wakeup.set()
+
+    def is_pooled(self, net_name):
+        return network_slot(net_name) is not None
+
+    def replenish(self):
+        ''' Creates or removes networks, so there are size spare ones '''
+        while True:
+            networks, in_use = self.__snapshot()
+            spare = self.__spare(networks, in_use,
+                                 self.store.reserved('network'))
+            if len(spare) < self.size:
+                slot = self.store.reserve(
+                    'network',
+                    lambda reserved: self.__missing(
+                        networks, in_use, reserved))
+                if slot is None:
+                    return
+                try:
+                    self.__create(network_name(slot))
+                finally:
+                    self.store.release('network', slot)
+            elif len(spare) > self.size:
+                excess = spare[-1]
+                slot = self.store.reserve(
+                    'network',
+                    lambda reserved: excess if excess not in reserved
+                    else None)
+                if slot is None:
+                    return
+                try:
+                    self.__remove(network_name(slot), networks)
+                finally:
+                    self.store.release('network', slot)
+            else:
+                return
+
+    def __snapshot(self):
+        ''' Returns existing networks and names of the ones in use, taken
+            before the store transaction, so the inventory lock is never
+            waited for while the store is locked '''
+        return self.inventory.networks(), self.inventory.networks_in_use()
+
+    def __spare(self, networks, in_use, reserved):
+        ''' Returns the sorted slots of existing networks nobody uses '''
+        return sorted([slot for slot in map(network_slot, networks)
+                       if slot is not None and slot not in reserved and
+                       network_name(slot) not in in_use])
+
+    def __missing(self, networks, in_use, reserved):
+        ''' Returns the lowest slot which network is not created yet '''
+        for slot in range(self.limit):
+            net_name = network_name(slot)
+            if net_name not in networks and net_name not in in_use and \
+                    slot not in reserved:
+                return slot
+        return None
+
+    def __create(self, net_name):
+        client = get_api()
+        try:
+            net = client.create_network(net_name, check_duplicate=True,
+                                        labels={LABEL_NETWORK_POOL: 'true'})
+            logger.info('created network {}'.format(net_name))
+        except docker.errors.APIError as e:
+            # another worker process may have created it meanwhile
+            if e.status_code != 409:
+                raise
+            net = client.inspect_network(net_name)
+            logger.info('network {} already created'.format(net_name))
+        self.inventory.add_network(net_name, net.get('Id'))
+
+    def __remove(self, net_name, networks):
+        client = get_client()
+        client.networks.get(networks[net_name]).remove()
+        self.inventory.remove_network(net_name)
+        logger.info('removed spare network {}'.format(net_name))
+
+    def __start_replenisher(self):
+        with self.__lock:
+            if self.__replenisher is None:
+                self.__replenisher = threading.Thread(
+                    target=self.__replenish_loop, name='network-pool',
+                    daemon=True)
+                self.__replenisher.start()
+
+    def __replenish_loop(self):
+        while True:
+            try:
+                self.replenish()
+            except Exception as e:
+                logger.error('network pool replenish failed: {}'.format(e))
+            self.__wakeup.wait(INVENTORY_RESYNC_INTERVAL)
+            self.__wakeup.clear()
+
+
+def network_name(slot):
+    return '{}{}'.format(NETWORK_POOL_PREFIX, slot)
+
+
+def network_slot(net_name):
+    ''' Returns the slot of pool network or None if it is not pooled '''
+    if not net_name.startswith(NETWORK_POOL_PREFIX):
+        return None
+    slot = net_name[len(NETWORK_POOL_PREFIX):]
+    return int(slot) if slot.isdigit() else None
@@ -0,0 +1,225 @@
+import time
+import socket
+import struct
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from emulator import READINESS_TIMEOUT
+from emulator import READINESS_MAX_BACKOFF
+from emulator.metrics import histogram
+
+logger = logging.getLogger(__name__)
+
+'''Boot time of instances reaches minutes, so the buckets are wider'''
+BOOT_BUCKETS = [5, 10, 20, 30, 45, 60, 90, 120, 180, 240, 300, 600]
+
+
+class ReadinessMonitor:
+    ''' Probes the instances being booted until they are ready. Every
+        instance is probed with exponential backoff starting at a second
+        up to max_backoff seconds between probes, the instance which
+        is not ready in timeout seconds is given up.
+        Boot time of the instances seen starting is recorded into the
+        histogram boot_<image>_seconds.
+        input: probe - callable taking instance info and returning True
+                       if the instance is ready
+               on_ready - called with instance info and boot time in
+                          seconds once the instance is ready
+               on_change - called after readiness of any instance changed
+        Instance info is a dict carrying image_name at least '''
+    def __init__(self, probe, on_ready=None, on_change=None,
+                 timeout=READINESS_TIMEOUT,
+                 max_backoff=READINESS_MAX_BACKOFF):
+        self.probe = probe
+        self.on_ready = on_ready
+        self.on_change = on_change
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.__cv = threading.Condition()
+        self.__instances = {}
+        self.__watcher = None
+        self.__executor = ThreadPoolExecutor(max_workers=8,
+                                             thread_name_prefix='probe')
+
+    def track(self, key, info, starting=True):
+        ''' Starts probing the instance, starting tells the instance is
+            seen starting, else it was found running and its boot time
+            is not known '''
+        with self.__cv:
+            if key in self.__instances:
+                return
+            now = time.monotonic()
+            self.__instances[key] = {
+                'info': info,
+                'since': now,
+                'starting': starting,
+                'next': now,
+                'delay': 1,
+                'probed': False,
+                'ready': False,
+                'failed': False}
+            self.__start_watcher()
+            self.__cv.notify_all()
+
+    def untrack(self, key):
+        with self.__cv:
+            self.__instances.pop(key, None)
+            self.__cv.notify_all()
+
+    def is_ready(self, key):
+        with self.__cv:
+            state = self.__instances.get(key)
+            return state is not None and state['ready']
+
+    def settle(self, timeout):
+        ''' Waits till every instance is probed at least once '''
+        deadline = time.monotonic() + timeout
+        with self.__cv:
+            while any([not state['probed']
+                       for state in self.__instances.values()]):
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return False
+                self.__cv.wait(left)
+        return True
+
+    def __start_watcher(self):
+        if self.__watcher is None:
+            self.__watcher = threading.Thread(
+                target=self.__watch, name='readiness-monitor', daemon=True)
+            self.__watcher.start()
+
+    def __watch(self):
+        while True:
+            with self.__cv:
+                now = time.monotonic()
+                waiting = [(key, state)
+                           for key, state in self.__instances.items()
+                           if not state['ready'] and not state['failed']]
+                due = [(key, state['info']) for key, state in waiting
+                       if state['next'] <= now]
+                if not due:
+                    wakeup = min([state['next'] for key, state in waiting],
+                                 default=now + self.max_backoff)
+                    self.__cv.wait(max(wakeup - now, 0.1))
+                    continue
+            results = self.__executor.map(self.__probe, due)
+            for (key, info), ready in zip(due, results):
+                self.__update(key, ready)
+
+    def __probe(self, due):
+        key, info = due
+        try:
+            return bool(self.probe(info))
+        except Exception as e:
+            logger.info('probe of {} failed: {}'.format(key, e))
+            return False
+
+    def __update(self, key, ready):
+        with self.__cv:
+            state = self.__instances.get(key)
+            if state is None:
+                return
+            now = time.monotonic()
+            if ready:
+                state['ready'] = True
+            elif now - state['since'] > self.timeout:
+                state['failed'] = True
+                logger.warning('{} is not ready in {}s, given up'.format(
+                    key, self.timeout))
+            else:
+                state['next'] = now + state['delay']
+                state['delay'] = min(state['delay'] * 2, self.max_backoff)
+            boot_time = now - state['since'] if state['starting'] else None
+            info = state['info']
+        if ready:
+            self.__notify(key, info, boot_time)
+        with self.__cv:
+            # the instance is marked probed once the callbacks are done,
+            # so settle() returns with the readiness visible to callers
+            state['probed'] = True
+            self.__cv.notify_all()
+
+    def __notify(self, key, info, boot_time):
+        logger.info('{} is ready{}'.format(
+            key, ' in {:.1f}s'.format(boot_time) if boot_time else ''))
+        if boot_time is not None:
+            histogram('boot_{}_seconds'.format(info['image_name']),
+                      BOOT_BUCKETS).observe(boot_time)
+        if self.on_change:
+            self.on_change()
+        if self.on_ready:
+            self.on_ready(info, boot_time)
+
+
+'''adb wire protocol commands'''
+A_CNXN = 0x4e584e43
+A_AUTH = 0x48545541
+A_OPEN = 0x4e45504f
+A_OKAY = 0x59414b4f
+A_WRTE = 0x45545257
+A_CLSE = 0x45534c43
+A_VERSION = 0x01000000
+A_MAXDATA = 4096
+
+
+def adb_shell(host, port, command, timeout=1):
+    ''' Runs the shell command via adbd listening on host:port and
+        returns its output. None is returned if adbd requires the
+        authentication, the output can't be got without adb keys '''
+    with socket.create_connection((host, port), timeout=timeout) as conn:
+        adb_send(conn, A_CNXN, A_VERSION, A_MAXDATA, b'host::\0')
+        command_id, _, _, _ = adb_recv(conn)
+        if command_id == A_AUTH:
+            return None
+        adb_send(conn, A_OPEN, 1, 0,
+                 'shell:{}\0'.format(command).encode())
+        output = b''
+        while True:
+            command_id, remote_id, _, data = adb_recv(conn)
+            if command_id == A_WRTE:
+                output += data
+                adb_send(conn, A_OKAY, 1, remote_id, b'')
+            elif command_id == A_CLSE:
+                return output.decode(errors='replace').strip()
+
+
+def adb_send(conn, command, arg0, arg1, data):
+    conn.sendall(struct.pack('<6I', command, arg0, arg1, len(data),
+                             sum(data) & 0xffffffff,
+                             command ^ 0xffffffff) + data)
+
+
+def adb_recv(conn):
+    header = adb_read(conn, 24)
+    command, arg0, arg1, length, _, _ = struct.unpack('<6I', header)
+    return command, arg0, arg1, adb_read(conn, length)
+
+
+def adb_read(conn, length):
+    data = b''
+    while len(data) < length:
+        chunk = conn.recv(length - len(data))
+        if not chunk:
+            raise ConnectionError('adb connection closed')
+        data += chunk
+    return data
+
+
+'''HTTP/2 connection preface followed by empty SETTINGS frame'''
+H2_PREFACE = b'PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n' + b'\0\0\0\x04\0\0\0\0\0'
+HTTP_HEAD = b'HEAD / HTTP/1.0\r\n\r\n'
+
+
+def answers(host, port, payload, timeout=1):
+    ''' Checks if the service on host:port replies to the payload. Mere
+        connect is not enough, docker proxy of the published port accepts
+        connections before the service in the container is listening '''
+    try:
+        with socket.create_connection((host, port), timeout=timeout) as conn:
+            conn.sendall(payload)
+            return len(conn.recv(1)) > 0
+    except OSError:
+        return False
@@ -0,0 +1,90 @@
+import os
+import time
+import sqlite3
+import logging
+from contextlib import contextmanager
+
+from emulator import RESERVATION_DB
+from emulator import RESERVATION_HOLD_TIME
+
+logger = logging.getLogger(__name__)
+
+
+class ReservationStore:
+    ''' Reservations of instance ids and host ports shared by all the
+        processes running on the node, kept in a small sqlite database.
+        A reservation covers the window between the allocation and the
+        moment the launched containers show up in the inventory of every
+        process, so it is held for hold_time seconds at most. Reservations
+        of the processes which are not alive anymore are dropped.
+        Every change runs in an immediate transaction, which is the lock
+        serializing allocations across the processes. '''
+    def __init__(self, path=None, hold_time=RESERVATION_HOLD_TIME):
+        self.path = path or RESERVATION_DB
+        self.hold_time = hold_time
+        with self.__transaction() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS reservations ('
+                       'kind TEXT, slot INTEGER, pid INTEGER, '
+                       'reserved_at REAL, PRIMARY KEY (kind, slot))')
+
+    def reserve(self, kind, pick):
+        ''' Reserves the slot returned by pick, pick is called with the
+            set of slots reserved at the moment and may return None if
+            nothing is available. Returns the reserved slot '''
+        with self.__transaction() as db:
+            reserved = self.__reserved(db, kind)
+            slot = pick(reserved)
+            if slot is not None:
+                db.execute('INSERT OR REPLACE INTO reservations '
+                           'VALUES (?, ?, ?, ?)',
+                           (kind, slot, os.getpid(), time.time()))
+            return slot
+
+    def release(self, kind, slot):
+        ''' Drops the reservation of the slot made by this process, the
+            slot may be reserved meanwhile by another process '''
+        with self.__transaction() as db:
+            db.execute('DELETE FROM reservations '
+                       'WHERE kind = ? AND slot = ? AND pid = ?',
+                       (kind, slot, os.getpid()))
+
+    def reserved(self, kind):
+        ''' Returns the set of slots of the kind being reserved '''
+        with self.__transaction() as db:
+            return self.__reserved(db, kind)
+
+    def __reserved(self, db, kind):
+        db.execute('DELETE FROM reservations WHERE reserved_at < ?',
+                   (time.time() - self.hold_time,))
+        rows = db.execute('SELECT slot, pid FROM reservations '
+                          'WHERE kind = ?', (kind,)).fetchall()
+        dead = [slot for slot, pid in rows if not is_alive(pid)]
+        for slot in dead:
+            db.execute('DELETE FROM reservations '
+                       'WHERE kind = ? AND slot = ?', (kind, slot))
+        return set([slot for slot, pid in rows if slot not in dead])
+
+    @contextmanager
+    def __transaction(self):
+        db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                yield db
+                db.execute('COMMIT')
+            except Exception:
+                db.execute('ROLLBACK')
+                raise
+        finally:
+            db.close()
+
+
+def is_alive(pid):
+    ''' Checks if the process with pid is running '''
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -1,9 +1,132 @@
 import os
+import json
 import logging
 
-'''Limited number of instances to launch per node'''
+'''Limited number of instances to launch per node which does not report
+   its capacity'''
 MAX_INSTANCES_PER_NODE = int(os.environ.get('MAX_INSTANCES_PER_NODE', 4))
 
+'''Resources an instance of the image uses: dict of pattern of image name:
+   cores and memory in bytes, default profile is used for the images not
+   matching any pattern. Capacity of the node is the number of instances
+   of each profile fitting in its cores and memory, less the cores and
+   memory reserved for the host. Instances need factor times more cores
+   on the node without kvm. The capacity is computed every refresh
+   interval seconds'''
+IMAGE_PROFILES = json.loads(os.environ.get('IMAGE_PROFILES', json.dumps({
+    'cloud_android': {'cores': 4, 'memory': 4 * 2**30},
+    'cloud_cluster': {'cores': 2, 'memory': 2 * 2**30},
+    'default': {'cores': 4, 'memory': 4 * 2**30}})))
+CAPACITY_RESERVED_CORES = float(os.environ.get('CAPACITY_RESERVED_CORES', 1))
+CAPACITY_RESERVED_MEMORY = int(os.environ.get(
+    'CAPACITY_RESERVED_MEMORY', 2**30))
+CAPACITY_NO_KVM_FACTOR = float(os.environ.get('CAPACITY_NO_KVM_FACTOR', 4))
+CAPACITY_REFRESH_INTERVAL = float(os.environ.get(
+    'CAPACITY_REFRESH_INTERVAL', 300))
+
+'''The node rejects a launch while its 1 minute load average per core is
+   above max load, or share in percent of time tasks stalled on cpu, memory
+   or io over the last 10 seconds is above max pressure, or its available
+   memory is below the memory of the image profile'''
+ADMISSION_MAX_LOAD = float(os.environ.get('ADMISSION_MAX_LOAD', 1.5))
+ADMISSION_MAX_PRESSURE = float(os.environ.get('ADMISSION_MAX_PRESSURE', 20))
+
+'''Policy the node to launch the image on is selected by: spread, binpack
+   or weighted, and weights of free memory, cpu idle and instance slots
+   left of the node the weighted policy scores the nodes by'''
+PLACEMENT_POLICY = os.environ.get('PLACEMENT_POLICY', 'spread')
+PLACEMENT_WEIGHTS = {
+    name: float(weight) for name, weight in (
+        item.split('=') for item in os.environ.get(
+            'PLACEMENT_WEIGHTS', 'memory=1,cpu=1,slots=1').split(','))}
+
+'''Number of launch jobs run at once and seconds a finished
+   job is kept for its status to be queried'''
+LAUNCH_WORKERS = int(os.environ.get('LAUNCH_WORKERS', 8))
+LAUNCH_JOB_TTL = int(os.environ.get('LAUNCH_JOB_TTL', 600))
+
+'''Seconds to wait for a launch job on remote node and period
+   in seconds its status is polled with'''
+LAUNCH_TIMEOUT = int(os.environ.get('LAUNCH_TIMEOUT', 300))
+LAUNCH_POLL_INTERVAL = float(os.environ.get('LAUNCH_POLL_INTERVAL', 0.25))
+
+'''Instances are leased for ttl seconds, the lease may be extended.
+   The owner is warned the warning seconds before the lease expires and
+   the instance is stopped once it expired, the leases are checked every
+   interval seconds'''
+LEASE_TTL = float(os.environ.get('LEASE_TTL', 8 * 3600))
+LEASE_WARNING = float(os.environ.get('LEASE_WARNING', 900))
+LEASE_REAP_INTERVAL = float(os.environ.get('LEASE_REAP_INTERVAL', 60))
+
+'''Instances without traffic for the timeout seconds are idle, the
+   traffic is checked every interval seconds. Policy applied to idle
+   instances: pause (unpaused once there is traffic again), stop (the
+   lease is cut to the warning seconds) or none (only reported)'''
+IDLE_TIMEOUT = float(os.environ.get('IDLE_TIMEOUT', 1800))
+IDLE_CHECK_INTERVAL = float(os.environ.get('IDLE_CHECK_INTERVAL', 60))
+IDLE_POLICY = os.environ.get('IDLE_POLICY', 'none')
+
+'''Launches waiting for free capacity of the pool: priority classes from
+   the highest, max number of launches waiting, seconds a launch waits at
+   most and seconds between the launch attempts while nothing is freed'''
+LAUNCH_PRIORITY_CLASSES = os.environ.get(
+    'LAUNCH_PRIORITY_CLASSES', 'interactive,ci').split(',')
+LAUNCH_QUEUE_SIZE = int(os.environ.get('LAUNCH_QUEUE_SIZE', 64))
+LAUNCH_QUEUE_TIMEOUT = float(os.environ.get('LAUNCH_QUEUE_TIMEOUT', 900))
+LAUNCH_QUEUE_RETRY_INTERVAL = float(os.environ.get(
+    'LAUNCH_QUEUE_RETRY_INTERVAL', 5))
+
+'''Seconds a slot reserved on the node for a launch is kept, the slot
+   of the launch not finished by then is released'''
+CAPACITY_RESERVATION_TTL = float(os.environ.get(
+    'CAPACITY_RESERVATION_TTL', 2 * LAUNCH_TIMEOUT))
+
+'''Seconds the pool waits for nodes to answer a query sent to all of
+   them, the nodes late to answer are left out of the result and
+   marked degraded, and number of threads querying the nodes'''
+FANOUT_DEADLINE = float(os.environ.get('FANOUT_DEADLINE', 5))
+FANOUT_WORKERS = int(os.environ.get('FANOUT_WORKERS', 32))
+
+'''Seconds to connect to a remote node and to wait for its response'''
+NODE_CONNECT_TIMEOUT = float(os.environ.get('NODE_CONNECT_TIMEOUT', 3))
+NODE_READ_TIMEOUT = float(os.environ.get('NODE_READ_TIMEOUT', 30))
+
+'''Number of failed calls in a row which stop calling the node and
+   seconds between background probes of the node which is not called'''
+BREAKER_FAILURES = int(os.environ.get('BREAKER_FAILURES', 3))
+BREAKER_COOLDOWN = float(os.environ.get('BREAKER_COOLDOWN', 30))
+
+'''Seconds the master keeps the instances and images of the pool'''
+INVENTORY_CACHE_TTL = float(os.environ.get('INVENTORY_CACHE_TTL', 2))
+
+'''Slave nodes push their state to the master: seconds to coalesce
+   changes for, seconds between checks for changes missed and seconds
+   between attempts of the master to connect to the node'''
+STATE_PUSH_DEBOUNCE = float(os.environ.get('STATE_PUSH_DEBOUNCE', 0.1))
+STATE_PUSH_INTERVAL = float(os.environ.get('STATE_PUSH_INTERVAL', 60))
+STATE_RECONNECT_INTERVAL = float(os.environ.get(
+    'STATE_RECONNECT_INTERVAL', 10))
+
+'''Parts of the node state a node returns in one response'''
+STATE_SELECTORS = ['images', 'instances', 'devices', 'host', 'capacity']
+
+'''Smallest size in bytes of node response to be compressed'''
+GZIP_MIN_SIZE = int(os.environ.get('GZIP_MIN_SIZE', 1024))
+
+'''Seconds the master waits for the node to push the change it made'''
+STATE_EXPECT_TIMEOUT = float(os.environ.get('STATE_EXPECT_TIMEOUT', 2))
+
+'''The master pings the nodes every interval seconds: number of the last
+   heartbeats the latency percentiles are taken over, 95th percentile of
+   latency in seconds the node is degraded above and number of heartbeats
+   failed in a row the node is offline after'''
+HEARTBEAT_INTERVAL = float(os.environ.get('HEARTBEAT_INTERVAL', 5))
+HEARTBEAT_WINDOW = int(os.environ.get('HEARTBEAT_WINDOW', 20))
+HEARTBEAT_DEGRADED_LATENCY = float(os.environ.get(
+    'HEARTBEAT_DEGRADED_LATENCY', 1))
+HEARTBEAT_OFFLINE_FAILURES = int(os.environ.get(
+    'HEARTBEAT_OFFLINE_FAILURES', 3))
+
 if os.environ.get('DEBUG', None):
     logging.basicConfig(
         format='%(asctime)s %(name)s %(levelname)s %(message)s',
@@ -0,0 +1,39 @@
+import logging
+
+from node import IMAGE_PROFILES
+from node import ADMISSION_MAX_LOAD
+from node import ADMISSION_MAX_PRESSURE
+from node.capacity import profile_of
+from node.host import host_info
+
+logger = logging.getLogger(__name__)
+
+
+class LaunchRejected(Exception):
+    ''' The node is too loaded to launch the image, the instances running
+        on it would suffer '''
+
+
+def admit(image_name, host=None):
+    ''' Raises LaunchRejected if the node is too loaded to launch the
+        image: load average per core, pressure stall of cpu, memory or
+        io, or memory available. host is the host_info of the node,
+        read if not given '''
+    host = host or host_info()
+    load = host['loadavg'][0] / (host['cores'] or 1)
+    if load > ADMISSION_MAX_LOAD:
+        reject(image_name, 'load {:.2f} per core above {}'.format(
+            load, ADMISSION_MAX_LOAD))
+    for resource, stalled in host.get('pressure', {}).items():
+        if stalled > ADMISSION_MAX_PRESSURE:
+            reject(image_name, '{} pressure {}% above {}%'.format(
+                resource, stalled, ADMISSION_MAX_PRESSURE))
+    needed = IMAGE_PROFILES[profile_of(image_name)]['memory']
+    if host['memory_available'] < needed:
+        reject(image_name, 'memory available {}MiB below {}MiB'.format(
+            host['memory_available'] // 2**20, needed // 2**20))
+
+
+def reject(image_name, reason):
+    logger.warning('launch of {} rejected: {}'.format(image_name, reason))
+    raise LaunchRejected(reason)
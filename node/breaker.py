@@ -0,0 +1,73 @@
+import time
+import logging
+import threading
+
+from node import BREAKER_FAILURES
+from node import BREAKER_COOLDOWN
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    ''' Stops calling a failing node. The breaker opens after failures
+        calls in a row failed, the calls are not let through while it is
+        open. Once it is open the node is probed in background every
+        cooldown seconds, the breaker closes as soon as a probe succeeds.
+        input: name - name of the node used in logs
+               probe - callable returning True if the node is reachable
+               failures - number of failed calls in a row to open
+               cooldown - seconds between probes of the open breaker '''
+    def __init__(self, name, probe, failures=BREAKER_FAILURES,
+                 cooldown=BREAKER_COOLDOWN):
+        self.name = name
+        self.probe = probe
+        self.failures = failures
+        self.cooldown = cooldown
+        self.__lock = threading.Lock()
+        self.__streak = 0
+        self.__opened_at = None
+        self.__prober = None
+
+    def is_open(self):
+        with self.__lock:
+            return self.__opened_at is not None
+
+    def allow(self):
+        ''' Checks if a call may go to the node '''
+        return not self.is_open()
+
+    def success(self):
+        with self.__lock:
+            self.__streak = 0
+
+    def failure(self):
+        with self.__lock:
+            self.__streak += 1
+            if self.__streak < self.failures or self.__opened_at is not None:
+                return
+            self.__opened_at = time.monotonic()
+            logger.warning('node {} failed {} times in a row, not called '
+                           'till it is back'.format(self.name, self.__streak))
+            if self.__prober is None:
+                self.__prober = threading.Thread(
+                    target=self.__probe_loop, name='breaker-probe',
+                    daemon=True)
+                self.__prober.start()
+
+    def __probe_loop(self):
+        while True:
+            time.sleep(self.cooldown)
+            try:
+                reachable = self.probe()
+            except Exception as e:
+                logger.info('probe of node {} failed: {}'.format(
+                    self.name, e))
+                reachable = False
+            if reachable:
+                break
+        with self.__lock:
+            logger.info('node {} is back after {:.0f}s'.format(
+                self.name, time.monotonic() - self.__opened_at))
+            self.__opened_at = None
+            self.__streak = 0
+            self.__prober = None
@@ -0,0 +1,76 @@
+import copy
+import time
+import logging
+import threading
+
+from node import INVENTORY_CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+
+class TtlCache:
+    ''' Results of queries to the pool kept for ttl seconds. Identical
+        queries made at once are coalesced: the first one loads the
+        result, the rest wait for it instead of querying the nodes too.
+        invalidate() drops the results, a load started before it is
+        neither stored nor joined by the queries made after it.
+        Callers get their own copies of the results, they may change
+        them freely '''
+    def __init__(self, ttl=INVENTORY_CACHE_TTL):
+        self.ttl = ttl
+        self.__lock = threading.Lock()
+        self.__results = {}   # key -> (loaded at, result)
+        self.__flights = {}   # key -> load in flight
+        self.__generation = 0
+        self.__stats = {'hits': 0, 'misses': 0, 'coalesced': 0}
+
+    def get(self, key, load):
+        ''' Returns the cached result of the query key, load() is called
+            to get it if there is no fresh result '''
+        with self.__lock:
+            cached = self.__results.get(key)
+            if cached and time.monotonic() - cached[0] < self.ttl:
+                self.__stats['hits'] += 1
+                return copy.deepcopy(cached[1])
+            flight = self.__flights.get(key)
+            if flight and flight['generation'] == self.__generation:
+                self.__stats['coalesced'] += 1
+                loader = False
+            else:
+                self.__stats['misses'] += 1
+                flight = {'generation': self.__generation,
+                          'done': threading.Event(),
+                          'result': None,
+                          'error': None}
+                self.__flights[key] = flight
+                loader = True
+        if loader:
+            self.__load(key, load, flight)
+        else:
+            flight['done'].wait()
+        if flight['error'] is not None:
+            raise flight['error']
+        return copy.deepcopy(flight['result'])
+
+    def __load(self, key, load, flight):
+        try:
+            flight['result'] = load()
+        except Exception as e:
+            flight['error'] = e
+        with self.__lock:
+            if self.__flights.get(key) is flight:
+                del self.__flights[key]
+            if flight['error'] is None and \
+                    flight['generation'] == self.__generation:
+                self.__results[key] = (time.monotonic(), flight['result'])
+        flight['done'].set()
+
+    def invalidate(self):
+        with self.__lock:
+            self.__generation += 1
+            self.__results.clear()
+
+    def stats(self):
+        ''' Returns the counters of hits, misses and coalesced queries '''
+        with self.__lock:
+            return dict(self.__stats)
@@ -0,0 +1,74 @@
+import time
+import logging
+import threading
+
+from node import IMAGE_PROFILES
+from node import CAPACITY_RESERVED_CORES
+from node import CAPACITY_RESERVED_MEMORY
+from node import CAPACITY_NO_KVM_FACTOR
+from node import CAPACITY_REFRESH_INTERVAL
+from node.host import host_info
+
+logger = logging.getLogger(__name__)
+
+
+def profile_of(image_name):
+    ''' Returns the name of the resource profile of the image '''
+    for pattern in IMAGE_PROFILES:
+        if pattern != 'default' and pattern in image_name.lower():
+            return pattern
+    return 'default'
+
+
+def capacity(host):
+    ''' Returns dict of profile name: number of instances of the profile
+        fitting in the host resources, as returned by host_info '''
+    cores = (host['cores'] or 0) - CAPACITY_RESERVED_CORES
+    memory = host['memory_total'] - CAPACITY_RESERVED_MEMORY
+    result = {}
+    for name, profile in IMAGE_PROFILES.items():
+        cores_needed = profile['cores'] * (
+            1 if host['kvm'] else CAPACITY_NO_KVM_FACTOR)
+        result[name] = max(0, int(min(cores // cores_needed,
+                                      memory // profile['memory'])))
+    return result
+
+
+class NodeCapacity:
+    ''' Capacity of the node the process runs on, computed at start and
+        every interval seconds in background, the resources of the node
+        may change while it runs
+        input: interval - seconds between the computations '''
+    def __init__(self, interval=CAPACITY_REFRESH_INTERVAL):
+        self.interval = interval
+        self.__lock = threading.Lock()
+        self.__capacity = None
+        self.__refresher = None
+
+    def get(self):
+        ''' Returns dict of profile name: number of instances '''
+        with self.__lock:
+            if self.__refresher is None:
+                self.__capacity = self.__compute()
+                self.__refresher = threading.Thread(
+                    target=self.__refresh_loop, name='capacity',
+                    daemon=True)
+                self.__refresher.start()
+            return dict(self.__capacity)
+
+    def __compute(self):
+        result = capacity(host_info())
+        if result != self.__capacity:
+            logger.info('node capacity: {}'.format(result))
+        return result
+
+    def __refresh_loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                result = self.__compute()
+            except Exception as e:
+                logger.error('capacity refresh failed: {}'.format(e))
+                continue
+            with self.__lock:
+                self.__capacity = result
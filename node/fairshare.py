@@ -0,0 +1,229 @@
+import time
+import logging
+import itertools
+import threading
+from concurrent.futures import Future
+
+from node import LAUNCH_PRIORITY_CLASSES
+from node import LAUNCH_QUEUE_SIZE
+from node import LAUNCH_QUEUE_TIMEOUT
+from node import LAUNCH_QUEUE_RETRY_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+class FairShareQueue:
+    ''' Launches waiting for free capacity of the pool. The launch is
+        attempted at once if nobody waits, otherwise it waits for its
+        turn. The turns go by priority class first, then round robin among
+        the owners: the first launches of every owner go before the second
+        ones, the owner served least recently first, then in order of
+        arrival. The launch in turn is attempted once capacity
+        is freed, or every retry seconds as capacity freed on remote nodes
+        is not told. Waiting launches get their position and estimated
+        seconds to wait whenever they change.
+        Waiting launches do not hold threads: they are kept in the queue
+        and the attempts are handed to run one at a time once dispatched.
+        input: classes - priority classes from the highest
+               size - max number of launches waiting
+               timeout - seconds a launch waits at most
+               retry - seconds between attempts while nothing is freed
+               run - callable running the function passed in a worker,
+                     returns its Future, a thread per attempt by default '''
+    def __init__(self, classes=LAUNCH_PRIORITY_CLASSES,
+                 size=LAUNCH_QUEUE_SIZE, timeout=LAUNCH_QUEUE_TIMEOUT,
+                 retry=LAUNCH_QUEUE_RETRY_INTERVAL, run=None):
+        self.classes = classes
+        self.size = size
+        self.timeout = timeout
+        self.retry = retry
+        self.run = run or run_in_thread
+        self.__cv = threading.Condition()
+        self.__waiting = []
+        self.__seq = itertools.count()
+        self.__served = {}   # owner -> seq of the last turn served
+        self.__freed = True
+        self.__attempting = None  # entry which attempt is running
+        self.__attempted_at = 0
+        self.__served_at = None
+        self.__interval = None  # average seconds between launches served
+        self.__dispatcher = None
+
+    def submit(self, owner, priority, attempt, progress=None):
+        ''' Returns Future of the result of attempt() once it is not None.
+            attempt is run in the owner turn, progress is called with
+            waiting stage and keyword info position and eta while it
+            waits. The result is None if the queue is full or it waited
+            too long, the error of attempt() if it raised '''
+        future = Future()
+        entry = {'owner': owner,
+                 'priority': priority if priority in self.classes
+                 else self.classes[0],
+                 'attempt': attempt,
+                 'progress': progress or (lambda stage, **info: None),
+                 'future': future,
+                 'reported': None}
+        with self.__cv:
+            direct = not self.__waiting
+        if direct:
+            self.run(attempt).add_done_callback(
+                lambda done: self.__queue(entry, done))
+        else:
+            self.__queue(entry)
+        return future
+
+    def __queue(self, entry, direct=None):
+        if direct is not None and (direct.exception() is not None or
+                                   direct.result() is not None):
+            resolve(entry['future'], direct)
+            return
+        with self.__cv:
+            if len(self.__waiting) >= self.size:
+                logger.warning('launch queue is full, {} launch rejected'
+                               .format(entry['owner']))
+                entry['future'].set_result(None)
+                return
+            entry['seq'] = next(self.__seq)
+            entry['deadline'] = time.monotonic() + self.timeout
+            self.__waiting.append(entry)
+            self.__start_dispatcher()
+            self.__cv.notify_all()
+        logger.info('launch of {} ({}) queued'.format(
+            entry['owner'], entry['priority']))
+        self.__report()
+
+    def __start_dispatcher(self):
+        if self.__dispatcher is None:
+            self.__dispatcher = threading.Thread(
+                target=self.__dispatch_loop, name='launch-queue',
+                daemon=True)
+            self.__dispatcher.start()
+
+    def __dispatch_loop(self):
+        while True:
+            with self.__cv:
+                now = time.monotonic()
+                self.__cv.wait_for(self.__due, max(0, min(
+                    [self.retry] + [entry['deadline'] - now
+                                    for entry in self.__waiting])))
+                expired = self.__expire()
+                entry = self.__due()
+                if entry is not None:
+                    self.__attempting = entry
+                    self.__attempted_at = time.monotonic()
+                    self.__freed = False
+            for late in expired:
+                logger.warning('launch of {} waited too long'.format(
+                    late['owner']))
+                late['future'].set_result(None)
+            if expired:
+                self.__report()
+            if entry is not None:
+                self.run(entry['attempt']).add_done_callback(
+                    lambda done, entry=entry: self.__attempted(entry, done))
+
+    def __due(self):
+        ''' Returns the launch in turn if it is to be attempted now '''
+        entry = self.__next()
+        if entry is None or self.__attempting is not None:
+            return None
+        if self.__freed or \
+                time.monotonic() - self.__attempted_at >= self.retry:
+            return entry
+        return None
+
+    def __expire(self):
+        now = time.monotonic()
+        expired = [entry for entry in self.__waiting
+                   if entry['deadline'] <= now and
+                   entry is not self.__attempting]
+        for entry in expired:
+            self.__waiting.remove(entry)
+        return expired
+
+    def __attempted(self, entry, done):
+        with self.__cv:
+            self.__attempting = None
+            launched = done.exception() is not None or \
+                done.result() is not None
+            if launched:
+                self.__waiting.remove(entry)
+                self.__serve(entry)
+                # the capacity may be left for the next one
+                self.__freed = True
+            self.__cv.notify_all()
+        if launched:
+            resolve(entry['future'], done)
+            self.__report()
+
+    def freed(self):
+        ''' Lets the queue know the capacity may have been freed '''
+        with self.__cv:
+            self.__freed = True
+            self.__cv.notify_all()
+
+    def waiting(self):
+        ''' Returns the list of owner and priority of the launches waiting
+            in order of their turns '''
+        with self.__cv:
+            return [(entry['owner'], entry['priority'])
+                    for entry in self.__ordered()]
+
+    def __ordered(self):
+        rounds = {}
+        counts = {}
+        for entry in self.__waiting:
+            key = (entry['owner'], entry['priority'])
+            rounds[entry['seq']] = counts.get(key, 0)
+            counts[key] = rounds[entry['seq']] + 1
+        return sorted(self.__waiting, key=lambda entry: (
+            self.classes.index(entry['priority']),
+            rounds[entry['seq']],
+            self.__served.get(entry['owner'], -1),
+            entry['seq']))
+
+    def __next(self):
+        ordered = self.__ordered()
+        return ordered[0] if ordered else None
+
+    def __serve(self, entry):
+        self.__served[entry['owner']] = next(self.__seq)
+        now = time.monotonic()
+        if self.__served_at is not None:
+            interval = now - self.__served_at
+            self.__interval = interval if self.__interval is None else \
+                0.8 * self.__interval + 0.2 * interval
+        self.__served_at = now
+
+    def __report(self):
+        with self.__cv:
+            reports = []
+            for position, entry in enumerate(self.__ordered(), start=1):
+                eta = None if self.__interval is None else \
+                    round(position * self.__interval)
+                if entry['reported'] != (position, eta):
+                    entry['reported'] = (position, eta)
+                    reports.append((entry['progress'], position, eta))
+        for progress, position, eta in reports:
+            progress('waiting', position=position, eta=eta)
+
+
+def run_in_thread(fn):
+    ''' Runs fn in a thread of its own, returns Future of its result '''
+    future = Future()
+
+    def run():
+        try:
+            future.set_result(fn())
+        except Exception as e:
+            future.set_exception(e)
+    threading.Thread(target=run, name='launch-attempt', daemon=True).start()
+    return future
+
+
+def resolve(future, done):
+    ''' Sets the result of the future to the one of the done future '''
+    if done.exception() is not None:
+        future.set_exception(done.exception())
+    else:
+        future.set_result(done.result())
@@ -0,0 +1,105 @@
+import time
+import logging
+import threading
+from enum import Enum
+from collections import deque
+
+from node import HEARTBEAT_WINDOW
+from node import HEARTBEAT_DEGRADED_LATENCY
+from node import HEARTBEAT_OFFLINE_FAILURES
+
+logger = logging.getLogger(__name__)
+
+
+class NodeAvailState(Enum):
+    OFFLINE = 0
+    ONLINE = 1
+    DEGRADED = 2  # slow or missing to answer
+
+    def __str__(self):
+        return self.name
+
+
+class NodeHealth:
+    ''' Health of the node as seen by the heartbeats: latencies of the
+        last window heartbeats answered and number of heartbeats failed
+        in a row. The node is offline after offline_failures heartbeats
+        failed in a row, degraded if the last heartbeat failed or the
+        95th percentile of latency is above degraded_latency seconds.
+        The node is online till the first heartbeat '''
+    def __init__(self, name, window=HEARTBEAT_WINDOW,
+                 degraded_latency=HEARTBEAT_DEGRADED_LATENCY,
+                 offline_failures=HEARTBEAT_OFFLINE_FAILURES):
+        self.name = name
+        self.degraded_latency = degraded_latency
+        self.offline_failures = offline_failures
+        self.__lock = threading.Lock()
+        self.__latencies = deque(maxlen=window)
+        self.__streak = 0
+        self.__last_seen = None
+        self.__beats = 0
+        self.__state = NodeAvailState.ONLINE
+
+    def beat(self, latency):
+        ''' Records the heartbeat answered in latency seconds '''
+        with self.__lock:
+            self.__beats += 1
+            self.__latencies.append(latency)
+            self.__streak = 0
+            self.__last_seen = time.time()
+            self.__update()
+
+    def miss(self):
+        ''' Records the heartbeat failed '''
+        with self.__lock:
+            self.__beats += 1
+            self.__streak += 1
+            self.__update()
+
+    @property
+    def state(self):
+        with self.__lock:
+            return self.__state
+
+    def has_beats(self):
+        with self.__lock:
+            return self.__beats > 0
+
+    def percentile(self, q):
+        ''' Returns the q-th percentile of the latencies in seconds or
+            None if no heartbeat was answered '''
+        with self.__lock:
+            return self.__percentile(q)
+
+    def info(self):
+        ''' Returns the health as dict: state, latency percentiles,
+            heartbeats failed in a row and time the node answered last '''
+        with self.__lock:
+            return {
+                'state': self.__state,
+                'latency_p50': self.__percentile(50),
+                'latency_p95': self.__percentile(95),
+                'latency_p99': self.__percentile(99),
+                'failures': self.__streak,
+                'last_seen': self.__last_seen}
+
+    def __percentile(self, q):
+        if not self.__latencies:
+            return None
+        latencies = sorted(self.__latencies)
+        rank = max(0, -(-len(latencies) * q // 100) - 1)  # nearest rank
+        return latencies[int(rank)]
+
+    def __update(self):
+        if self.__streak >= self.offline_failures:
+            state = NodeAvailState.OFFLINE
+        elif self.__streak or (self.__latencies and self.__percentile(95) >
+                               self.degraded_latency):
+            state = NodeAvailState.DEGRADED
+        else:
+            state = NodeAvailState.ONLINE
+        if state != self.__state:
+            logger.info('node {} is {} after {} heartbeats failed, latency '
+                        'p95 {}'.format(self.name, state, self.__streak,
+                                        self.__percentile(95)))
+        self.__state = state
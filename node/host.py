@@ -0,0 +1,52 @@
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def host_info():
+    ''' Returns the resources of the host the node is running on: number
+        of cores, total and available memory in bytes, load average
+        over 1, 5 and 15 minutes, pressure stall information and if kvm
+        is available '''
+    memory = meminfo()
+    return {
+        'cores': os.cpu_count(),
+        'memory_total': memory.get('MemTotal', 0),
+        'memory_available': memory.get('MemAvailable', 0),
+        'loadavg': list(os.getloadavg()),
+        'pressure': pressure(),
+        'kvm': os.path.exists('/dev/kvm')}
+
+
+def pressure():
+    ''' Returns dict of resource (cpu, memory, io): share in percent of
+        time some tasks stalled on the resource over the last 10 seconds.
+        Resources the kernel does not report pressure of are left out '''
+    result = {}
+    for resource in ('cpu', 'memory', 'io'):
+        try:
+            with open('/proc/pressure/' + resource) as f:
+                for line in f:
+                    kind, *values = line.split()
+                    if kind == 'some':
+                        values = dict(v.split('=') for v in values)
+                        result[resource] = float(values['avg10'])
+        except (OSError, ValueError, KeyError):
+            pass
+    return result
+
+
+def meminfo():
+    ''' Returns /proc/meminfo as dict of name: bytes '''
+    memory = {}
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                name, value = line.split(':', 1)
+                value = value.split()
+                memory[name] = int(value[0]) * (
+                    1024 if value[1:] == ['kB'] else 1)
+    except OSError as e:
+        logger.error('failed to read memory info: {}'.format(e))
+    return memory
@@ -0,0 +1,116 @@
+import time
+import logging
+import threading
+
+from node import IDLE_TIMEOUT
+from node import IDLE_CHECK_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+def through_envoy(instance):
+    ''' Checks if the users reach the instance through envoy, the link
+        of the ones routed by envoy is /instance/<id>. The rest are used
+        by direct links, adb or telnet envoy does not count '''
+    return '/instance/' in instance.get('link', '')
+
+
+class IdleDetector:
+    ''' Flags the instances nobody uses. The traffic counters of the
+        instances are checked every interval seconds, an instance which
+        counters did not change for timeout seconds is idle. The idle
+        instance is active again as soon as its counters change.
+        Instances without counters, the ones not routed, and the ones the
+        users do not reach through envoy are not judged, neither are any
+        while the counters can not be got. The instance not listed is
+        forgotten only if its node reported, the idle timers of the
+        instances of the nodes late to answer keep running.
+        input: instances - callable returning dict of ident: instance
+               stats - callable returning dict of ident: counters
+               on_idle - called with the ident and the instance gone idle
+               on_active - called with the ident and the idle instance
+                           used again
+               timeout - seconds without traffic an instance is idle after
+               interval - seconds between the checks of the counters
+               judged - predicate telling if the traffic of the instance
+                        goes through envoy
+               reported - callable telling if the node of the instance,
+                          taking its ident, reported in the last listing '''
+    def __init__(self, instances, stats, on_idle, on_active=None,
+                 timeout=IDLE_TIMEOUT, interval=IDLE_CHECK_INTERVAL,
+                 judged=through_envoy, reported=lambda ident: True):
+        self.instances = instances
+        self.stats = stats
+        self.on_idle = on_idle
+        self.on_active = on_active
+        self.timeout = timeout
+        self.interval = interval
+        self.judged = judged
+        self.reported = reported
+        self.__lock = threading.Lock()
+        self.__seen = {}  # ident -> counters, last active at, idle flag
+        self.__checker = None
+
+    def start(self):
+        ''' Starts the checks, does nothing if already started '''
+        with self.__lock:
+            if self.__checker is None:
+                self.__checker = threading.Thread(
+                    target=self.__check_loop, name='idle-detector',
+                    daemon=True)
+                self.__checker.start()
+
+    def idle(self):
+        ''' Returns dict of ident: seconds since the last traffic of the
+            idle instances '''
+        now = time.monotonic()
+        with self.__lock:
+            return {ident: now - seen['active_at']
+                    for ident, seen in self.__seen.items() if seen['idle']}
+
+    def check(self):
+        ''' Compares the counters with the ones seen last time, flags the
+            instances gone idle and the idle ones used again '''
+        stats = self.stats()
+        instances = self.instances()
+        now = time.monotonic()
+        changed = []
+        with self.__lock:
+            self.__seen = {k: v for k, v in self.__seen.items()
+                           if k in instances or not self.reported(k)}
+            for ident, instance in instances.items():
+                counters = stats.get(ident)
+                if counters is None or not self.judged(instance):
+                    self.__seen.pop(ident, None)
+                    continue
+                seen = self.__seen.get(ident)
+                if seen is None:
+                    self.__seen[ident] = {'counters': counters,
+                                          'active_at': now, 'idle': False}
+                    continue
+                if counters != seen['counters']:
+                    seen['counters'] = counters
+                    seen['active_at'] = now
+                    if seen['idle']:
+                        seen['idle'] = False
+                        changed.append((self.on_active, ident, instance))
+                elif not seen['idle'] and \
+                        now - seen['active_at'] >= self.timeout:
+                    seen['idle'] = True
+                    changed.append((self.on_idle, ident, instance))
+        for callback, ident, instance in changed:
+            logger.info('instance {} is {}'.format(
+                ident, 'idle' if callback is self.on_idle else 'active'))
+            try:
+                if callback:
+                    callback(ident, instance)
+            except Exception as e:
+                logger.error('idle policy of {} failed: {}'.format(ident, e))
+
+    def __check_loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception as e:
+                logger.error('idle check failed: {}'.format(e))
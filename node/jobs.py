@@ -0,0 +1,133 @@
+import time
+import uuid
+import logging
+import threading
+
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+
+from node import LAUNCH_WORKERS
+from node import LAUNCH_JOB_TTL
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue:
+    ''' Runs jobs in a pool of worker threads. A job reports stages it
+        passes through, every stage is recorded in the job and passed
+        to on_event, so the caller gets the progress without waiting
+        for the job to finish.
+        input: workers - number of jobs run at once
+               on_event - called with the copy of job on every stage
+               ttl - seconds a finished job is kept
+        Job is a dict of id, owner, state (queued, running, done or
+        failed), stages as list of {'stage', 'at', **info} dicts, result
+        returned by the job function and error if it raised. The job
+        function may return a Future, the job is finished with its result
+        then, the worker is not held meanwhile '''
+    def __init__(self, workers=LAUNCH_WORKERS, on_event=None,
+                 ttl=LAUNCH_JOB_TTL):
+        self.on_event = on_event
+        self.ttl = ttl
+        self.__lock = threading.Lock()
+        self.__jobs = {}
+        self.__executor = ThreadPoolExecutor(max_workers=workers,
+                                             thread_name_prefix='job')
+
+    def submit(self, fn, *args, owner='', **kwargs):
+        ''' Queues fn(progress, *args, **kwargs), progress is the callable
+            taking the stage name and keyword info. Returns the job id '''
+        job_id = uuid.uuid4().hex
+        with self.__lock:
+            self.__expire()
+            self.__jobs[job_id] = {
+                'id': job_id,
+                'owner': owner,
+                'state': 'queued',
+                'stages': [],
+                'result': None,
+                'error': None,
+                'finished_at': None}
+        self.__stage(job_id, 'queued')
+        self.__executor.submit(self.__run, job_id, fn, args, kwargs)
+        return job_id
+
+    def execute(self, fn, *args, **kwargs):
+        ''' Runs fn(*args, **kwargs) in a worker as a part of a job
+            already running. Returns the Future of its result '''
+        return self.__executor.submit(fn, *args, **kwargs)
+
+    def get(self, job_id):
+        ''' Returns the copy of the job or None if there is no such job '''
+        with self.__lock:
+            job = self.__jobs.get(job_id)
+            return self.__copy(job) if job else None
+
+    def pending(self, owner):
+        ''' Returns the number of jobs of the owner not finished yet '''
+        with self.__lock:
+            return len([job for job in self.__jobs.values()
+                        if job['owner'] == owner and
+                        job['state'] in ('queued', 'running')])
+
+    def __run(self, job_id, fn, args, kwargs):
+        with self.__lock:
+            self.__jobs[job_id]['state'] = 'running'
+
+        def progress(stage, **info):
+            self.__stage(job_id, stage, **info)
+
+        try:
+            result = fn(progress, *args, **kwargs)
+        except Exception as e:
+            self.__finish(job_id, error=e)
+            return
+        if isinstance(result, Future):
+            def finish(done):
+                if done.exception() is not None:
+                    self.__finish(job_id, error=done.exception())
+                else:
+                    self.__finish(job_id, done.result())
+            result.add_done_callback(finish)
+        else:
+            self.__finish(job_id, result)
+
+    def __finish(self, job_id, result=None, error=None):
+        if error is not None:
+            logger.error('job {} failed: {}'.format(job_id, error))
+            with self.__lock:
+                self.__jobs[job_id]['error'] = str(error)
+                self.__jobs[job_id]['state'] = 'failed'
+            self.__stage(job_id, 'failed')
+        else:
+            with self.__lock:
+                self.__jobs[job_id]['result'] = result
+                self.__jobs[job_id]['state'] = 'done'
+            self.__stage(job_id, 'done')
+
+    def __stage(self, job_id, stage, **info):
+        with self.__lock:
+            job = self.__jobs[job_id]
+            job['stages'].append({'stage': stage, 'at': time.time(), **info})
+            if stage in ('done', 'failed'):
+                job['finished_at'] = time.monotonic()
+            job = self.__copy(job)
+        logger.info('job {} {}'.format(job_id, stage))
+        if self.on_event:
+            try:
+                self.on_event(job)
+            except Exception as e:
+                logger.error('job event of {} not delivered: {}'.format(
+                    job_id, e))
+
+    def __expire(self):
+        now = time.monotonic()
+        self.__jobs = {k: v for k, v in self.__jobs.items()
+                       if v['finished_at'] is None or
+                       now - v['finished_at'] < self.ttl}
+
+    def __copy(self, job):
+        job = dict(job)
+        job['stages'] = [dict(stage) for stage in job['stages']]
+        job.pop('finished_at')
+        return job
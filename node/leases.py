@@ -0,0 +1,151 @@
+import time
+import logging
+import threading
+
+from node import LEASE_TTL
+from node import LEASE_WARNING
+from node import LEASE_REAP_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseKeeper:
+    ''' Leases of the instances. An instance is leased for ttl seconds at
+        launch, the lease may be extended. The reaper checks the leases
+        every interval seconds: the owner of the instance which lease
+        expires in warning seconds is warned once, the instance which
+        lease expired is stopped. The instances found without lease, the
+        ones launched bypassing the keeper or before the keeper started,
+        are leased for ttl seconds from then. The lease of the instance
+        not listed is dropped only if its node reported, the instances
+        of the nodes late to answer keep their leases.
+        input: instances - callable returning dict of ident: instance
+               stop - callable stopping the instance, taking its ident
+                      and the instance
+               on_warning - called with the ident, the instance and the
+                            lease before the instance is stopped
+               ttl - seconds an instance is leased for
+               warning - seconds before the expiry the owner is warned
+               interval - seconds between the checks of the leases
+               reported - callable telling if the node of the instance,
+                          taking its ident, reported in the last listing
+        Lease is a dict of owner and expires_at (seconds since epoch) '''
+    def __init__(self, instances, stop, on_warning=None, ttl=LEASE_TTL,
+                 warning=LEASE_WARNING, interval=LEASE_REAP_INTERVAL,
+                 reported=lambda ident: True):
+        self.instances = instances
+        self.stop = stop
+        self.on_warning = on_warning
+        self.ttl = ttl
+        self.warning = warning
+        self.interval = interval
+        self.reported = reported
+        self.__lock = threading.Lock()
+        self.__leases = {}  # ident -> lease
+        self.__reaper = None
+
+    def start(self):
+        ''' Starts the reaper, does nothing if already started '''
+        with self.__lock:
+            if self.__reaper is None:
+                self.__reaper = threading.Thread(
+                    target=self.__reap_loop, name='lease-reaper',
+                    daemon=True)
+                self.__reaper.start()
+
+    def grant(self, ident, owner):
+        ''' Leases the instance launched for ttl seconds '''
+        with self.__lock:
+            self.__leases[ident] = {'owner': owner,
+                                    'expires_at': time.time() + self.ttl,
+                                    'warned': False}
+            return self.__copy(self.__leases[ident])
+
+    def extend(self, ident, seconds=None):
+        ''' Extends the lease by seconds, ttl by default, but to at most
+            ttl seconds from now. Returns the lease or None if the
+            instance is not leased '''
+        seconds = self.ttl if seconds is None else seconds
+        with self.__lock:
+            lease = self.__leases.get(ident)
+            if lease is None:
+                return None
+            now = time.time()
+            lease['expires_at'] = min(
+                max(lease['expires_at'], now) + seconds, now + self.ttl)
+            lease['warned'] = False
+            logger.info('lease of instance {} extended till {}'.format(
+                ident, time.ctime(lease['expires_at'])))
+            return self.__copy(lease)
+
+    def shorten(self, ident, seconds):
+        ''' Cuts the lease to expire in seconds at the latest, the owner
+            is warned again. Returns the lease or None if the instance is
+            not leased '''
+        with self.__lock:
+            lease = self.__leases.get(ident)
+            if lease is None:
+                return None
+            expires_at = time.time() + seconds
+            if expires_at < lease['expires_at']:
+                lease['expires_at'] = expires_at
+                lease['warned'] = False
+                logger.info('lease of instance {} cut till {}'.format(
+                    ident, time.ctime(expires_at)))
+            return self.__copy(lease)
+
+    def get(self, ident):
+        ''' Returns the lease of the instance or None '''
+        with self.__lock:
+            lease = self.__leases.get(ident)
+            return self.__copy(lease) if lease else None
+
+    def reap(self):
+        ''' Warns the owners of the leases about to expire and stops the
+            instances which leases expired '''
+        instances = self.instances()
+        now = time.time()
+        warn = []
+        expired = []
+        with self.__lock:
+            self.__leases = {k: v for k, v in self.__leases.items()
+                             if k in instances or not self.reported(k)}
+            for ident, instance in instances.items():
+                lease = self.__leases.setdefault(ident, {
+                    'owner': instance.get('owner'),
+                    'expires_at': now + self.ttl,
+                    'warned': False})
+                if lease['expires_at'] <= now:
+                    expired.append((ident, instance))
+                    del self.__leases[ident]
+                elif lease['expires_at'] - now <= self.warning and \
+                        not lease['warned']:
+                    lease['warned'] = True
+                    warn.append((ident, instance, self.__copy(lease)))
+        for ident, instance, lease in warn:
+            logger.info('lease of instance {} expires at {}'.format(
+                ident, time.ctime(lease['expires_at'])))
+            try:
+                if self.on_warning:
+                    self.on_warning(ident, instance, lease)
+            except Exception as e:
+                logger.error('lease warning of {} not delivered: {}'.format(
+                    ident, e))
+        for ident, instance in expired:
+            logger.info('lease of instance {} expired, stopping'.format(
+                ident))
+            try:
+                self.stop(ident, instance)
+            except Exception as e:
+                logger.error('instance {} not stopped: {}'.format(ident, e))
+
+    def __reap_loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.reap()
+            except Exception as e:
+                logger.error('lease reaper failed: {}'.format(e))
+
+    def __copy(self, lease):
+        return {'owner': lease['owner'], 'expires_at': lease['expires_at']}
@@ -0,0 +1,67 @@
+import time
+import uuid
+import logging
+import threading
+
+from node import CAPACITY_RESERVATION_TTL
+
+logger = logging.getLogger(__name__)
+
+
+class CapacityLedger:
+    ''' Slots reserved on the nodes for the launches in progress. The node
+        is selected and its slot reserved at once, so the launches made at
+        the same time do not select the node which has one slot left all
+        together. The slot is confirmed once the instance is launched and
+        released if the launch fails. The slot is counted on top of the
+        instances the node reported unless it was confirmed before the
+        node was queried, the instance is reported then. The slots are
+        dropped after ttl seconds, the launch not finished by then too
+        input: ttl - seconds to keep the slots for '''
+    def __init__(self, ttl=CAPACITY_RESERVATION_TTL):
+        self.ttl = ttl
+        self.__lock = threading.Lock()
+        self.__slots = {}  # token -> node index, confirmed at, expires at
+
+    def reserve(self, queried_at, select):
+        ''' Calls select with dict of node index: number of slots reserved
+            on the node, which the nodes queried at queried_at (monotonic
+            time) did not report yet. Reserves a slot on the node index
+            select returns and returns the index and the reservation
+            token, (None, None) if select returns None '''
+        with self.__lock:
+            now = time.monotonic()
+            for token in [k for k, v in self.__slots.items()
+                          if v['expires'] < now]:
+                slot = self.__slots.pop(token)
+                if slot['confirmed'] is None:
+                    logger.warning('slot {} on node {} expired'.format(
+                        token, slot['node']))
+            reserved = {}
+            for slot in self.__slots.values():
+                if slot['confirmed'] is None or \
+                        slot['confirmed'] > queried_at:
+                    reserved[slot['node']] = reserved.get(slot['node'], 0) + 1
+            index = select(reserved)
+            if index is None:
+                return (None, None)
+            token = uuid.uuid4().hex
+            self.__slots[token] = {'node': index,
+                                   'confirmed': None,
+                                   'expires': now + self.ttl}
+        logger.info('reserved slot {} on node {}'.format(token, index))
+        return (index, token)
+
+    def confirm(self, token):
+        ''' The instance is launched in the slot '''
+        with self.__lock:
+            if token in self.__slots:
+                self.__slots[token]['confirmed'] = time.monotonic()
+
+    def release(self, token):
+        ''' The launch in the slot failed '''
+        with self.__lock:
+            slot = self.__slots.pop(token, None)
+        if slot is not None:
+            logger.info('released slot {} on node {}'.format(
+                token, slot['node']))
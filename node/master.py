@@ -1,61 +1,226 @@
+import copy
 import json
-import random
+import time
 import logging
 import requests
 import socketio
 import threading
-from enum import Enum
 
 from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
 
 import emulator
 from emulator import HOSTNAME
-from node import MAX_INSTANCES_PER_NODE
+from emulator import INSTANCE_ID_LIMIT
+from node import LAUNCH_TIMEOUT
+from node import LAUNCH_POLL_INTERVAL
+from node import FANOUT_DEADLINE
+from node import FANOUT_WORKERS
+from node import NODE_CONNECT_TIMEOUT
+from node import NODE_READ_TIMEOUT
+from node.breaker import CircuitBreaker
+from node.cache import TtlCache
+from node.state import NodeReplica
+from node import STATE_EXPECT_TIMEOUT
+from node import STATE_SELECTORS
+from node import HEARTBEAT_INTERVAL
+from node.health import NodeAvailState
+from node.health import NodeHealth
+from node.host import host_info
+from node.capacity import NodeCapacity
+from node.placement import PlacementEngine
+from node.ledger import CapacityLedger
+from node.admission import admit
+from node.admission import LaunchRejected
 
 logger = logging.getLogger(__name__)
 
-
-class NodeAvailState(Enum):
-    OFFLINE = 0
-    ONLINE = 1
-
-    def __str__(self):
-        return 'ONLINE' if self.value else 'OFFLINE'
+fanout_executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS,
+                                     thread_name_prefix='fanout')
 
 
 class RemoteNode:
-    ''' Represents a node running on remote machine '''
+    ''' Represents a node running on remote machine. Requests to the node
+        go through the persistent session keeping connections alive and
+        through the circuit breaker, the node failing the requests is not
+        called till it is back. Availability of the node is the state of
+        its breaker and its health kept by the heartbeats. Instances and
+        images are read from the replica of the node state pushed by the
+        node, the node is requested only while the replica is not
+        synced '''
     def __init__(self, node_url):
         self.node_url = node_url
-        self.avail_state = NodeAvailState.OFFLINE
-
-    def __request_node(self, api_path, params={}):
+        self.replica = NodeReplica(node_url)
+        self.session = requests.Session()
+        self.session.mount('http://', requests.adapters.HTTPAdapter(
+            pool_maxsize=FANOUT_WORKERS))
+        self.breaker = CircuitBreaker(node_url, self.ping)
+        self.health = NodeHealth(node_url)
+        self.__late = False
+        self.__tagged = {}  # request -> etag and response tagged by it
+
+    @property
+    def avail_state(self):
+        health = self.health.state
+        if self.breaker.is_open() or health == NodeAvailState.OFFLINE:
+            return NodeAvailState.OFFLINE
+        if self.__late or health == NodeAvailState.DEGRADED:
+            return NodeAvailState.DEGRADED
+        return NodeAvailState.ONLINE
+
+    @avail_state.setter
+    def avail_state(self, state):
+        ''' The pool marks the node degraded if it is late to answer,
+            the rest of the states come from the breaker and health '''
+        self.__late = state == NodeAvailState.DEGRADED
+
+    def ping(self):
+        ''' Sends the heartbeat to the node and records it to the health,
+            returns True if the node answered, any response is fine '''
+        started = time.monotonic()
         try:
-            url = self.node_url + api_path
-            req = requests.get(url, params=params)
-            self.avail_state = NodeAvailState.ONLINE
-            logger.info('got response from node {}:'.format(url))
-            logger.info(req.json())
-            return req.json()
-        except Exception as e:
-            self.avail_state = NodeAvailState.OFFLINE
+            req = self.session.get(self.node_url + '/ping',
+                                   timeout=NODE_CONNECT_TIMEOUT)
+        except requests.RequestException as e:
+            logger.info('node {} missed heartbeat: {}'.format(
+                self.node_url, e))
+            self.health.miss()
+            return False
+        if req.status_code >= 500:
+            self.health.miss()
+            return False
+        self.health.beat(time.monotonic() - started)
+        return True
+
+    def __request_node(self, api_path, params={},
+                       read_timeout=NODE_READ_TIMEOUT, conditional=False):
+        ''' Requests the node, conditional request is answered with the
+            response got earlier if the node tells it is not modified '''
+        url = self.node_url + api_path
+        if not self.breaker.allow() or \
+                self.health.state == NodeAvailState.OFFLINE:
             logger.info('node {} not available'.format(self.node_url))
             return {}
+        key = (api_path, tuple(sorted(params.items())))
+        tagged = self.__tagged.get(key) if conditional else None
+        try:
+            req = self.session.get(
+                url, params=params,
+                headers={'If-None-Match': tagged[0]} if tagged else {},
+                timeout=(NODE_CONNECT_TIMEOUT, read_timeout))
+        except requests.RequestException as e:
+            self.breaker.failure()
+            logger.info('node {} not available: {}'.format(
+                self.node_url, e))
+            return {}
+        if req.status_code >= 500:
+            self.breaker.failure()
+        else:
+            self.breaker.success()
+        if req.status_code == 304 and tagged:
+            logger.info('node {} not modified since {}'.format(
+                url, tagged[0]))
+            return copy.deepcopy(tagged[1])
+        try:
+            response = req.json()
+        except ValueError:
+            logger.info('node {} responded {}'.format(url, req.status_code))
+            return {}
+        logger.info('got response from node {}:'.format(url))
+        logger.info(response)
+        if conditional and req.headers.get('ETag'):
+            self.__tagged[key] = (req.headers['ETag'],
+                                  copy.deepcopy(response))
+        return response
 
     def list_images(self, registry=None, name_pattern=''):
-        return self.__request_node('/images', {'pattern': name_pattern})
+        self.replica.start()
+        images = self.replica.get('images')
+        if images is not None:
+            return {k: v for k, v in images.items() if name_pattern in k}
+        return self.__request_node('/images', {'pattern': name_pattern},
+                                   conditional=True)
 
     def list_containers(self):
-        return self.__request_node('/instances')
-
-    def start_image(self, image_name, devices=[], prefix=''):
-        return self.__request_node('/launch', {
+        self.replica.start()
+        instances = self.replica.get('instances')
+        if instances is not None:
+            return instances
+        return self.__request_node('/instances', conditional=True)
+
+    def state(self, select=STATE_SELECTORS, name_pattern=''):
+        ''' Returns the selected parts of the node state in one request,
+            images and instances come from the replica if it is synced '''
+        self.replica.start()
+        snapshot = self.replica.snapshot()
+        if snapshot is not None and \
+                set(select) <= set(['images', 'instances']):
+            snapshot['images'] = {k: v for k, v in snapshot['images'].items()
+                                  if name_pattern in k}
+            return {k: v for k, v in snapshot.items()
+                    if k in select or k == 'version'}
+        return self.__request_node('/state', {
+            'select': ','.join(select),
+            'pattern': name_pattern}, conditional=True)
+
+    def start_image(self, image_name, devices=[], prefix='', progress=None):
+        ''' Launches the image by a launch job on the node, the job status
+            is polled and the stages it passes are reported to progress.
+            LaunchRejected is raised if the node is too loaded to launch '''
+        progress = progress or (lambda stage, **info: None)
+        job = self.__request_node('/launch/job', {
             'image_name': image_name,
             'devices': devices,
             'prefix': prefix})
+        if 'rejected' in job:
+            raise LaunchRejected(job['rejected'])
+        if 'job' not in job:
+            return None
+
+        job_id = job['job']
+        reported = 0
+        deadline = time.monotonic() + LAUNCH_TIMEOUT
+        while time.monotonic() < deadline:
+            job = self.__request_node('/job/' + job_id)
+            if 'state' not in job:
+                return None
+            for stage in job['stages'][reported:]:
+                if stage['stage'] not in ('queued', 'done', 'failed'):
+                    progress(**{k: v for k, v in stage.items()
+                                if k != 'at'})
+            reported = len(job['stages'])
+            if job['state'] == 'done':
+                ident = job['result']
+                if ident is not None:
+                    self.replica.expect(
+                        'instances', lambda instances: str(ident) in instances,
+                        STATE_EXPECT_TIMEOUT)
+                return ident
+            if job['state'] == 'failed':
+                logger.error('launch on node {} failed: {}'.format(
+                    self.node_url, job['error']))
+                return None
+            time.sleep(LAUNCH_POLL_INTERVAL)
+        logger.error('launch on node {} timed out'.format(self.node_url))
+        return None
 
     def stop_container(self, ident):
-        return self.__request_node('/stop', {'ident': ident})
+        ''' Stops the instance, it is hidden from the instances of the
+            replica till the node pushes the removal '''
+        result = self.__request_node('/stop', {'ident': ident})
+        self.replica.hide('instances', str(ident), STATE_EXPECT_TIMEOUT)
+        return result
+
+    def pause_container(self, ident, paused=True):
+        return self.__request_node(
+            '/pause', {'ident': ident, 'paused': int(paused)})
+
+    def on_ready(self, callback):
+        ''' Registers callback called with the instance info and its boot
+            time once the instance is booted on the node, the node pushes
+            the events to the replica '''
+        self.replica.on_ready(callback)
+        self.replica.start()
 
     def pull(self, image_name, registry, pattern=''):
         progress_cv = threading.Condition()
@@ -63,7 +228,8 @@ class RemoteNode:
 
         def __pull_request_wrapper(api_path, params={}):
             nonlocal progress_cv, progress_value
-            value = self.__request_node(api_path, params)
+            # pull responds once the image is pulled, no read timeout
+            value = self.__request_node(api_path, params, read_timeout=None)
             with progress_cv:
                 if value == {'state': 'Complete'}:
                     progress_value = {'Complete': 100}
@@ -135,6 +301,13 @@ class SelfNode:
     def __init__(self):
         self.node_url = 'local-self-node'
         self.avail_state = NodeAvailState.ONLINE
+        self.health = NodeHealth(self.node_url)
+        self.capacity = NodeCapacity()
+
+    def ping(self):
+        ''' The node runs in the backend process, it is always there '''
+        self.health.beat(0.0)
+        return True
 
     def list_images(self, registry=None, name_pattern=''):
         return json.loads(json.dumps(emulator.list_images(
@@ -143,13 +316,34 @@ class SelfNode:
     def list_containers(self):
         return json.loads(json.dumps(emulator.list_containers()))
 
-    def start_image(self, image_name, devices=[], prefix=''):
+    def state(self, select=STATE_SELECTORS, name_pattern=''):
+        result = {'version': None}
+        if 'images' in select:
+            result['images'] = self.list_images(name_pattern=name_pattern)
+        if 'instances' in select:
+            result['instances'] = self.list_containers()
+        if 'devices' in select:
+            result['devices'] = emulator.lsusb()
+        if 'host' in select:
+            result['host'] = host_info()
+        if 'capacity' in select:
+            result['capacity'] = self.capacity.get()
+        return result
+
+    def start_image(self, image_name, devices=[], prefix='', progress=None):
+        admit(image_name)
         return json.loads(json.dumps(emulator.start_image(
-            image_name, devices, prefix)))
+            image_name, devices, prefix, progress=progress)))
 
     def stop_container(self, ident):
         return json.loads(json.dumps(emulator.stop_container(ident)))
 
+    def pause_container(self, ident, paused=True):
+        return emulator.pause_container(ident, paused)
+
+    def on_ready(self, callback):
+        emulator.on_ready(callback)
+
     def pull(self, image_name, registry, pattern=''):
         for value in emulator.pull(image_name, registry, pattern):
             yield value
@@ -158,62 +352,68 @@ class SelfNode:
         return json.loads(json.dumps(emulator.delete_image(image_name)))
 
 
-class BalancingStrategy:
-    ''' Implements the balancing strategy among nodes in the pool '''
-    def select_node(nodes):
-        ''' Returns a tuple with the index and node instance of the
-            node to be used for the next image launching.
-            The tuple (None, None) is returned if max number of
-            instances per node is reached. '''
-        inst_per_node = {k: len(v.list_containers()) for k, v in nodes.items()}
-        inst_per_node = {k: v for k, v in inst_per_node.items()
-                         if nodes[k].avail_state == NodeAvailState.ONLINE}
-        logger.info(f'instances per nodes at node select: {inst_per_node}')
-
-        min_inst_per_node = min(inst_per_node.values())
-        if min_inst_per_node >= MAX_INSTANCES_PER_NODE:
-            logger.info(f'max instances per node reached {min_inst_per_node}')
-            return (None, None)
-
-        min_inst_nodes = [k for k, v in inst_per_node.items()
-                          if v == min_inst_per_node]
-        logger.info(f'nodes with min instances {min_inst_nodes}')
-
-        if len(min_inst_nodes) == 1 and min_inst_nodes[0] == 0:
-            selected = (0, nodes[0])  # only master self-node left
-        else:
-            min_inst_nodes = [k for k in min_inst_nodes if k != 0]
-            node_id = random.choice(min_inst_nodes)
-            selected = (node_id, nodes[node_id])
-        logger.info(f'selected {selected}')
-        return selected
-
-
 class PoolMananger:
     ''' Represents a pool of nodes. The implementation must have common
         inteface with emulator, so it is transparent for the caller if it is
-        interfacing to just signle emulator instance or to the pool of them '''
-    NODE_INDEX_BASE = 100
+        interfacing to just signle emulator instance or to the pool of them.
+        Instance ids of the pool are node index * NODE_INDEX_BASE + instance
+        id on the node, ids on the node never reach INSTANCE_ID_LIMIT '''
+    NODE_INDEX_BASE = INSTANCE_ID_LIMIT
 
     def __init__(self, urls):
         self.nodes = {
             **{0: SelfNode()},  # node=0 is backend itself
             **{k: RemoteNode(url) for k, url in enumerate(urls, start=1)}}
+        self.fanout_deadline = FANOUT_DEADLINE
+        self.heartbeat_interval = HEARTBEAT_INTERVAL
+        self.cache = TtlCache()
+        self.placement = PlacementEngine()
+        self.ledger = CapacityLedger()
+        self.__reported = set(self.nodes)  # nodes listed the instances
+        self.__heartbeat_lock = threading.Lock()
+        self.__heartbeat_thread = None
 
     def __nodes__(self):
         ''' For debug purposes only '''
         return self.nodes
 
     def __nodes_info__(self):
-        ''' For debug purposes only '''
-        self.list_containers()  # update avail state
+        ''' Returns the nodes with their health kept by the heartbeats,
+            the nodes are pinged once if no heartbeat was sent yet '''
+        if not all(node.health.has_beats() for node in self.nodes.values()):
+            self.heartbeat()
+        self.start_heartbeat()
         return [
-            {'id': node_id,
+            {**node.health.info(),
+             'id': node_id,
              'url': node.node_url,
              'role': 'master' if not node_id else 'slave',
              'state': node.avail_state}
             for node_id, node in self.nodes.items()]
 
+    def start_heartbeat(self):
+        ''' Starts pinging the nodes every heartbeat_interval seconds in
+            background, does nothing if already started '''
+        with self.__heartbeat_lock:
+            if self.__heartbeat_thread is None:
+                self.__heartbeat_thread = threading.Thread(
+                    target=self.__heartbeat_loop, name='heartbeat',
+                    daemon=True)
+                self.__heartbeat_thread.start()
+
+    def heartbeat(self):
+        ''' Pings all nodes at once and waits for them to answer '''
+        wait([fanout_executor.submit(node.ping)
+              for node in self.nodes.values()])
+
+    def __heartbeat_loop(self):
+        while True:
+            time.sleep(self.heartbeat_interval)
+            try:
+                self.heartbeat()
+            except Exception as e:
+                logger.error('heartbeat failed: {}'.format(e))
+
     def __to_instance_index(self, node_index, instance_index):
         return self.NODE_INDEX_BASE*node_index + instance_index
 
@@ -221,10 +421,50 @@ class PoolMananger:
         return (instance_index // self.NODE_INDEX_BASE,
                 instance_index % self.NODE_INDEX_BASE)
 
+    def __fan_out(self, call, nodes=None, wait_all=False):
+        ''' Calls call(node) for all nodes at once and returns the dict
+            of node index: result of the nodes answered in fanout_deadline
+            seconds, or of all nodes if wait_all is set. The nodes late
+            to answer are marked degraded and left out, their calls are
+            not waited for. The nodes offline are not called at all '''
+        self.start_heartbeat()
+        nodes = self.nodes if nodes is None else nodes
+        futures = {fanout_executor.submit(call, node): index
+                   for index, node in nodes.items()
+                   if node.avail_state != NodeAvailState.OFFLINE}
+        done, late = wait(
+            futures, timeout=None if wait_all else self.fanout_deadline)
+        for future in late:
+            node = nodes[futures[future]]
+            node.avail_state = NodeAvailState.DEGRADED
+            logger.warning('node {} is late to answer'.format(node.node_url))
+        results = {}
+        for future in done:
+            node = nodes[futures[future]]
+            if node.avail_state == NodeAvailState.DEGRADED:
+                node.avail_state = NodeAvailState.ONLINE  # in time again
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                logger.error('node {} failed: {}'.format(node.node_url, e))
+        return results
+
+    def invalidate(self):
+        ''' Drops the cached instances and images, to be called after
+            they are changed bypassing the pool '''
+        self.cache.invalidate()
+
     def list_images(self, registry=None, name_pattern=''):
         ''' Return only images present in all nodes '''
-        images = [node.list_images(registry, name_pattern)
-                  for node in self.nodes.values()]
+        return self.cache.get(
+            ('images', registry, name_pattern),
+            lambda: self.__list_images(registry, name_pattern))
+
+    def __list_images(self, registry, name_pattern):
+        images = list(self.__fan_out(
+            lambda node: node.list_images(registry, name_pattern)).values())
+        if not images:
+            return {}
         intersect = set.intersection(*map(set, [[
             k for k, v in d.items() if v != 'Remote'] for d in images]))
         intersect_and_remote = {
@@ -236,9 +476,20 @@ class PoolMananger:
         return {**intersect_and_remote, **out_of_intersect}
 
     def list_containers(self):
+        return self.cache.get('instances', self.__list_containers)
+
+    def reported(self, ident):
+        ''' Checks if the node of the instance reported its instances in
+            the last listing, the instances of the nodes which did not
+            are left out of it though they may be running '''
+        return self.__from_instance_index(int(ident))[0] in self.__reported
+
+    def __list_containers(self):
         instances = dict()
-        for index, node in self.nodes.items():
-            for ident, container in node.list_containers().items():
+        nodes_instances = self.__fan_out(lambda node: node.list_containers())
+        self.__reported = set(nodes_instances)
+        for index, node_instances in sorted(nodes_instances.items()):
+            for ident, container in node_instances.items():
                 instance_index = self.__to_instance_index(index, int(ident))
                 container['id'] = instance_index
                 # TODO: To be corrected once cluster graphics link
@@ -249,24 +500,101 @@ class PoolMananger:
                 instances[instance_index] = container
         return instances
 
-    def start_image(self, image_name, devices=[], prefix=''):
+    def start_image(self, image_name, devices=[], prefix='', progress=None):
+        ''' Launches the image on the node selected by placement engine,
+            progress is called with the name of launch stage passed and
+            keyword info: placed (the node is selected, with the reason),
+            rejected (the node is too loaded to launch, the next best node
+            is tried) and the stages reported by the node. A slot is
+            reserved on the node for the launch, see CapacityLedger '''
+        progress = progress or (lambda stage, **info: None)
         if devices:
-            # select master node if device passing is requested
-            node_index, target_node = (0, self.nodes[0])
+            nodes_state = None
         else:
-            # Although it is expected all nodes have the same set of images,
-            # filter out nodes where desired image is not present
-            nodes = {k: v for k, v in self.nodes.items()
-                     if v.list_images(name_pattern=image_name.lower())}
-            node_index, target_node = BalancingStrategy.select_node(nodes)
-        if target_node is None:
-            return None  # launch failed
-        ident = target_node.start_image(image_name, devices, prefix)
+            queried_at = time.monotonic()
+            nodes_state = self.__fan_out(
+                lambda node: node.state(
+                    ['images', 'instances', 'host', 'capacity'],
+                    image_name.lower()))
+        refused = set()
+        while True:
+            if devices:
+                # select master node if device passing is requested
+                node_index, token, reason = (0, None, 'devices passed')
+            else:
+                decision = {}
+
+                def select(reserved):
+                    decision.update(self.placement.select(
+                        {k: v for k, v in self.nodes.items()
+                         if k not in refused},
+                        nodes_state, image_name, reserved))
+                    return decision['node']
+
+                node_index, token = self.ledger.reserve(queried_at, select)
+                reason = decision['reason']
+            if node_index is None:
+                return None  # launch failed
+            progress('placed', node=node_index, reason=reason)
+            try:
+                return self.__start_on_node(
+                    node_index, token, image_name, devices, prefix, progress)
+            except LaunchRejected as e:
+                progress('rejected', node=node_index, reason=str(e))
+                logger.info('node {} rejected launch of {}: {}'.format(
+                    node_index, image_name, e))
+                if devices:
+                    return None
+                refused.add(node_index)
+
+    def __start_on_node(self, node_index, token, image_name, devices, prefix,
+                        progress):
+        ''' Launches the image on the node in the slot reserved by token '''
+        def node_progress(stage, **info):
+            if 'ident' in info:
+                info['ident'] = self.__to_instance_index(
+                    node_index, info['ident'])
+            progress(stage, **info)
+
+        try:
+            ident = self.nodes[node_index].start_image(
+                image_name, devices, prefix, progress=node_progress)
+        except Exception:
+            self.ledger.release(token)
+            raise
+        self.cache.invalidate()
+        if ident is None:
+            self.ledger.release(token)
+            return None  # no free ids left on the node
+        self.ledger.confirm(token)
         return self.__to_instance_index(node_index, ident)
 
     def stop_container(self, ident):
         node_index, ident = self.__from_instance_index(ident)
         self.nodes[node_index].stop_container(ident)
+        self.cache.invalidate()
+
+    def pause_container(self, ident, paused=True):
+        node_index, ident = self.__from_instance_index(ident)
+        return self.nodes[node_index].pause_container(ident, paused)
+
+    def on_ready(self, callback):
+        ''' Registers callback called with the instance info and its boot
+            time once an instance is booted on any node, ids of the info
+            are the ones of the pool '''
+        for index, node in self.nodes.items():
+            node.on_ready(
+                lambda info, boot_time, index=index: callback(
+                    self.__pool_info(index, info), boot_time))
+
+    def __pool_info(self, node_index, info):
+        info = dict(info)
+        info['ident'] = self.__to_instance_index(
+            node_index, int(info['ident']))
+        if info.get('pair'):
+            info['pair'] = str(self.__to_instance_index(
+                node_index, int(info['pair'])))
+        return info
 
     def describe_image(self, image_name, sha):
         return emulator.describe_image(image_name, sha)
@@ -274,14 +602,16 @@ class PoolMananger:
     def pull(self, image_name, registry, pattern=''):
         progress_cv = threading.Condition()
         progress_values = [{'Downloading': 0} for node in self.nodes]
+        progress_changes = 0
 
         def __pull_wrapper(node_index, node):
-            nonlocal progress_cv, progress_values
+            nonlocal progress_cv, progress_values, progress_changes
             logger.info(f'enter __pull_wrapper {node_index}')
             for value in node.pull(image_name, registry, pattern):
                 with progress_cv:
                     logger.info(f'__pull_wrapper {node_index}, {value}')
                     progress_values[node_index] = value
+                    progress_changes += 1
                     progress_cv.notify()
                 if 'Failure' in value.keys() or 'Complete' in value.keys():
                     logger.info(f'exit __pull_wrapper {node_index}')
@@ -294,9 +624,14 @@ class PoolMananger:
             __progress_values = [{'Downloading': 0} for node in self.nodes]
             reported_value = {'Failure': 0}
 
+            reported_changes = 0
             with progress_cv:
                 while True:
-                    progress_cv.wait()
+                    # the values may change before the wait is entered,
+                    # the notification is not waited for then
+                    progress_cv.wait_for(
+                        lambda: progress_changes != reported_changes)
+                    reported_changes = progress_changes
                     __progress_values = progress_values
 
                     # The reporting strategy is that the value with lower state
@@ -322,18 +657,18 @@ class PoolMananger:
             # wait till complete
             for f in pull_futures:
                 pass
+            self.cache.invalidate()
 
             yield reported_value
 
     def delete_image(self, image_name):
-        success = True
-        for node in self.nodes.values():
-            result = node.delete_image(image_name)
+        results = self.__fan_out(
+            lambda node: node.delete_image(image_name), wait_all=True)
+        self.cache.invalidate()
+        for index, node in self.nodes.items():
             logger.info('result of deleting an image: {} on node: {} is: {}'
-                        .format(image_name, node.node_url, result))
-            if not result:
-                success = False
-        return success
+                        .format(image_name, node.node_url, results.get(index)))
+        return len(results) == len(self.nodes) and all(results.values())
 
     def sync(self, registry, pattern, ref_node_id=0):
         ''' Synchronizes local images on the nodes in the cluster to
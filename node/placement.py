@@ -0,0 +1,148 @@
+import random
+import logging
+
+from node import MAX_INSTANCES_PER_NODE
+from node import PLACEMENT_POLICY
+from node import PLACEMENT_WEIGHTS
+from node.health import NodeAvailState
+from node.capacity import profile_of
+
+logger = logging.getLogger(__name__)
+
+
+def spread(factors, weights):
+    ''' Prefers the node with the most resources left '''
+    return (factors['memory'] + factors['cpu'] + factors['slots']) / 3
+
+
+def binpack(factors, weights):
+    ''' Prefers the node with the least resources left, filling the
+        nodes one by one '''
+    return 1 - spread(factors, weights)
+
+
+def weighted(factors, weights):
+    ''' Prefers the node with the highest weighted sum of resources left '''
+    return sum(weight * factors.get(name, 0)
+               for name, weight in weights.items())
+
+
+class PlacementEngine:
+    ''' Selects the node to launch the image on. The nodes which are
+        offline, have no image or no capacity left are rejected. The rest
+        are scored by the policy on the shares of their resources left:
+        free memory, cpu idle and capacity. Instance of the image uses
+        1 / capacity of the node for the image profile, the nodes not
+        reporting the capacity have MAX_INSTANCES_PER_NODE of instances
+        of any image. The nodes having kvm are preferred to the ones
+        without it, online nodes are preferred to degraded ones, slave
+        nodes are preferred to the master node, the policy decides among
+        them and a random node is taken of the ones scored the same.
+        Policies are callables taking the resource shares and the
+        weights, more may be registered.
+        input: policy - name of the policy
+               weights - dict of resource name: weight for weighted policy '''
+    policies = {
+        'spread': spread,
+        'binpack': binpack,
+        'weighted': weighted}
+
+    def __init__(self, policy=PLACEMENT_POLICY, weights=PLACEMENT_WEIGHTS):
+        if policy not in self.policies:
+            logger.error('unknown placement policy {}, spread is used'
+                         .format(policy))
+            policy = 'spread'
+        self.policy = policy
+        self.weights = weights
+
+    @classmethod
+    def register(cls, name, score):
+        cls.policies[name] = score
+
+    def select(self, nodes, states, image_name, reserved={}):
+        ''' Returns the decision as dict: index of the node selected or
+            None, the policy, the scores of the nodes considered, the
+            reasons the rest of the nodes were rejected for and the reason
+            of selection. states is dict of node index: node state with
+            images, instances and host, reserved is dict of node index:
+            number of slots taken by launches the state does not show.
+            The state contains the capacity of the node if it reports it '''
+        scores = {}
+        rejected = {}
+        keys = {}
+        for index, node in nodes.items():
+            state = states.get(index)
+            reason = self.__reject(node, state, image_name)
+            if reason is None:
+                used = self.used(state, image_name, reserved.get(index, 0))
+                if used + self.share(state, image_name) > 1 + 1e-9:
+                    reason = 'no capacity left for {}'.format(image_name)
+            if reason:
+                rejected[index] = reason
+                continue
+            factors = self.factors(state, used)
+            scores[index] = round(
+                self.policies[self.policy](factors, self.weights), 3)
+            keys[index] = (factors['kvm'],
+                           node.avail_state == NodeAvailState.ONLINE,
+                           index != 0, scores[index])
+
+        decision = {'node': None, 'policy': self.policy,
+                    'scores': scores, 'rejected': rejected}
+        if keys:
+            best = max(keys.values())
+            decision['node'] = random.choice(
+                [k for k, v in keys.items() if v == best])
+            decision['reason'] = '{} score {} {}'.format(
+                self.policy, scores[decision['node']],
+                'with kvm' if best[0] else 'no node with kvm')
+        else:
+            decision['reason'] = 'no node available'
+        logger.info('placement of {}: {}'.format(image_name, decision))
+        return decision
+
+    @staticmethod
+    def share(state, image_name):
+        ''' Returns the share of the node capacity an instance of the
+            image uses '''
+        capacity = state.get('capacity')
+        if not capacity:
+            return 1 / MAX_INSTANCES_PER_NODE
+        slots = capacity.get(profile_of(image_name),
+                             capacity.get('default', 0))
+        return 1 / slots if slots else float('inf')
+
+    @staticmethod
+    def used(state, image_name, taken=0):
+        ''' Returns the share of the node capacity used by its instances
+            and by taken slots for instances of the image '''
+        return sum(PlacementEngine.share(state, i.get('image_name', ''))
+                   for i in state['instances'].values()) + \
+            taken * PlacementEngine.share(state, image_name)
+
+    @staticmethod
+    def factors(state, used=0):
+        ''' Returns the shares of the node resources left, from 0 to 1,
+            and 1 if the node has kvm, 0 otherwise. The resources the
+            node does not report are taken as used, used is the share of
+            the node capacity used '''
+        host = state.get('host', {})
+        memory_total = host.get('memory_total', 0)
+        cores = host.get('cores') or 0
+        loadavg = host.get('loadavg') or [0]
+        return {
+            'memory': host.get('memory_available', 0) / memory_total
+            if memory_total else 0,
+            'cpu': max(0, 1 - loadavg[0] / cores) if cores else 0,
+            'slots': max(0, 1 - used),
+            'kvm': 1 if host.get('kvm') else 0}
+
+    @staticmethod
+    def __reject(node, state, image_name):
+        if node.avail_state == NodeAvailState.OFFLINE:
+            return 'node is {}'.format(node.avail_state)
+        if state is None:
+            return 'no state'
+        if not state.get('images'):
+            return 'no image {}'.format(image_name)
+        return None
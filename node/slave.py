@@ -1,31 +1,136 @@
+import gzip
 import json
 import logging
 import requests
 from flask import Flask, request, jsonify
-from flask_socketio import SocketIO
+from flask_socketio import SocketIO, emit
 
 import emulator
+from emulator import metrics
+from emulator import TITAN_IMAGE_NAME_PATTERN
+from emulator import CLUSTER_IMAGE_NAME_PATTERN
+from node.jobs import JobQueue
+from node.state import StatePublisher
+from node.state import etag
+from node.host import host_info
+from node.capacity import NodeCapacity
+from node.admission import admit
+from node.admission import LaunchRejected
+from node import STATE_SELECTORS
+from node import GZIP_MIN_SIZE
 
 logger = logging.getLogger(__name__)
 app = Flask(__name__)
 socketio = SocketIO(app)
+jobs = JobQueue(on_event=lambda job: socketio.emit(
+    'stage', json.dumps(job), namespace='/launch'))
+# ready events go to the masters following the state of the node
+emulator.on_ready(lambda info, boot_time: socketio.emit(
+    'ready', json.dumps({**info, 'boot_time': boot_time}),
+    namespace='/state'))
+# state is passed through json, so keys are the same as the master
+# gets them by /images and /instances. Images are the local ones of
+# the patterns the master asks for, listed from the image index
+state = StatePublisher(
+    lambda: json.loads(json.dumps({
+        'instances': emulator.list_containers(),
+        'images': {
+            **emulator.list_images(None, TITAN_IMAGE_NAME_PATTERN),
+            **emulator.list_images(None, CLUSTER_IMAGE_NAME_PATTERN)}})),
+    lambda event, data: socketio.emit(event, data, namespace='/state'))
+emulator.on_change(state.changed)
+capacity = NodeCapacity()
+
+
+@socketio.on('connect', namespace='/state')
+def state_connect():
+    emit('snapshot', state.snapshot())
+
+
+@socketio.on('sync', namespace='/state')
+def state_sync():
+    emit('snapshot', state.snapshot())
+
+
+def versioned(payload):
+    ''' Returns the json response tagged by its content, it is
+        304 Not Modified if the requester has got the same content '''
+    response = jsonify(payload)
+    response.set_etag(etag(payload))
+    return response.make_conditional(request)
+
+
+@app.after_request
+def compress(response):
+    ''' Compresses large json responses if the requester accepts gzip '''
+    if response.status_code != 200 or response.direct_passthrough or \
+            response.mimetype != 'application/json' or \
+            'gzip' not in request.headers.get('Accept-Encoding', '') or \
+            'Content-Encoding' in response.headers:
+        return response
+    data = response.get_data()
+    if len(data) < GZIP_MIN_SIZE:
+        return response
+    response.set_data(gzip.compress(data, compresslevel=5))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
 
 
 @app.route('/images')
 def images():
     name_pattern = request.args.get('pattern', '')
-    images = emulator.list_images(None, name_pattern)
+    snapshot = state.snapshot(fresh=True)
+    images = {k: v for k, v in snapshot['images'].items()
+              if name_pattern in k}
     logger.info('request for images from {}: {}'.format(
         request.remote_addr, images))
-    return jsonify(images)
+    return versioned(images)
 
 
 @app.route('/instances')
 def instances():
-    instances = emulator.list_containers()
+    snapshot = state.snapshot(fresh=True)
     logger.info('request for instances from {}: {}'.format(
-        request.remote_addr, instances))
-    return jsonify(instances)
+        request.remote_addr, snapshot['instances']))
+    return versioned(snapshot['instances'])
+
+
+@app.route('/state')
+def node_state():
+    ''' Returns the parts of the node state selected (comma separated
+        STATE_SELECTORS, all by default) in one response: images which
+        names contain the pattern, instances, usb devices, host resources,
+        capacity of the node and the version of the state '''
+    select = request.args.get('select', ','.join(STATE_SELECTORS))
+    select = select.split(',')
+    pattern = request.args.get('pattern', '')
+    snapshot = state.snapshot(fresh=True)
+    result = {'version': snapshot['version']}
+    if 'images' in select:
+        result['images'] = {k: v for k, v in snapshot['images'].items()
+                            if pattern in k}
+    if 'instances' in select:
+        result['instances'] = snapshot['instances']
+    if 'devices' in select:
+        result['devices'] = emulator.lsusb()
+    if 'host' in select:
+        result['host'] = host_info()
+    if 'capacity' in select:
+        result['capacity'] = capacity.get()
+    if set(select) <= set(['images', 'instances']):
+        return versioned(result)
+    return jsonify(result)
+
+
+@app.route('/ping')
+def ping():
+    return jsonify({})
+
+
+@app.route('/metrics')
+def launch_metrics():
+    return jsonify(metrics.snapshot())
 
 
 @app.route('/launch')
@@ -39,10 +144,42 @@ def launch():
     logger.info('devices {}'.format(devices))
     logger.info('prefix {}'.format(prefix))
 
+    try:
+        admit(image_name)
+    except LaunchRejected as e:
+        return jsonify({'rejected': str(e)}), 429
     ident = emulator.start_image(image_name, devices, prefix)
     return jsonify(ident)
 
 
+@app.route('/launch/job')
+def launch_job():
+    image_name = request.args.get('image_name', None)
+    devices = request.args.get('devices', [])
+    prefix = request.args.get('prefix', 'anonymous_')
+
+    logger.info('request for launch job from {}:'.format(
+        request.remote_addr))
+    logger.info('image_name {}'.format(image_name))
+    logger.info('devices {}'.format(devices))
+    logger.info('prefix {}'.format(prefix))
+
+    try:
+        admit(image_name)
+    except LaunchRejected as e:
+        return jsonify({'rejected': str(e)}), 429
+    job_id = jobs.submit(
+        lambda progress: emulator.start_image(
+            image_name, devices, prefix, progress=progress),
+        owner=prefix)
+    return jsonify({'job': job_id})
+
+
+@app.route('/job/<job_id>')
+def job(job_id):
+    return jsonify(jobs.get(job_id) or {})
+
+
 @app.route('/stop')
 def stop():
     ident = request.args.get('ident', None)
@@ -54,6 +191,17 @@ def stop():
     return jsonify({})
 
 
+@app.route('/pause')
+def pause():
+    ident = request.args.get('ident', None)
+    paused = request.args.get('paused', 1, type=int)
+
+    logger.info('request for pause from {}:'.format(request.remote_addr))
+    logger.info('ident {} paused {}'.format(ident, paused))
+
+    return jsonify(emulator.pause_container(int(ident), bool(paused)))
+
+
 @app.route('/pull')
 def pull():
     image_name = request.args.get('image_name', None)
@@ -0,0 +1,272 @@
+import json
+import time
+import hashlib
+import logging
+import threading
+import socketio
+
+from node import STATE_PUSH_DEBOUNCE
+from node import STATE_PUSH_INTERVAL
+from node import STATE_RECONNECT_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+'''Parts of the node state, each one is a dict'''
+STATE_PARTS = ['instances', 'images']
+
+
+class StatePublisher:
+    ''' Pushes the state of the slave node to the masters connected as
+        versioned deltas. Every change bumps the version, the delta
+        carries the keys set and removed since the base version.
+        Bursts of changes are coalesced into a single delta, the state
+        is also checked every interval seconds for changes missed.
+        input: load - callable returning the state, dict of STATE_PARTS
+               emit - callable taking the event name and its data
+               debounce - seconds to coalesce changes for
+               interval - seconds between the checks '''
+    def __init__(self, load, emit, debounce=STATE_PUSH_DEBOUNCE,
+                 interval=STATE_PUSH_INTERVAL):
+        self.load = load
+        self.emit = emit
+        self.debounce = debounce
+        self.interval = interval
+        self.__lock = threading.Lock()
+        # publishes are serialized, so an older state loaded by a slower
+        # publish is never installed over a newer one
+        self.__publish_lock = threading.Lock()
+        self.__changed = threading.Event()
+        self.__dirty = False
+        self.__state = None
+        self.__version = 0
+        self.__publisher = None
+
+    def changed(self):
+        ''' Lets the publisher know the state may have changed '''
+        self.__dirty = True
+        self.__changed.set()
+
+    def snapshot(self, fresh=False):
+        ''' Returns the full state and its version, fresh publishes the
+            changes not published yet first. The state is loaded again
+            only if it was told to have changed since published '''
+        self.__start_publisher()
+        if fresh and self.__state is not None and self.__dirty:
+            self.publish()
+        with self.__lock:
+            if self.__state is None:
+                self.__state = self.load()
+            return {'version': self.__version, **self.__state}
+
+    def publish(self):
+        ''' Pushes the delta if the state changed since last published '''
+        with self.__publish_lock:
+            self.__dirty = False
+            state = self.load()
+            with self.__lock:
+                delta = diff(self.__state or {}, state)
+                if not delta:
+                    return
+                self.__state = state
+                self.__version += 1
+                delta['base'] = self.__version - 1
+                delta['version'] = self.__version
+            self.emit('delta', delta)
+
+    def __start_publisher(self):
+        with self.__lock:
+            if self.__publisher is None:
+                self.__publisher = threading.Thread(
+                    target=self.__publish_loop, name='state-publisher',
+                    daemon=True)
+                self.__publisher.start()
+
+    def __publish_loop(self):
+        while True:
+            changed = self.__changed.wait(self.interval)
+            if changed:
+                time.sleep(self.debounce)
+            self.__changed.clear()
+            if changed and not self.__dirty:
+                continue  # published by a fresh snapshot meanwhile
+            try:
+                self.publish()
+            except Exception as e:
+                logger.error('state publish failed: {}'.format(e))
+
+
+class NodeReplica:
+    ''' Copy of the state of the remote node kept current by the deltas
+        the node pushes over socketio. A delta which does not follow the
+        version of the copy makes the copy be synced from a snapshot.
+        The copy is not synced while the node is not connected, the
+        connection is retried in background every reconnect seconds.
+        Entries the caller removed from the node may be hidden till the
+        node pushes the removal. Ready events of the instances booted on
+        the node are passed to the listeners registered by on_ready '''
+    def __init__(self, node_url, reconnect=STATE_RECONNECT_INTERVAL):
+        self.node_url = node_url
+        self.reconnect = reconnect
+        self.__cv = threading.Condition()
+        self.__state = None
+        self.__version = None
+        self.__syncing = False
+        self.__client = None
+        self.__hidden = {}  # (part, key) -> monotonic time hidden till
+        self.__ready_listeners = []
+
+    def start(self):
+        ''' Starts following the node, does nothing if already started '''
+        with self.__cv:
+            if self.__client is not None:
+                return
+            self.__client = socketio.Client(reconnection=False)
+        self.__client.on('snapshot', self.__on_snapshot, '/state')
+        self.__client.on('delta', self.__on_delta, '/state')
+        self.__client.on('disconnect', self.__on_disconnect, '/state')
+        self.__client.on('ready', self.__on_ready, '/state')
+        threading.Thread(target=self.__connect_loop, name='node-replica',
+                         daemon=True).start()
+
+    def get(self, part):
+        ''' Returns the copy of the state part or None if not synced '''
+        with self.__cv:
+            if self.__state is None:
+                return None
+            now = time.monotonic()
+            self.__hidden = {
+                (p, k): till for (p, k), till in self.__hidden.items()
+                if till > now and k in self.__state[p]}
+            return {k: dict(v) if isinstance(v, dict) else v
+                    for k, v in self.__state[part].items()
+                    if (part, k) not in self.__hidden}
+
+    def hide(self, part, key, timeout):
+        ''' Hides the entry of the state part till the node pushes its
+            removal, the caller removed it from the node. The entry is
+            shown again if it is not removed in timeout seconds '''
+        with self.__cv:
+            self.__hidden[(part, key)] = time.monotonic() + timeout
+
+    def snapshot(self):
+        ''' Returns the copy of the state with its version or None if
+            not synced '''
+        with self.__cv:
+            if self.__state is None:
+                return None
+            return {'version': self.__version,
+                    **{part: self.get(part) for part in STATE_PARTS}}
+
+    def expect(self, part, predicate, timeout):
+        ''' Waits till the state part satisfies the predicate, the caller
+            changed the node and expects the change to be pushed. The copy
+            is dropped and synced again if it does not in timeout seconds,
+            the change may be lost '''
+        with self.__cv:
+            if self.__state is None:
+                return
+            if self.__cv.wait_for(
+                    lambda: self.__state is not None and
+                    predicate(self.__state[part]), timeout):
+                return
+            logger.info('node {} did not push the change, resyncing'
+                        .format(self.node_url))
+            self.__state = None
+        self.__sync()
+
+    def on_ready(self, callback):
+        ''' Registers callback called with the instance info and its boot
+            time once the instance is booted on the node '''
+        self.__ready_listeners.append(callback)
+
+    def __connect_loop(self):
+        while True:
+            if not self.__client.connected:
+                try:
+                    self.__client.connect(self.node_url,
+                                          namespaces=['/state'])
+                except Exception as e:
+                    logger.info('node {} state is not followed: {}'.format(
+                        self.node_url, e))
+            time.sleep(self.reconnect)
+
+    def __sync(self):
+        with self.__cv:
+            if self.__syncing:
+                return
+            self.__syncing = True
+        try:
+            self.__client.emit('sync', namespace='/state')
+        except Exception as e:
+            self.__syncing = False
+            logger.info('node {} state sync failed: {}'.format(
+                self.node_url, e))
+
+    def __on_snapshot(self, snapshot):
+        with self.__cv:
+            self.__version = snapshot['version']
+            self.__state = {part: snapshot.get(part, {})
+                            for part in STATE_PARTS}
+            self.__syncing = False
+            self.__cv.notify_all()
+        logger.info('node {} state synced at version {}'.format(
+            self.node_url, self.__version))
+
+    def __on_delta(self, delta):
+        with self.__cv:
+            if self.__state is not None and \
+                    delta['base'] == self.__version:
+                apply(self.__state, delta)
+                self.__version = delta['version']
+                self.__cv.notify_all()
+                return
+            self.__state = None
+        logger.info('node {} delta {} does not follow {}, resyncing'
+                    .format(self.node_url, delta['version'], self.__version))
+        self.__sync()
+
+    def __on_ready(self, data):
+        info = json.loads(data)
+        boot_time = info.pop('boot_time', None)
+        for callback in self.__ready_listeners:
+            try:
+                callback(info, boot_time)
+            except Exception as e:
+                logger.error('ready callback failed: {}'.format(e))
+
+    def __on_disconnect(self):
+        with self.__cv:
+            self.__state = None
+            self.__syncing = False
+        logger.info('node {} state is not followed'.format(self.node_url))
+
+
+def etag(payload):
+    ''' Returns the tag of the state part, the tag depends on the content
+        only, so it is the same in every worker process of the node and
+        survives restarts of the node, unlike the version '''
+    return hashlib.sha1(
+        json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def diff(old, new):
+    ''' Returns the delta turning old state into new one, empty if
+        there are no changes '''
+    delta = {}
+    for part in STATE_PARTS:
+        before = old.get(part, {})
+        after = new.get(part, {})
+        changed = {k: v for k, v in after.items() if before.get(k) != v}
+        removed = [k for k in before if k not in after]
+        if changed or removed:
+            delta[part] = {'set': changed, 'removed': removed}
+    return delta
+
+
+def apply(state, delta):
+    ''' Applies the delta to the state in place '''
+    for part in STATE_PARTS:
+        if part in delta:
+            state[part].update(delta[part]['set'])
+            for key in delta[part]['removed']:
+                state[part].pop(key, None)
@@ -3,6 +3,8 @@ import unittest
 
 from threading import Lock
 
+from emulator import docker_client
+
 
 class APIClientMock(unittest.mock.Mock):
     __images = [{
@@ -12,6 +14,9 @@ class APIClientMock(unittest.mock.Mock):
         'RepoTags': ['cloud_android_test_image_name:latest'],
     }]
     __containers = []
+    __labels = []
+    __networks = []
+    __stopped = set()
     __lock = Lock()
 
     def images(self, name=None, quiet=False, all=False, filters=None):
@@ -23,27 +28,55 @@ class APIClientMock(unittest.mock.Mock):
     def containers(self, quiet=False, all=False, trunc=False, latest=False,
                    since=None, before=None, limit=-1, size=False,
                    filters=None):
+        label = (filters or {}).get('label')
         with self.__lock:
             return [{
-                'Id': ident,
+                'Id': str(ident),
                 'Name': [name],
+                'Names': ['/' + name],
                 'Image': 'cloud_android_test_image_name:latest',
+                'Labels': labels,
+                'NetworkSettings': {
+                    'Networks': {
+                        net_name: {
+                            'NetworkID': net_name
+                        }
+                    }
+                },
                 'Created': '2 days ago',
                 'Command': 'true',
                 'Status': 'fake status'
-            } for ident, name in zip(
-                range(len(self.__containers)), self.__containers)]
+            } for ident, name, labels, net_name in zip(
+                range(len(self.__containers)), self.__containers,
+                self.__labels, self.__networks)
+                if (label is None or label in labels) and
+                ident not in self.__stopped]
+
+    def __index(self, container_id):
+        if container_id.isdigit():
+            index = int(container_id)
+        else:
+            indexes = [ix for ix, name in enumerate(self.__containers)
+                       if name == container_id and ix not in self.__stopped]
+            index = indexes[-1] if indexes else None
+        if index is None or index in self.__stopped:
+            raise docker.errors.NotFound(container_id)
+        return index
 
     def inspect_container(self, container_id):
         with self.__lock:
+            container_id = str(self.__index(container_id))
             return {
                 'Id': container_id,
                 'Config': {
                     'Image': 'cloud_android_test_image_name',
+                    'Labels': self.__labels[int(container_id)],
                 },
                 'NetworkSettings': {
                     'Networks': {
-                        'emulator_envoymesh': 'dummy'
+                        self.__networks[int(container_id)]: {
+                            'NetworkID': self.__networks[int(container_id)]
+                        }
                     }
                 },
                 'ID': container_id,
@@ -72,8 +105,27 @@ class APIClientMock(unittest.mock.Mock):
                          use_config_proxy=True):
         with self.__lock:
             self.__containers += [name]
+            self.__labels += [labels or {}]
+            self.__networks += list((networking_config or {}).get(
+                'EndpointsConfig', {'emulator_envoymesh': {}}).keys())[:1]
             return {'Id': str(len(self.__containers)-1)}
 
+    def stop(self, container, timeout=None):
+        with self.__lock:
+            self.__stopped.add(self.__index(container))
+
+    def remove_container(self, container, v=False, link=False, force=False):
+        with self.__lock:
+            self.__stopped.add(self.__index(container))
+
+    def create_networking_config(self, endpoints_config=None):
+        return {'EndpointsConfig': endpoints_config or {}}
+
+    def create_endpoint_config(self, aliases=None, links=None,
+                               ipv4_address=None, ipv6_address=None,
+                               link_local_ips=None, driver_opt=None):
+        return {'Aliases': aliases}
+
     def networks(self, names=None, ids=None, filters=None):
         return []
 
@@ -81,12 +133,20 @@ class APIClientMock(unittest.mock.Mock):
                        check_duplicate=None, internal=False, labels=None,
                        enable_ipv6=False, attachable=None, scope=None,
                        ingress=None):
+        return {'Id': name, 'Warning': ''}
+
+    def inspect_network(self, net_id, verbose=None, scope=None):
+        return {'Id': net_id, 'Name': net_id}
+
+    def remove_network(self, net_id):
         pass
 
 
 class DockerClientMock(docker.DockerClient):
     def __init__(self, *args, **kwargs):
         self.api = APIClientMock(*args, **kwargs)
+        # the shared client is rebuilt from the patched docker module
+        docker_client.reset()
 
     def __call__(self, *args, **kwargs):
         return self
@@ -1,3 +1,12 @@
+import os
+import gzip
+import importlib
+import json
+import time
+import sqlite3
+import tempfile
+import threading
+import docker
 import unittest
 
 from unittest.mock import patch
@@ -7,11 +16,32 @@ from .mock_docker import DockerClientMock
 from .mock_docker import APIClientMock
 
 import emulator
+from emulator import metrics
+from emulator import docker_client
+from emulator import NETWORK_POOL_PREFIX
+from emulator import LABEL_INSTANCE
+from emulator.allocator import IdAllocator
+from emulator.allocator import PortAllocator
+from emulator.reservations import ReservationStore
+from emulator.netpool import network_slot
+from emulator.netpool import NetworkPool
+from emulator.readiness import ReadinessMonitor
 
 
 class TestCase(unittest.TestCase):
     def setUp(self):
-        pass
+        # every test gets reservations and an inventory of its own
+        self.tmp = tempfile.TemporaryDirectory()
+        self.reservation_db = patch(
+            'emulator.reservations.RESERVATION_DB',
+            os.path.join(self.tmp.name, 'reservations.db'))
+        self.reservation_db.start()
+        emulator.emulator.reset()
+
+    def tearDown(self):
+        emulator.emulator.reset()
+        self.reservation_db.stop()
+        self.tmp.cleanup()
 
     @patch('docker.DockerClient', new_callable=DockerClientMock)
     @patch('docker.APIClient', new_callable=APIClientMock)
@@ -28,3 +58,256 @@ class TestCase(unittest.TestCase):
         cont_ids = [int(cont.split('_')[-1]) for cont in containers]
         self.assertTrue(all(
             [ident in cont_ids for ident in range(no_of_containers)]))
+
+    @patch('docker.DockerClient', new_callable=DockerClientMock)
+    @patch('docker.APIClient', new_callable=APIClientMock)
+    def test_list_containers_from_inventory(self, fake_api_client, _):
+        emulator.start_image('cloud_android_test_image_name')
+        instances = emulator.list_containers()
+        with patch.object(APIClientMock, 'containers',
+                          side_effect=AssertionError('docker is queried')):
+            self.assertEqual(instances, emulator.list_containers())
+        self.assertTrue(instances)
+
+    @patch('docker.DockerClient', new_callable=DockerClientMock)
+    @patch('docker.APIClient', new_callable=APIClientMock)
+    def test_multi_digit_instance_ids(self, fake_api_client, _):
+        no_of_containers = 12
+        with ThreadPoolExecutor(max_workers=no_of_containers) as executor:
+            idents = list(executor.map(
+                emulator.start_image,
+                no_of_containers*['cloud_android_test_image_name']))
+
+        instances = emulator.list_containers()
+        self.assertEqual(len(set(idents)), no_of_containers)
+        self.assertTrue(all([ident in instances for ident in idents]))
+        self.assertTrue(any([ident >= 10 for ident in idents]))
+
+    @patch('docker.DockerClient', new_callable=DockerClientMock)
+    @patch('docker.APIClient', new_callable=APIClientMock)
+    def test_launch_fast_path(self, fake_api_client, _):
+        emulator.start_image('cloud_android_test_image_name')
+        unexpected = AssertionError('redundant docker call')
+        with patch.object(APIClientMock, 'images', side_effect=unexpected), \
+                patch.object(APIClientMock, 'containers',
+                             side_effect=unexpected), \
+                patch.object(APIClientMock, 'exec_create', create=True,
+                             side_effect=unexpected):
+            self.assertIsNotNone(
+                emulator.start_image('cloud_android_test_image_name'))
+        timings = metrics.snapshot()
+        for stage in ['resolve', 'allocate', 'network', 'create', 'start']:
+            self.assertTrue(
+                timings['launch_{}_seconds'.format(stage)]['count'] >= 2)
+
+    @patch('docker.DockerClient', new_callable=DockerClientMock)
+    @patch('docker.APIClient', new_callable=APIClientMock)
+    def test_stop_in_background(self, fake_api_client, _):
+        ident = emulator.start_image('cloud_android_test_image_name')
+        name = emulator.list_containers()[ident]['childs']
+        emulator.stop_container(ident)
+        self.assertNotIn(ident, emulator.list_containers())
+
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline and name in [
+                cont['Name'][0] for cont in fake_api_client.containers()]:
+            time.sleep(0.1)
+        self.assertNotIn(name, [
+            cont['Name'][0] for cont in fake_api_client.containers()])
+
+    @patch('docker.DockerClient', new_callable=DockerClientMock)
+    @patch('docker.APIClient', new_callable=APIClientMock)
+    def test_failed_start_releases_launch(self, fake_api_client, _):
+        failed = {}
+
+        def start(container):
+            failed.update(fake_api_client.inspect_container(container))
+            raise docker.errors.APIError('start failed')
+
+        with patch.object(APIClientMock, 'start', create=True,
+                          side_effect=start):
+            with self.assertRaises(docker.errors.APIError):
+                emulator.start_image('cloud_android_test_image_name')
+
+        # the half created container is removed
+        with self.assertRaises(docker.errors.NotFound):
+            fake_api_client.inspect_container(failed['Id'])
+        ident = int(failed['Config']['Labels'][LABEL_INSTANCE])
+        net_name = list(failed['NetworkSettings']['Networks'])[0]
+        store = ReservationStore()
+        self.assertNotIn(ident, store.reserved('id'))
+        self.assertNotIn(network_slot(net_name), store.reserved('network'))
+        self.assertNotIn(ident, emulator.list_containers())
+
+    @patch('docker.DockerClient', new_callable=DockerClientMock)
+    @patch('docker.APIClient', new_callable=APIClientMock)
+    def test_instances_lease_pool_networks(self, fake_api_client, _):
+        no_of_containers = 5
+        with ThreadPoolExecutor(max_workers=no_of_containers) as executor:
+            idents = list(executor.map(
+                emulator.start_image,
+                no_of_containers*['cloud_android_test_image_name']))
+
+        instances = emulator.list_containers()
+        net_names = [instances[ident]['net_name'] for ident in idents]
+        self.assertEqual(len(set(net_names)), no_of_containers)
+        self.assertTrue(all([net_name.startswith(NETWORK_POOL_PREFIX)
+                             for net_name in net_names]))
+
+    @patch('docker.APIClient', new_callable=APIClientMock)
+    def test_docker_client_shared(self, _):
+        client = DockerClientMock()
+        with patch('docker.DockerClient', return_value=client) as factory:
+            for _ in range(3):
+                emulator.start_image('cloud_android_test_image_name')
+            emulator.list_images()
+            self.assertIs(docker_client.get_client(), client)
+        self.assertEqual(factory.call_count, 1)
+
+    def test_allocators_sharing_reservations(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'reservations.db')
+            # allocators of two worker processes sharing the database
+            ids = [IdAllocator(store=ReservationStore(path)) for _ in (0, 1)]
+            ports = [PortAllocator(store=ReservationStore(path), **RANGES)
+                     for _ in (0, 1)]
+            idents = [ids[i % 2].acquire() for i in range(6)]
+            triples = [ports[i % 2].acquire() for i in range(6)]
+            self.assertEqual(sorted(idents), list(range(6)))
+            self.assertEqual(len(set(triples)), 6)
+
+            ids[0].release(idents[0])
+            self.assertEqual(ids[1].acquire(), 6)
+            self.assertEqual(ids[0].acquire(), idents[0])
+
+    def test_allocators_changed_on_commit_only(self):
+        class FailingStore(ReservationStore):
+            def reserve(self, kind, pick):
+                pick(set())
+                raise sqlite3.OperationalError('database is locked')
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'reservations.db')
+            ids = IdAllocator(store=FailingStore(path))
+            ports = PortAllocator(store=FailingStore(path), **RANGES)
+            for allocator in (ids, ports):
+                with self.assertRaises(sqlite3.OperationalError):
+                    allocator.acquire()
+                allocator.store = ReservationStore(path)
+            self.assertEqual(ids.acquire(), 0)
+            self.assertEqual(ports.acquire(), (100, 200, 300))
+
+            # slot reserved by another process is skipped, not taken
+            with patch('emulator.reservations.os.getpid', return_value=1):
+                ports.store.reserve('port', lambda reserved: 1)
+            self.assertEqual(ports.acquire(), (102, 202, 302))
+            with patch('emulator.reservations.os.getpid', return_value=1):
+                ports.store.release('port', 1)
+            self.assertEqual(ports.acquire(), (101, 201, 301))
+
+    def test_release_own_reservations_only(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'reservations.db')
+            stores = [ReservationStore(path) for _ in (0, 1)]
+            # reservation of another live process
+            with patch('emulator.reservations.os.getpid', return_value=1):
+                stores[0].reserve('id', lambda reserved: 3)
+            stores[1].release('id', 3)
+            self.assertEqual(stores[1].reserved('id'), {3})
+
+            stores[1].reserve('id', lambda reserved: 4)
+            stores[1].release('id', 4)
+            self.assertEqual(stores[0].reserved('id'), {3})
+
+    def test_network_created_by_another_process(self):
+        class Inventory:
+            created = {}
+
+            def networks(self):
+                return dict(self.created)
+
+            def networks_in_use(self):
+                return set()
+
+            def add_network(self, net_name, net_id):
+                self.created[net_name] = net_id
+
+        conflict = docker.errors.APIError(
+            'conflict', response=unittest.mock.Mock(status_code=409))
+        api = unittest.mock.Mock()
+        api.create_network.side_effect = [conflict, {'Id': 'new'}]
+        api.inspect_network.return_value = {'Id': 'existing'}
+        # the pool of the emulator replenishes in background meanwhile
+        get_api = docker_client.get_api
+        this_thread = threading.current_thread()
+        with tempfile.TemporaryDirectory() as tmp, \
+                patch('emulator.netpool.get_api', side_effect=lambda: (
+                    api if threading.current_thread() is this_thread
+                    else get_api())):
+            pool = NetworkPool(Inventory(), ReservationStore(
+                os.path.join(tmp, 'reservations.db')), size=2)
+            pool.replenish()
+        self.assertEqual(sorted(Inventory.created.values()),
+                         ['existing', 'new'])
+        self.assertTrue(all([call.kwargs['check_duplicate'] for call
+                             in api.create_network.call_args_list]))
+
+    def test_readiness_monitor(self):
+        probes = []
+        ready = []
+        monitor = ReadinessMonitor(
+            lambda info: probes.append(info) or len(probes) > 1,
+            on_ready=lambda info, boot_time: ready.append(boot_time),
+            max_backoff=1)
+        monitor.track(0, {'image_name': 'readiness_test_image'})
+        self.assertTrue(monitor.settle(5))
+        self.assertFalse(monitor.is_ready(0))
+
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline and not ready:
+            time.sleep(0.1)
+        self.assertTrue(monitor.is_ready(0))
+        self.assertEqual(len(probes), 2)
+        self.assertTrue(ready[0] >= 1)
+        self.assertEqual(metrics.snapshot()[
+            'boot_readiness_test_image_seconds']['count'], 1)
+
+        monitor.untrack(0)
+        self.assertFalse(monitor.is_ready(0))
+
+    def test_readiness_host_default(self):
+        # the ports are published on the host, not in the container
+        # network of the node
+        from emulator import constants
+        try:
+            with patch.dict(os.environ, {'HOSTNAME': 'node.test'}):
+                os.environ.pop('READINESS_HOST', None)
+                importlib.reload(constants)
+                self.assertEqual(constants.READINESS_HOST, 'node.test')
+        finally:
+            importlib.reload(constants)
+
+    @patch('docker.DockerClient', new_callable=DockerClientMock)
+    @patch('docker.APIClient', new_callable=APIClientMock)
+    def test_slave_conditional_responses(self, fake_api_client, _):
+        from node import slave
+        client = slave.app.test_client()
+        response = client.get('/instances')
+        etag = response.headers['ETag']
+        self.assertEqual(client.get('/instances', headers={
+            'If-None-Match': etag}).status_code, 304)
+
+        for _ in range(10):
+            emulator.start_image('cloud_android_test_image_name')
+        response = client.get('/instances', headers={
+            'If-None-Match': etag, 'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        instances = json.loads(gzip.decompress(response.get_data()))
+        self.assertEqual(len(instances), len(emulator.list_containers()))
+
+
+RANGES = {'grpc_ports': '100-109',
+          'shell_ports': '200-209',
+          'telnet_ports': '300-309'}
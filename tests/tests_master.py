@@ -4,14 +4,32 @@ import json
 import logging
 import unittest
 import requests
+import threading
 from queue import Empty
-from flask import Flask, jsonify
-from flask_socketio import SocketIO
+from unittest.mock import patch
+from flask import Flask, jsonify, request
+from flask_socketio import SocketIO, emit
 from multiprocessing import Process, Queue
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
 from parameterized import parameterized_class
 
+from node import BREAKER_FAILURES
+from node import MAX_INSTANCES_PER_NODE
 from node.master import RemoteNode
 from node.master import PoolMananger
+from node.jobs import JobQueue
+from node.cache import TtlCache
+from node.state import StatePublisher
+from node.state import etag
+from node.health import NodeAvailState
+from node.placement import PlacementEngine
+from node.capacity import capacity
+from node.admission import admit
+from node.admission import LaunchRejected
+from node.fairshare import FairShareQueue
+from node.leases import LeaseKeeper
+from node.idle import IdleDetector
 
 
 class TestEndlessList(list):
@@ -30,17 +48,93 @@ class TestEndlessList(list):
 
 
 class StubSlaveNode(object):
-    def __init__(self, port=9999):
+    def __init__(self, port=9999, delay=0, images={}, rejected=None):
         self.port = port
+        self.delay = delay
+        self.images = images
+        self.rejected = rejected
         self.queue = Queue()
         self.process = None
         self.app = Flask(__name__)
         self.sio = SocketIO(self.app, async_mode='threading')
+        self.instances = {}
+        self.instances_lock = threading.Lock()
+        self.state = StatePublisher(
+            lambda: {'instances': dict(self.instances),
+                     'images': dict(self.images)},
+            lambda event, data: self.sio.emit(event, data, namespace='/state'))
+
+        @self.sio.on('connect', namespace='/state')
+        def state_connect():
+            emit('snapshot', self.state.snapshot())
+
+        @self.app.route('/state')
+        def state():
+            snapshot = self.state.snapshot(fresh=True)
+            snapshot['host'] = {'cores': 1}
+            return jsonify(snapshot)
+
+        @self.app.route('/stub/instance/<ident>')
+        def add_instance(ident):
+            self.instances[ident] = {'image_name': 'image_name'}
+            self.state.changed()
+            return jsonify({})
+
+        @self.app.route('/stub/ready/<ident>')
+        def ready(ident):
+            self.sio.emit('ready', json.dumps({
+                'ident': int(ident), 'owner': 'user_', 'pair': '',
+                'boot_time': 1.5}), namespace='/state')
+            return jsonify({})
+
+        @self.app.route('/stop')
+        def stop():
+            # teardown is committed, the removal is pushed later
+            ident = request.args['ident']
+
+            def remove():
+                self.instances.pop(ident, None)
+                self.state.changed()
+            threading.Timer(1, remove).start()
+            return jsonify({})
+
+        @self.app.route('/ping')
+        def ping():
+            return jsonify({})
 
         @self.app.route('/sync')
         def sync():
             return jsonify('ok')
 
+        @self.app.route('/instances')
+        def instances():
+            time.sleep(self.delay)
+            return jsonify({'0': {'image_name': 'image_name'}})
+
+        @self.app.route('/launch/job')
+        def launch_job():
+            if self.rejected:
+                return jsonify({'rejected': self.rejected}), 429
+            with self.instances_lock:
+                ident = 3 + len(self.instances)
+                self.instances[str(ident)] = {'image_name': 'image_name'}
+            self.state.changed()
+            return jsonify({'job': f'job{ident}'})
+
+        @self.app.route('/job/<job_id>')
+        def job(job_id):
+            ident = int(job_id[3:])
+            return jsonify({
+                'id': job_id,
+                'state': 'done',
+                'stages': [
+                    {'stage': 'queued', 'at': 0},
+                    {'stage': 'network', 'at': 1, 'network': 'net'},
+                    {'stage': 'started', 'at': 2, 'ident': ident},
+                    {'stage': 'done', 'at': 3}],
+                'result': ident,
+                'error': None})
+
         @self.app.route('/pull')
         def pull():
             for value in self.__get_value():
@@ -135,6 +229,79 @@ class TestCaseRemoteNode(unittest.TestCase):
         for value in self.node.pull('image_name', 'repo_path'):
             self.assertEqual(value, {'Failure': 0})
 
+    def test_launch_job(self):
+        stages = []
+        self.assertTrue(self.slave.start())
+        ident = self.node.start_image(
+            'image_name', progress=lambda stage, **info: stages.append(
+                (stage, info)))
+        self.assertEqual(ident, 3)
+        self.assertEqual(stages, [('network', {'network': 'net'}),
+                                  ('started', {'ident': 3})])
+
+    def test_launch_job_no_slave(self):
+        self.assertIsNone(self.node.start_image('image_name'))
+
+    def test_breaker_stops_calls_till_slave_is_back(self):
+        self.node.breaker.cooldown = 0.5
+        self.assertEqual(str(self.node.avail_state), 'ONLINE')
+        for _ in range(BREAKER_FAILURES):
+            self.assertEqual(self.node.list_containers(), {})
+        self.assertEqual(str(self.node.avail_state), 'OFFLINE')
+        with patch.object(self.node.session, 'get',
+                          side_effect=AssertionError('node is called')):
+            self.assertEqual(self.node.list_containers(), {})
+
+        self.assertTrue(self.slave.start())
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline and \
+                str(self.node.avail_state) != 'ONLINE':
+            time.sleep(0.1)
+        self.assertEqual(str(self.node.avail_state), 'ONLINE')
+        self.assertEqual(self.node.list_containers(),
+                         {'0': {'image_name': 'image_name'}})
+
+    def test_state_pushed_by_slave(self):
+        self.assertTrue(self.slave.start())
+        self.assertEqual(self.node.list_containers(),
+                         {'0': {'image_name': 'image_name'}})
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline and \
+                self.node.replica.get('instances') is None:
+            time.sleep(0.1)
+        self.assertEqual(self.node.replica.get('instances'), {})
+
+        requests.get('http://localhost:9999/stub/instance/7')
+        self.node.replica.expect(
+            'instances', lambda instances: '7' in instances, 10)
+        with patch.object(self.node.session, 'get',
+                          side_effect=AssertionError('node is called')):
+            self.assertEqual(self.node.list_containers(),
+                             {'7': {'image_name': 'image_name'}})
+            self.assertEqual(self.node.state(['images', 'instances']), {
+                'version': 1,
+                'images': {},
+                'instances': {'7': {'image_name': 'image_name'}}})
+        self.assertEqual(self.node.state(['host'])['host'], {'cores': 1})
+
+    def test_stop_not_waiting_for_push(self):
+        self.assertTrue(self.slave.start())
+        self.node.replica.start()
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline and \
+                self.node.replica.get('instances') is None:
+            time.sleep(0.1)
+        requests.get('http://localhost:9999/stub/instance/7')
+        self.node.replica.expect(
+            'instances', lambda instances: '7' in instances, 10)
+        started = time.monotonic()
+        self.node.stop_container(7)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(self.node.list_containers(), {})
+        self.node.replica.expect(
+            'instances', lambda instances: '7' not in instances, 10)
+        self.assertEqual(self.node.list_containers(), {})
+
     def test_pull_nok_slave_disconnect(self):
         latest_value = None
         self.assertTrue(self.slave.start())
@@ -189,6 +356,23 @@ class TestCasePoolMananger(unittest.TestCase):
         for value in self.pool.pull('image_name', 'repo_path'):
             self.assertEqual(value, {'Failure': 0})
 
+    def test_ready_relayed(self):
+        booted = Queue()
+        self.assertTrue(all([slave.start() for slave in self.slaves]))
+        self.pool.on_ready(
+            lambda info, boot_time: booted.put((info['ident'], boot_time)))
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline and any(
+                node.replica.get('instances') is None
+                for node in self.pool.nodes.values()):
+            time.sleep(0.1)
+        for slave in self.slaves:
+            requests.get(f'http://localhost:{slave.port}/stub/ready/3')
+        events = {booted.get(timeout=10) for _ in self.slaves}
+        self.assertEqual(events, {
+            (PoolMananger.NODE_INDEX_BASE * index + 3, 1.5)
+            for index in self.pool.nodes})
+
     def test_pull_nok_slave_disconnect(self):
         latest_value = None
         self.assertTrue(all([slave.start() for slave in self.slaves]))
@@ -201,3 +385,656 @@ class TestCasePoolMananger(unittest.TestCase):
                 [slave.set_value(self.reported_values.__next__())
                     for slave in self.slaves]
         self.assertEqual(latest_value, {'Failure': 0})
+
+
+class TestCasePoolFanOut(unittest.TestCase):
+    def setUp(self):
+        ports = range(9999, 9995, -1)
+        self.pool = PoolMananger([f'http://localhost:{x}' for x in ports])
+        self.pool.nodes = {k: v for k, v in list(self.pool.nodes.items())[1:]}
+        self.pool.fanout_deadline = 3
+        # the last slave is too slow to make the deadline
+        self.slaves = [StubSlaveNode(x, delay=1) for x in ports[:-1]] + [
+            StubSlaveNode(ports[-1], delay=10)]
+
+    def tearDown(self):
+        [slave.stop() for slave in self.slaves]
+
+    def test_list_containers_at_once(self):
+        self.assertTrue(all([slave.start() for slave in self.slaves]))
+        started = time.monotonic()
+        instances = self.pool.list_containers()
+        self.assertLess(time.monotonic() - started, 3 + 1)
+        self.assertEqual(sorted(instances.keys()), [
+            PoolMananger.NODE_INDEX_BASE * k for k in (1, 2, 3)])
+        self.assertEqual([str(node.avail_state)
+                          for node in self.pool.nodes.values()],
+                         ['ONLINE', 'ONLINE', 'ONLINE', 'DEGRADED'])
+
+
+class TestCasePoolHeartbeat(unittest.TestCase):
+    def setUp(self):
+        self.pool = PoolMananger(['http://localhost:9999',
+                                  'http://localhost:9998'])
+        self.pool.nodes = {k: v for k, v in list(self.pool.nodes.items())[1:]}
+        self.pool.heartbeat_interval = 0.1
+        self.slaves = [StubSlaveNode(9999), StubSlaveNode(9998)]
+
+    def tearDown(self):
+        [slave.stop() for slave in self.slaves]
+
+    def wait_state(self, node, state):
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline and str(node.avail_state) != state:
+            time.sleep(0.1)
+        self.assertEqual(str(node.avail_state), state)
+
+    def test_offline_node_not_called_till_back(self):
+        self.assertTrue(self.slaves[0].start())
+        nodes = self.pool.__nodes_info__()
+        self.assertEqual(nodes[0]['failures'], 0)
+        self.assertGreater(nodes[1]['failures'], 0)
+        self.assertIsNotNone(nodes[0]['latency_p95'])
+        self.assertIsNone(nodes[1]['latency_p95'])
+        self.wait_state(self.pool.nodes[2], 'OFFLINE')
+        self.assertEqual(str(self.pool.nodes[1].avail_state), 'ONLINE')
+
+        with patch.object(self.pool.nodes[2].session, 'get',
+                          side_effect=AssertionError('node is called')):
+            self.assertEqual(list(self.pool.list_containers().keys()),
+                             [PoolMananger.NODE_INDEX_BASE])
+
+        self.assertTrue(self.slaves[1].start())
+        self.wait_state(self.pool.nodes[2], 'ONLINE')
+
+    def test_slow_node_degraded(self):
+        self.assertTrue(self.slaves[0].start())
+        self.pool.nodes[1].health.degraded_latency = 0
+        self.pool.start_heartbeat()
+        self.wait_state(self.pool.nodes[1], 'DEGRADED')
+
+
+class TestCasePoolReservations(unittest.TestCase):
+    def setUp(self):
+        ports = range(9999, 9996, -1)
+        self.pool = PoolMananger([f'http://localhost:{x}' for x in ports])
+        self.pool.nodes = {k: v for k, v in list(self.pool.nodes.items())[1:]}
+        self.slaves = [StubSlaveNode(x, images={'image_name': 'sha'})
+                       for x in ports]
+
+    def tearDown(self):
+        [slave.stop() for slave in self.slaves]
+
+    def test_parallel_launches_bounded(self):
+        self.assertTrue(all([slave.start() for slave in self.slaves]))
+        with ThreadPoolExecutor(max_workers=50) as executor:
+            idents = list(executor.map(
+                lambda _: self.pool.start_image('image_name'), range(50)))
+        launched = [ident for ident in idents if ident is not None]
+        self.assertTrue(launched)
+        for node in self.pool.nodes.values():
+            self.assertLessEqual(
+                len(node.state(['instances'])['instances']),
+                MAX_INSTANCES_PER_NODE)
+        # slots of the launches in flight may be counted twice during
+        # the burst, the nodes are filled up once the launches are done
+        while True:
+            ident = self.pool.start_image('image_name')
+            if ident is None:
+                break
+            launched.append(ident)
+        self.assertEqual(len(launched), len(self.slaves) *
+                         MAX_INSTANCES_PER_NODE)
+        self.assertEqual(len(set(launched)), len(launched))
+        for node in self.pool.nodes.values():
+            self.assertEqual(len(node.state(['instances'])['instances']),
+                             MAX_INSTANCES_PER_NODE)
+
+    def test_failed_launch_releases_slot(self):
+        self.assertTrue(self.slaves[0].start())
+        self.pool.nodes = {1: self.pool.nodes[1]}
+        with patch.object(self.pool.nodes[1], 'start_image',
+                          return_value=None):
+            for _ in range(MAX_INSTANCES_PER_NODE + 1):
+                self.assertIsNone(self.pool.start_image('image_name'))
+        self.assertIsNotNone(self.pool.start_image('image_name'))
+
+
+class TestCaseAdmission(unittest.TestCase):
+    def setUp(self):
+        self.pool = PoolMananger(['http://localhost:9999',
+                                  'http://localhost:9998'])
+        self.pool.nodes = {k: v for k, v in list(self.pool.nodes.items())[1:]}
+        self.slaves = [
+            StubSlaveNode(9999, images={'image_name': 'sha'},
+                          rejected='load 3.00 per core above 1.5'),
+            StubSlaveNode(9998, images={'image_name': 'sha'})]
+
+    def tearDown(self):
+        [slave.stop() for slave in self.slaves]
+
+    def test_admit(self):
+        host = {'cores': 2, 'loadavg': [1, 1, 1], 'memory_available': 2**33,
+                'pressure': {'cpu': 5.0, 'memory': 0.0, 'io': 0.0}}
+        admit('cloud_android_x', host)
+        for changed, reason in (
+                ({'loadavg': [4, 1, 1]}, 'load 2.00 per core above 1.5'),
+                ({'pressure': {'io': 30.0}}, 'io pressure 30.0% above 20.0%'),
+                ({'memory_available': 2**30},
+                 'memory available 1024MiB below 4096MiB')):
+            with self.assertRaises(LaunchRejected) as e:
+                admit('cloud_android_x', {**host, **changed})
+            self.assertEqual(str(e.exception), reason)
+
+    def test_rejected_launch_retried_on_next_node(self):
+        self.assertTrue(all([slave.start() for slave in self.slaves]))
+        for _ in range(3):
+            stages = []
+            ident = self.pool.start_image(
+                'image_name', progress=lambda stage, **info: stages.append(
+                    (stage, info)))
+            self.assertEqual(ident // PoolMananger.NODE_INDEX_BASE, 2)
+            self.assertEqual([info['node'] for stage, info in stages
+                              if stage == 'placed'][-1], 2)
+
+    def test_all_nodes_reject(self):
+        self.slaves[1].rejected = 'io pressure 30.0% above 20.0%'
+        self.assertTrue(all([slave.start() for slave in self.slaves]))
+        stages = []
+        self.assertIsNone(self.pool.start_image(
+            'image_name', progress=lambda stage, **info: stages.append(
+                (stage, info.get('node')))))
+        self.assertEqual(sorted(node for stage, node in stages
+                                if stage == 'rejected'), [1, 2])
+
+
+class TestCasePlacement(unittest.TestCase):
+    class Node:
+        avail_state = NodeAvailState.ONLINE
+
+    def setUp(self):
+        self.nodes = {k: self.Node() for k in range(4)}
+
+        def state(instances, memory_available, load, kvm=True):
+            return {
+                'images': {'image_name': 'sha'},
+                'instances': {str(i): {} for i in range(instances)},
+                'host': {'cores': 8, 'memory_total': 100,
+                         'memory_available': memory_available,
+                         'loadavg': [load, 0, 0], 'kvm': kvm}}
+        self.states = {
+            0: state(0, 100, 0),  # master is used if no slave is left
+            1: state(1, 80, 2),
+            2: state(2, 40, 6),
+            3: state(0, 100, 0, kvm=False)}
+
+    def test_policies(self):
+        for policy, selected in (('spread', 1), ('binpack', 2)):
+            decision = PlacementEngine(policy).select(
+                self.nodes, self.states, 'image_name')
+            self.assertEqual(decision['node'], selected)
+            self.assertEqual(set(decision['scores']), {0, 1, 2, 3})
+        decision = PlacementEngine('weighted', {'memory': -1}).select(
+            self.nodes, self.states, 'image_name')
+        self.assertEqual(decision['node'], 2)
+
+    def test_rejected_nodes(self):
+        self.nodes[1].avail_state = NodeAvailState.OFFLINE
+        self.states[2]['images'] = {}
+        del self.states[3]
+        decision = PlacementEngine().select(
+            self.nodes, self.states, 'image_name')
+        self.assertEqual(decision['node'], 0)
+        self.assertEqual(decision['rejected'], {
+            1: 'node is OFFLINE',
+            2: 'no image image_name',
+            3: 'no state'})
+        self.nodes[0].avail_state = NodeAvailState.OFFLINE
+        decision = PlacementEngine().select(
+            self.nodes, self.states, 'image_name')
+        self.assertIsNone(decision['node'])
+
+    def test_degraded_nodes(self):
+        # the degraded node is ranked below the online ones
+        self.nodes[1].avail_state = NodeAvailState.DEGRADED
+        decision = PlacementEngine().select(
+            self.nodes, self.states, 'image_name')
+        self.assertEqual(decision['node'], 2)
+        self.assertEqual(decision['rejected'], {})
+        # and is used if it is the only candidate
+        for index in (0, 2, 3):
+            self.nodes[index].avail_state = NodeAvailState.OFFLINE
+        decision = PlacementEngine().select(
+            self.nodes, self.states, 'image_name')
+        self.assertEqual(decision['node'], 1)
+
+    def test_capacity(self):
+        host = {'cores': 17, 'memory_total': 64 * 2**30, 'kvm': True}
+        self.assertEqual(capacity(host), {
+            'cloud_android': 4, 'cloud_cluster': 8, 'default': 4})
+        self.assertEqual(capacity({**host, 'kvm': False}), {
+            'cloud_android': 1, 'cloud_cluster': 2, 'default': 1})
+
+        # the small node is full of android instances, the big one not
+        self.states[1]['capacity'] = {'cloud_android': 1, 'default': 1}
+        self.states[2]['capacity'] = {'cloud_android': 16, 'default': 16}
+        for state in self.states.values():
+            state['images'] = {'cloud_android_x': 'sha'}
+        del self.states[0]
+        del self.states[3]
+        decision = PlacementEngine().select(
+            self.nodes, self.states, 'cloud_android_x', {1: 0, 2: 13})
+        self.assertEqual(decision['node'], 2)
+        self.assertEqual(decision['rejected'][1],
+                         'no capacity left for cloud_android_x')
+        decision = PlacementEngine().select(
+            self.nodes, self.states, 'cloud_android_x', {2: 14})
+        self.assertIsNone(decision['node'])
+
+
+class TestCaseFairShareQueue(unittest.TestCase):
+    def setUp(self):
+        self.queue = FairShareQueue(classes=['interactive', 'ci'], retry=10)
+        self.free = 0
+        self.served = []
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def launch(self, owner, priority='interactive'):
+        def attempt():
+            with self.lock:
+                if not self.free:
+                    return None
+                self.free -= 1
+                self.served.append(owner)
+                return len(self.served)
+
+        return self.queue.submit(
+            owner, priority, attempt,
+            lambda stage, **info: self.stages.setdefault(
+                owner, []).append((stage, info)))
+
+    def wait_for(self, predicate):
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline and not predicate():
+            time.sleep(0.05)
+        self.assertTrue(predicate())
+
+    def test_turns(self):
+        launches = []
+        for count, (owner, priority) in enumerate((
+                ('alice', 'interactive'), ('carol', 'ci'),
+                ('alice', 'interactive'), ('alice', 'interactive'),
+                ('bob', 'interactive')), start=1):
+            launches.append(self.launch(owner, priority))
+            self.wait_for(lambda: len(self.queue.waiting()) == count)
+        self.assertEqual([owner for owner, _ in self.queue.waiting()],
+                         ['alice', 'bob', 'alice', 'alice', 'carol'])
+        self.wait_for(lambda: self.stages.get('bob', [None])[-1] ==
+                      ('waiting', {'position': 2, 'eta': None}))
+
+        for served in range(1, len(launches) + 1):
+            with self.lock:
+                self.free += 1
+            self.queue.freed()
+            self.wait_for(lambda: len(self.served) == served)
+        self.assertEqual([launch.result(5) for launch in launches],
+                         [1, 5, 3, 4, 2])
+        self.assertEqual(self.served,
+                         ['alice', 'bob', 'alice', 'alice', 'carol'])
+        self.assertEqual(self.stages['carol'][-1][1]['position'], 1)
+        self.assertIsNotNone(self.stages['carol'][-1][1]['eta'])
+
+    def test_direct_launch_and_full_queue(self):
+        self.assertEqual(
+            self.queue.submit('alice', 'ci', lambda: 1).result(5), 1)
+        self.queue.size = 1
+        launch = self.launch('alice')
+        self.wait_for(lambda: len(self.queue.waiting()) == 1)
+        self.assertIsNone(
+            self.queue.submit('bob', 'ci', lambda: None).result(5))
+        with self.lock:
+            self.free = 1
+        self.queue.freed()
+        self.assertEqual(launch.result(5), 1)
+        self.assertEqual(self.served, ['alice'])
+
+    def test_waiting_launches_hold_no_threads(self):
+        self.queue.timeout = 1
+        threads = threading.active_count()
+        launches = [self.launch('user{}'.format(n)) for n in range(20)]
+        self.wait_for(lambda: len(self.queue.waiting()) == 20)
+        self.assertTrue(threading.active_count() <= threads + 2)
+
+        # the launches waited too long
+        self.assertEqual([launch.result(5) for launch in launches],
+                         20 * [None])
+        self.assertEqual(self.queue.waiting(), [])
+
+
+class StubNode(object):
+    ''' Node answering the fan-out from memory, late by delay seconds '''
+    def __init__(self, instances):
+        self.node_url = 'stub'
+        self.avail_state = NodeAvailState.ONLINE
+        self.instances = instances
+        self.delay = 0
+
+    def list_containers(self):
+        time.sleep(self.delay)
+        return {k: dict(v) for k, v in self.instances.items()}
+
+
+def stub_pool(nodes):
+    pool = PoolMananger([])
+    pool.nodes = nodes
+    pool.fanout_deadline = 0.5
+    pool.heartbeat_interval = 3600
+    return pool
+
+
+class TestCaseLeaseKeeper(unittest.TestCase):
+    def setUp(self):
+        self.instances = {1: {'owner': 'alice_'}, 2: {'owner': 'bob_'}}
+        self.stopped = []
+        self.warned = []
+        self.leases = LeaseKeeper(
+            lambda: dict(self.instances),
+            lambda ident, inst: self.stopped.append(ident),
+            on_warning=lambda ident, inst, lease: self.warned.append(ident),
+            ttl=10, warning=5)
+
+    def test_expiry(self):
+        self.leases.grant(1, 'alice')
+        self.leases.reap()
+        self.assertEqual(self.leases.get(1)['owner'], 'alice')
+        # found without lease
+        self.assertEqual(self.leases.get(2)['owner'], 'bob_')
+        self.assertEqual((self.stopped, self.warned), ([], []))
+
+        now = time.time()
+        with patch('time.time', return_value=now + 6):
+            self.leases.reap()
+            self.leases.reap()
+        self.assertEqual((self.stopped, sorted(self.warned)), ([], [1, 2]))
+
+        with patch('time.time', return_value=now + 6):
+            self.leases.extend(1)
+        with patch('time.time', return_value=now + 11):
+            self.leases.reap()
+        self.assertEqual(self.stopped, [2])
+        self.assertIsNone(self.leases.get(2))
+
+        del self.instances[1]
+        self.leases.reap()
+        self.assertIsNone(self.leases.get(1))
+
+    def test_extend(self):
+        self.assertIsNone(self.leases.extend(1))
+        now = time.time()
+        with patch('time.time', return_value=now):
+            self.leases.grant(1, 'alice')
+            self.assertEqual(self.leases.extend(1, 3)['expires_at'], now + 10)
+        with patch('time.time', return_value=now + 4):
+            self.assertEqual(self.leases.extend(1, 3)['expires_at'], now + 13)
+
+    def test_shorten(self):
+        self.leases.grant(1, 'alice')
+        self.leases.reap()
+        now = time.time()
+        with patch('time.time', return_value=now):
+            self.assertEqual(self.leases.shorten(1, 5)['expires_at'], now + 5)
+            self.leases.reap()
+        self.assertEqual(self.warned, [1])
+        with patch('time.time', return_value=now + 5):
+            self.leases.reap()
+        self.assertEqual(self.stopped, [1])
+
+    def test_node_missing_fan_out_round(self):
+        nodes = {k: StubNode({'1': {'image_name': 'image_name'}})
+                 for k in (1, 2)}
+        pool = stub_pool(nodes)
+        leases = LeaseKeeper(
+            pool.list_containers,
+            lambda ident, inst: self.stopped.append(ident),
+            ttl=10, warning=5, reported=pool.reported)
+        now = time.time()
+        with patch('time.time', return_value=now):
+            leases.reap()
+        self.assertEqual(leases.get(2001)['expires_at'], now + 10)
+
+        # node 2 is late, its instance keeps the lease
+        nodes[2].delay = 1
+        pool.invalidate()
+        with patch('time.time', return_value=now + 6):
+            leases.reap()
+        self.assertEqual(leases.get(2001)['expires_at'], now + 10)
+
+        nodes[2].delay = 0
+        pool.invalidate()
+        with patch('time.time', return_value=now + 11):
+            leases.reap()
+        self.assertEqual(sorted(self.stopped), [1001, 2001])
+
+
+class TestCaseIdleDetector(unittest.TestCase):
+    def test_idle_and_active(self):
+        instances = {k: {'link': f'http://host/instance/{k}'}
+                     for k in (1, 2, 3)}
+        stats = {1: {'upstream_cx_total': 1}, 2: {'upstream_cx_total': 1}}
+        events = []
+        detector = IdleDetector(
+            lambda: instances, lambda: stats,
+            lambda ident, inst: events.append(('idle', ident)),
+            lambda ident, inst: events.append(('active', ident)),
+            timeout=10)
+
+        now = time.monotonic()
+        with patch('time.monotonic', return_value=now):
+            detector.check()
+        stats[1] = {'upstream_cx_total': 2}
+        with patch('time.monotonic', return_value=now + 5):
+            detector.check()
+        with patch('time.monotonic', return_value=now + 10):
+            detector.check()
+            detector.check()
+            self.assertEqual(detector.idle(), {2: 10})
+        # not routed instance 3 is not judged
+        self.assertEqual(events, [('idle', 2)])
+
+        stats[2] = {'upstream_cx_total': 2}
+        with patch('time.monotonic', return_value=now + 15):
+            detector.check()
+            self.assertEqual(detector.idle(), {1: 10})
+        self.assertEqual(events, [('idle', 2), ('idle', 1), ('active', 2)])
+
+    def test_cluster_not_judged(self):
+        # cluster is routed by envoy but used by its direct link
+        instances = {1: {'link': 'http://host:8554'}}
+        stats = {1: {'upstream_cx_total': 1}}
+        events = []
+        detector = IdleDetector(
+            lambda: instances, lambda: stats,
+            lambda ident, inst: events.append(('idle', ident)),
+            timeout=10)
+
+        now = time.monotonic()
+        for delay in (0, 10, 100):
+            with patch('time.monotonic', return_value=now + delay):
+                detector.check()
+        self.assertEqual(detector.idle(), {})
+        self.assertEqual(events, [])
+
+    def test_node_missing_fan_out_round(self):
+        nodes = {k: StubNode({'1': {'image_name': 'cloud_android_x'}})
+                 for k in (1, 2)}
+        pool = stub_pool(nodes)
+        stats = {1001: {'upstream_cx_total': 1},
+                 2001: {'upstream_cx_total': 1}}
+        events = []
+        detector = IdleDetector(
+            pool.list_containers, lambda: stats,
+            lambda ident, inst: events.append(('idle', ident)),
+            timeout=10, reported=pool.reported)
+
+        now = time.monotonic()
+        with patch('time.monotonic', return_value=now):
+            detector.check()
+        # node 2 is late, the idle timer of its instance keeps running
+        nodes[2].delay = 1
+        pool.invalidate()
+        with patch('time.monotonic', return_value=now + 5):
+            detector.check()
+        nodes[2].delay = 0
+        pool.invalidate()
+        with patch('time.monotonic', return_value=now + 10):
+            detector.check()
+        self.assertEqual(sorted(events), [('idle', 1001), ('idle', 2001)])
+
+
+class TestCaseStatePublisher(unittest.TestCase):
+    def test_fresh_snapshot_loaded_on_change_only(self):
+        loads = []
+        publisher = StatePublisher(
+            lambda: loads.append(1) or {'instances': {'0': len(loads)},
+                                        'images': {}},
+            lambda event, data: None, interval=60)
+        publisher.snapshot(fresh=True)
+        publisher.snapshot(fresh=True)
+        self.assertEqual(len(loads), 1)
+
+        publisher.changed()
+        self.assertEqual(publisher.snapshot(fresh=True)['instances'],
+                         {'0': 2})
+        publisher.snapshot(fresh=True)
+        self.assertEqual(len(loads), 2)
+
+    def test_concurrent_publishes(self):
+        loads = []
+        deltas = []
+
+        def load():
+            loads.append(1)
+            instances = {'0': len(loads)}
+            if len(loads) == 1:
+                time.sleep(0.5)  # the first load is slow
+            return {'instances': instances, 'images': {}}
+
+        publisher = StatePublisher(
+            load, lambda event, data: deltas.append(data), interval=60)
+        slow = threading.Thread(target=publisher.publish)
+        slow.start()
+        time.sleep(0.1)
+        publisher.publish()
+        slow.join()
+        self.assertEqual(publisher.snapshot()['instances'], {'0': 2})
+        self.assertEqual([d['version'] for d in deltas], [1, 2])
+        self.assertEqual(deltas[-1]['instances']['set'], {'0': 2})
+
+
+class TestCaseStateTag(unittest.TestCase):
+    def test_tag_after_restart(self):
+        instances = {'3': {'image_name': 'image_name'}}
+        publisher = StatePublisher(
+            lambda: {'instances': dict(instances), 'images': {}},
+            lambda event, data: None)
+        before = publisher.snapshot()
+        tag = etag(before['instances'])
+
+        # restarted node starts counting versions from scratch
+        del instances['3']
+        publisher = StatePublisher(
+            lambda: {'instances': dict(instances), 'images': {}},
+            lambda event, data: None)
+        after = publisher.snapshot()
+        self.assertEqual(after['version'], before['version'])
+        self.assertNotEqual(etag(after['instances']), tag)
+
+        # same content is tagged the same in every worker
+        self.assertEqual(etag({'b': 1, 'a': {}}), etag({'a': {}, 'b': 1}))
+
+
+class TestCaseTtlCache(unittest.TestCase):
+    def test_coalesced_queries(self):
+        loads = []
+
+        def load():
+            loads.append(1)
+            time.sleep(0.5)
+            return {'instances': len(loads)}
+
+        cache = TtlCache(ttl=10)
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            results = list(executor.map(
+                lambda _: cache.get('instances', load), range(10)))
+        self.assertEqual(results, 10 * [{'instances': 1}])
+        self.assertEqual(len(loads), 1)
+
+        results[0]['instances'] = 0
+        self.assertEqual(cache.get('instances', load), {'instances': 1})
+        self.assertEqual(cache.stats(),
+                         {'hits': 1, 'misses': 1, 'coalesced': 9})
+
+    def test_invalidate(self):
+        cache = TtlCache(ttl=10)
+        self.assertEqual(cache.get('instances', lambda: 1), 1)
+        cache.invalidate()
+        self.assertEqual(cache.get('instances', lambda: 2), 2)
+
+        # the load started before invalidation is not stored
+        cache.invalidate()
+
+        def load():
+            cache.invalidate()
+            return 3
+        self.assertEqual(cache.get('instances', load), 3)
+        self.assertEqual(cache.get('instances', lambda: 4), 4)
+
+
+class TestCaseJobQueue(unittest.TestCase):
+    def test_job_stages(self):
+        events = Queue()
+        jobs = JobQueue(workers=2, on_event=events.put)
+
+        def launch(progress, ident):
+            progress('started', ident=ident)
+            return ident
+
+        job_id = jobs.submit(launch, 5, owner='user')
+        stages = [events.get(timeout=5)['stages'][-1]['stage']
+                  for _ in range(3)]
+        self.assertEqual(stages, ['queued', 'started', 'done'])
+        job = jobs.get(job_id)
+        self.assertEqual(job['result'], 5)
+        self.assertEqual(job['stages'][1]['ident'], 5)
+        self.assertEqual(jobs.pending('user'), 0)
+
+    def test_job_failed(self):
+        jobs = JobQueue(workers=1)
+
+        def launch(progress):
+            raise RuntimeError('no docker')
+
+        job_id = jobs.submit(launch)
+        deadline = time.time() + 5
+        while jobs.get(job_id)['state'] != 'failed' and \
+                time.time() < deadline:
+            time.sleep(0.1)
+        self.assertEqual(jobs.get(job_id)['error'], 'no docker')
+
+    def test_job_finished_by_future(self):
+        jobs = JobQueue(workers=1)
+        future = Future()
+        job_id = jobs.submit(lambda progress: future)
+        # the worker is not held by the job waiting for the future
+        other_id = jobs.submit(lambda progress: jobs.execute(lambda: 2))
+        deadline = time.time() + 5
+        while jobs.get(other_id)['state'] != 'done' and \
+                time.time() < deadline:
+            time.sleep(0.1)
+        self.assertEqual(jobs.get(other_id)['result'], 2)
+        self.assertEqual(jobs.get(job_id)['state'], 'running')
+
+        future.set_result(3)
+        self.assertEqual(jobs.get(job_id)['state'], 'done')
+        self.assertEqual(jobs.get(job_id)['result'], 3)
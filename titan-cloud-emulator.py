@@ -1,12 +1,15 @@
 #!/usr/bin/python3
 
 import os
+import time
 import logging
+import threading
 import argparse
 import emulator
 import ipaddress
 
 from emulator import TITAN_IMAGE_NAME_PATTERN, CLUSTER_IMAGE_NAME_PATTERN
+from emulator import READINESS_TIMEOUT
 from node.master import PoolMananger
 
 # TODO: Once /images and /instaces api calls are implemented
@@ -67,6 +70,9 @@ def list_images(args):
 @clusterwide
 def list_containers(args):
     '''list running containers'''
+    # instances running on this node are probed by this process,
+    # let the probes run once so H column is known
+    emulator.probe_readiness()
     instances = args.iface.list_containers()
     print(' {}  {:5}  {:40} {:40} {:40} {:30} {:30} {:30} {:5}'.format(
         'H', 'ID', 'IMAGE', 'LINK', 'ADB', 'TELNET', 'DEVICES', 'CONTAINTERS',
@@ -81,7 +87,8 @@ def list_containers(args):
             instances[ident]['telnet'][:30],
             instances[ident]['devices'][:30],
             instances[ident]['childs'],
-            ident//100 if vars(args).get('cluster_ext_info') else ''))
+            ident // PoolMananger.NODE_INDEX_BASE
+            if vars(args).get('cluster_ext_info') else ''))
 
 
 @clusterwide
@@ -97,9 +104,38 @@ def start_image(args):
                    for device in attached_devices
                    if str(device['port']) in args.devices]
     prefix = args.prefix + '_' if args.prefix else ''
+    # ready events are followed before the launch, so none is missed
+    booted = ReadyWaiter(args.iface) if args.wait else None
     ident = args.iface.start_image(args.image_name, devices, prefix)
     if ident is None:
         print('Max number of instances reached')
+    elif booted:
+        booted.wait(ident)
+
+
+class ReadyWaiter:
+    '''waits for the ready events the nodes push once instances boot'''
+    def __init__(self, iface):
+        self.started = time.monotonic()
+        self.booted = set()
+        self.cv = threading.Condition()
+        iface.on_ready(self.on_ready)
+
+    def on_ready(self, info, boot_time):
+        with self.cv:
+            self.booted.add(int(info['ident']))
+            self.cv.notify_all()
+
+    def wait(self, ident):
+        '''waits till the instance is booted'''
+        with self.cv:
+            ready = self.cv.wait_for(lambda: int(ident) in self.booted,
+                                     READINESS_TIMEOUT)
+        if ready:
+            print(f'Instance #{ident} is ready in '
+                  f'{time.monotonic() - self.started:.0f}s')
+        else:
+            print(f'Instance #{ident} is not ready in {READINESS_TIMEOUT}s')
 
 
 @clusterwide
@@ -164,18 +200,24 @@ def detach(args):
 
 def nodes(args):
     '''lists cluster nodes'''
-    print(' {:10} {:10} {:40} {:10}'.format(
+    print(' {:10} {:10} {:40} {:10} {:>8} {:>8} {:>8}'.format(
         'NODE#',
         'ROLE',
         'URL',
-        'STATE'))
+        'STATE',
+        'P50 MS',
+        'P95 MS',
+        'FAILED'))
     if FLASK_APP == 'backend':
         for node in args.iface.__nodes_info__():
-            print(' {:<10} {:10} {:40} {:10}'.format(
+            print(' {:<10} {:10} {:40} {:10} {:>8} {:>8} {:>8}'.format(
                 node['id'],
                 node['role'].upper(),
                 node['url'],
-                node['state']))
+                str(node['state']),
+                *['-' if node[p] is None else '{:.0f}'.format(node[p]*1000)
+                  for p in ('latency_p50', 'latency_p95')],
+                node['failures']))
 
 
 def sync(args):
@@ -209,6 +251,9 @@ def add_node_parsers(subparsers, iface=emulator, cluster_ext_info=False):
     start_parser.add_argument(
         '--prefix',
         help='prefix appended to all container names stared for this instance')
+    start_parser.add_argument(
+        '--wait', action='store_true',
+        help='wait till the instance is booted')
     start_parser.set_defaults(
         func=start_image, iface=iface, cluster_ext_info=False)
 